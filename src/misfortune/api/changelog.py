@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from misfortune.api.snapshot import (
+    WheelSnapshot,
+    dump_snapshot,
+    fetch_snapshot,
+    load_snapshot,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator
+    from datetime import timedelta
+
+    from misfortune.api.repo import ChangeLogEntry, Repository
+
+_LOG = logging.getLogger(__name__)
+
+
+class ChangeLogConsumer:
+    # Reads the change log from an offset, which is the repository revision the
+    # consumer has seen last. If the entries after the offset were already trimmed,
+    # the consumer is reset to the compacted snapshot, or to a snapshot of all
+    # wheels if the compacted one is too old as well.
+
+    def __init__(
+        self,
+        repo: Repository,
+        *,
+        offset: int = 0,
+        batch_size: int = 500,
+    ) -> None:
+        self._repo = repo
+        self._batch_size = batch_size
+        self.offset = offset
+
+    async def _restart(self) -> WheelSnapshot:
+        raw = await self._repo.fetch_compacted_changelog()
+        if raw is not None:
+            try:
+                snapshot = load_snapshot(raw)
+            except ValueError as e:
+                _LOG.warning("Ignoring unreadable compacted change log", exc_info=e)
+            else:
+                entries = await self._repo.read_changelog(
+                    after=snapshot.revision,
+                    count=1,
+                )
+                if entries is not None:
+                    return snapshot
+
+        _LOG.info(
+            "Change log was trimmed beyond offset %d, fetching all wheels", self.offset
+        )
+        return await fetch_snapshot(self._repo)
+
+    async def poll(self) -> list[ChangeLogEntry] | WheelSnapshot:
+        # Returns the next entries, or a snapshot replacing everything seen so far
+        entries = await self._repo.read_changelog(
+            after=self.offset,
+            count=self._batch_size,
+        )
+        if entries is None:
+            snapshot = await self._restart()
+            self.offset = snapshot.revision
+            return snapshot
+
+        if entries:
+            self.offset = entries[-1].revision
+
+        return entries
+
+    async def follow(
+        self,
+        *,
+        interval: timedelta,
+    ) -> AsyncIterator[list[ChangeLogEntry] | WheelSnapshot]:
+        while True:
+            batch = await self.poll()
+            if batch:
+                yield batch
+
+            # Full batches mean there is more to read right away
+            if isinstance(batch, WheelSnapshot) or len(batch) < self._batch_size:
+                await asyncio.sleep(interval.total_seconds())
+
+    async def sync(self, snapshot: WheelSnapshot) -> WheelSnapshot:
+        # Applies all entries after the offset to a snapshot at the offset
+        while True:
+            batch = await self.poll()
+            if isinstance(batch, WheelSnapshot):
+                snapshot = batch
+            elif batch:
+                snapshot = snapshot.replay(batch)
+            else:
+                return snapshot
+
+
+class ChangeLogCompactor:
+    # Periodically stores a snapshot of all wheels at a known offset, so consumers
+    # which fell behind the trimmed change log don't need to read all wheels.
+    # Only one instance compacts per interval.
+
+    def __init__(self, repo: Repository, *, interval: timedelta) -> None:
+        self._repo = repo
+        self._interval = interval
+        self._snapshot: WheelSnapshot | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    async def _load(self) -> WheelSnapshot:
+        if snapshot := self._snapshot:
+            return snapshot
+
+        raw = await self._repo.fetch_compacted_changelog()
+        if raw is not None:
+            try:
+                return load_snapshot(raw)
+            except ValueError as e:
+                _LOG.warning("Ignoring unreadable compacted change log", exc_info=e)
+
+        return WheelSnapshot(revision=0, wheels={})
+
+    async def compact(self) -> bool:
+        if not await self._repo.try_lock_compaction(ttl=self._interval):
+            return False
+
+        previous = self._snapshot
+        snapshot = await self._load()
+        consumer = ChangeLogConsumer(self._repo, offset=snapshot.revision)
+        compacted = await consumer.sync(snapshot)
+        self._snapshot = compacted
+        if previous is None or compacted.revision != previous.revision:
+            await self._repo.store_compacted_changelog(dump_snapshot(compacted))
+            _LOG.debug("Compacted change log up to revision %d", compacted.revision)
+
+        return True
+
+    async def _compact_periodically(self) -> None:
+        while True:
+            try:
+                await self.compact()
+            except Exception as e:
+                _LOG.error("Could not compact change log", exc_info=e)
+
+            await asyncio.sleep(self._interval.total_seconds())
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._compact_periodically())
+
+    async def close(self) -> None:
+        if task := self._task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,90 @@
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from misfortune.api.scheduler import Scheduler
+
+if TYPE_CHECKING:
+    import uuid
+    from collections.abc import Awaitable, Callable
+    from datetime import timedelta
+
+
+@dataclass(frozen=True, kw_only=True)
+class HeartbeatStats:
+    connections: int
+    reaped: int
+
+
+@dataclass(kw_only=True)
+class _Connection:
+    last_seen: float
+    ping: Callable[[], Awaitable[None]]
+    reap: Callable[[], Awaitable[None]]
+
+
+class HeartbeatMonitor:
+    # A single scheduler task pings all connections. The next check is scheduled
+    # before pinging, so a ping stuck on a half-open socket doesn't delay the reaping.
+
+    def __init__(self, *, interval: timedelta, timeout: timedelta) -> None:
+        if timeout <= interval:
+            raise ValueError("timeout must be longer than interval")
+
+        self._interval = interval
+        self._timeout = timeout.total_seconds()
+        self._connections: dict[uuid.UUID, _Connection] = {}
+        self._checks = Scheduler(self._check)
+        self.reaped = 0
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def __contains__(self, connection_id: object) -> bool:
+        return connection_id in self._connections
+
+    def add(
+        self,
+        connection_id: uuid.UUID,
+        *,
+        ping: Callable[[], Awaitable[None]],
+        reap: Callable[[], Awaitable[None]],
+    ) -> None:
+        self._connections[connection_id] = _Connection(
+            last_seen=time.monotonic(),
+            ping=ping,
+            reap=reap,
+        )
+        self._checks.schedule(connection_id, self._interval)
+
+    def seen(self, connection_id: uuid.UUID) -> None:
+        if connection := self._connections.get(connection_id):
+            connection.last_seen = time.monotonic()
+
+    def remove(self, connection_id: uuid.UUID) -> None:
+        if self._connections.pop(connection_id, None) is not None:
+            self._checks.cancel(connection_id)
+
+    async def _check(self, connection_id: uuid.UUID) -> None:
+        connection = self._connections.get(connection_id)
+        if connection is None:
+            return
+
+        if time.monotonic() - connection.last_seen >= self._timeout:
+            self.reaped += 1
+            self.remove(connection_id)
+            await connection.reap()
+            return
+
+        self._checks.schedule(connection_id, self._interval)
+        await connection.ping()
+
+    def stats(self) -> HeartbeatStats:
+        return HeartbeatStats(
+            connections=len(self._connections),
+            reaped=self.reaped,
+        )
+
+    async def close(self) -> None:
+        self._connections.clear()
+        await self._checks.close()
@@ -1,30 +1,65 @@
 import asyncio
+import hashlib
+import hmac
 import logging
 import random
 import secrets
+import time
 import uuid
 from contextlib import asynccontextmanager
 from datetime import UTC, datetime, timedelta
-from typing import Annotated, Any
+from typing import TYPE_CHECKING, Annotated, Any
 
+import httpx
 import jwt
 from fastapi import Depends, FastAPI, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.exceptions import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse, Response
+from fastapi.responses import PlainTextResponse, RedirectResponse, Response
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import ValidationError
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+from websockets.asyncio.client import connect as connect_websocket
+from websockets.exceptions import WebSocketException
 
+from misfortune.api.changelog import ChangeLogCompactor
+from misfortune.api.heartbeats import HeartbeatMonitor
 from misfortune.api.model import (
     InternalWheel,
     State,
     WheelCredentials,
+    WheelEncoding,
     WheelLogin,
+    WheelPing,
+    WheelPong,
+    WheelProtocol,
     WheelRegistrationInfo,
+    WheelResyncRequest,
 )
-from misfortune.api.repo import Repository
-from misfortune.config import init_config
-from misfortune.observable import Observable, observable
+from misfortune.api.protocol import (
+    PatchEncoder,
+    full_encoder,
+    serialize,
+    snapshot_encoder,
+    state_codec,
+)
+from misfortune.api.registrations import RegistrationLimitError, RegistrationManager
+from misfortune.api.registry import WheelRegistry
+from misfortune.api.repo import QuotaExceededError, Repository
+from misfortune.api.scheduler import Scheduler
+from misfortune.api.snapshot import SnapshotManager
+from misfortune.api.tokens import VerifiedTokenCache
+from misfortune.config import StateBackend, WheelLoading, init_config
+from misfortune.metrics import CONTENT_TYPE, Histogram, registry
+from misfortune.observable import (
+    Codec,
+    LockMonitoring,
+    Observable,
+    QueuedListener,
+    RedisObservableHub,
+    observable,
+)
+from misfortune.sharding import HashRing
 from misfortune.shared_model import (
     Drink,
     TelegramWheel,
@@ -32,6 +67,15 @@ from misfortune.shared_model import (
     TelegramWheelState,
 )
 
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Iterator
+
+    from starlette.datastructures import Headers
+    from starlette.routing import BaseRoute
+    from starlette.types import ASGIApp, Receive, Scope, Send
+
+    from misfortune.redis_pool import PoolStats
+
 _LOG = logging.getLogger(__name__)
 
 auth_token = HTTPBearer()
@@ -45,30 +89,395 @@ async def _repo(request: Request) -> Repository:
     return request.app.state.repo
 
 
-pending_wheel_clients: dict[uuid.UUID, Observable[uuid.UUID]] = {}
-observable_states: dict[uuid.UUID, Observable[State]] = {}
+observable_states = WheelRegistry()
 
 config = init_config()
 
+registrations = RegistrationManager(
+    max_pending=config.registration.max_pending,
+    max_pending_per_client=config.registration.max_pending_per_client,
+    timeout=config.registration.timeout,
+)
+
+state_hub = (
+    RedisObservableHub(config.repo)
+    if config.state_backend == StateBackend.REDIS
+    else None
+)
+
+token_cache = VerifiedTokenCache(max_size=config.token_cache_size)
+
+heartbeats = HeartbeatMonitor(
+    interval=config.heartbeat.interval,
+    timeout=config.heartbeat.timeout,
+)
+
+shards = HashRing(config.sharding.members) if config.sharding.members else None
+
+if shards is not None:
+    if config.sharding.member not in shards.members:
+        raise ValueError("The sharding member must be one of the sharding members")
+    # Wheels are handed over between members whenever the members change
+    if config.wheel_loading == WheelLoading.EAGER:
+        raise ValueError("Sharding requires lazy wheel loading")
+elif (
+    config.repo.write_behind_interval is not None
+    and config.state_backend == StateBackend.REDIS
+):
+    # Other workers would read wheels without the updates still buffered here
+    raise ValueError("Write-behind requires sharding or the memory state backend")
+
+# Marks requests forwarded to the owner of a wheel, which always handles them itself.
+# The value is derived from the internal token, so only members can set it.
+_FORWARDED_HEADER = "X-Misfortune-Forwarded"
+_FORWARDED_PROOF = hmac.new(
+    config.internal_token.encode(),
+    b"forwarded",
+    hashlib.sha256,
+).hexdigest()
+
+# Headers of forwarded responses which only apply to the connection to the owner.
+# The body is already decoded and its length is set again.
+_HOP_BY_HOP_HEADERS = frozenset(
+    {
+        "connection",
+        "content-encoding",
+        "content-length",
+        "keep-alive",
+        "proxy-authenticate",
+        "proxy-authorization",
+        "te",
+        "trailer",
+        "transfer-encoding",
+        "upgrade",
+    }
+)
+
+_ping_payloads = {
+    encoding: serialize(WheelPing(), encoding) for encoding in WheelEncoding
+}
+
+
+async def _auto_unlock(spin: tuple[uuid.UUID, int]) -> None:
+    wheel_id, version = spin
+    if state := observable_states.get(wheel_id):
+        await _unlock_wheel(state, version=version)
+
+
+unlock_scheduler = Scheduler(_auto_unlock)
+
+lock_monitoring = (
+    LockMonitoring(hold_warning=config.lock_hold_warning)
+    if config.lock_hold_warning is not None
+    else None
+)
+
+_wheel_id_codec = Codec(
+    encode=lambda wheel_id: wheel_id.bytes,
+    decode=lambda raw: uuid.UUID(bytes=raw),
+)
+
+
+def _foreign_owner(wheel_id: uuid.UUID) -> str | None:
+    if shards is None:
+        return None
+
+    owner = shards.owner(wheel_id)
+    return None if owner == config.sharding.member else owner
+
+
+class _ForwardToOwner(Exception):
+    def __init__(self, owner: str) -> None:
+        super().__init__(owner)
+        self.owner = owner
+
+
+def _is_forwarded(headers: Headers) -> bool:
+    proof = headers.get(_FORWARDED_HEADER)
+    return proof is not None and hmac.compare_digest(
+        proof.encode(),
+        _FORWARDED_PROOF.encode(),
+    )
+
+
+async def _route_to_owner(request: Request, wheel_id: uuid.UUID) -> None:
+    if _is_forwarded(request.headers):
+        return
+
+    if owner := _foreign_owner(wheel_id):
+        raise _ForwardToOwner(owner)
+
+
+def _wheel_key(wheel_id: uuid.UUID) -> str:
+    return f"wheel:{wheel_id}"
+
+
+def _registration_key(registration_id: uuid.UUID) -> str:
+    return f"registration:{registration_id}"
+
+
+async def _observe_wheel(wheel: InternalWheel) -> Observable[State]:
+    initial = State.initial(wheel=wheel, code=generate_code())
+    key = _wheel_key(wheel.id)
+    monitor = lock_monitoring.monitor(key) if lock_monitoring else None
+    if state_hub is None:
+        return observable(initial, monitor=monitor)
+
+    state = await state_hub.observable(key, initial, state_codec, monitor=monitor)
+    if (value := state.value).is_locked:
+        # The shared state outlives the process which spun the wheel, and with it
+        # the scheduled unlock, so it is scheduled again by every loader.
+        unlock_scheduler.schedule(
+            (wheel.id, value.version), _spin_duration(value.speed)
+        )
+
+    return state
+
+
+def _release_wheel(wheel_id: uuid.UUID) -> None:
+    if lock_monitoring is not None:
+        lock_monitoring.release(_wheel_key(wheel_id))
+
+
+def _register_wheel(
+    wheel_id: uuid.UUID,
+    state: Observable[State],
+) -> Observable[State]:
+    # The wheel may have been announced by another worker while it was observed, in
+    # which case the hub passed the same instance to its watcher.
+    if existing := observable_states.get(wheel_id):
+        return existing
+
+    observable_states.add(wheel_id, state)
+    return state
+
+
+async def _start_state_hub(hub: RedisObservableHub) -> None:
+    async def __on_created(key: str, state: Observable[State]) -> None:
+        wheel_id = uuid.UUID(key.removeprefix("wheel:"))
+        if wheel_id not in observable_states:
+            observable_states.add(wheel_id, state)
+
+    async def __on_discarded(key: str) -> None:
+        wheel_id = uuid.UUID(key.removeprefix("wheel:"))
+        observable_states.remove(wheel_id)
+        _release_wheel(wheel_id)
+
+    hub.watch(
+        "wheel:",
+        state_codec,
+        on_created=__on_created,
+        on_discarded=__on_discarded,
+        monitoring=lock_monitoring,
+    )
+    await hub.start()
+
 
 @asynccontextmanager
 async def lifespan(fastapi_app: FastAPI):
     repo = Repository(config.repo)
+    snapshots: SnapshotManager | None = None
+    compactor: ChangeLogCompactor | None = None
     try:
         fastapi_app.state.repo = repo
-        wheels = await repo.fetch_wheels()
-        for wheel in wheels:
-            observable_states[wheel.id] = observable(
-                State.initial(wheel=wheel, code=generate_code())
-            )
+        fastapi_app.state.shard_client = httpx.AsyncClient(timeout=10)
+        if state_hub is not None:
+            # Started before loading, so wheels created by other workers meanwhile
+            # aren't missed.
+            await _start_state_hub(state_hub)
+
+        await repo.migrate()
+        if config.wheel_loading == WheelLoading.EAGER:
+            if (snapshot_path := config.snapshot.path) is not None:
+                snapshots = SnapshotManager(
+                    repo,
+                    path=snapshot_path,
+                    interval=config.snapshot.interval,
+                )
+                wheels = await snapshots.load()
+                snapshots.start()
+            else:
+                wheels = await repo.fetch_wheels()
+
+            for wheel in wheels:
+                if wheel.id not in observable_states:
+                    _register_wheel(wheel.id, await _observe_wheel(wheel))
+
+        if (interval := config.repo.changelog_compaction_interval) is not None:
+            compactor = ChangeLogCompactor(repo, interval=interval)
+            compactor.start()
 
         yield
     finally:
+        await unlock_scheduler.close()
+        await heartbeats.close()
+        await registrations.close()
+        if compactor is not None:
+            await compactor.close()
+        if snapshots is not None:
+            await snapshots.close()
         await repo.close()
+        await fastapi_app.state.shard_client.aclose()
+        if state_hub is not None:
+            await state_hub.close()
+
+
+_websockets: dict[uuid.UUID, int] = {}
+
+registry.gauge(
+    "misfortune_loaded_wheels",
+    "Wheel states held by this process",
+    lambda: len(observable_states),
+)
+registry.gauge(
+    "misfortune_pending_registrations",
+    "Displays waiting for their registration to be confirmed",
+    lambda: len(registrations),
+)
+registry.counter(
+    "misfortune_registrations_rejected_total",
+    "Registrations rejected because of the pending limits",
+    lambda: registrations.rejected,
+)
+registry.counter(
+    "misfortune_registrations_expired_total",
+    "Registrations which weren't confirmed in time",
+    lambda: registrations.expired,
+)
+registry.gauge(
+    "misfortune_websockets",
+    "Connected displays per wheel",
+    lambda: (((str(wheel_id),), count) for wheel_id, count in _websockets.items()),
+    label_names=("wheel",),
+)
+registry.counter(
+    "misfortune_websockets_reaped_total",
+    "Websocket connections closed because they missed their heartbeats",
+    lambda: heartbeats.reaped,
+)
+registry.counter(
+    "misfortune_token_cache_hits_total",
+    "Wheel tokens found in the verified token cache",
+    lambda: token_cache.hits,
+)
+registry.counter(
+    "misfortune_token_cache_misses_total",
+    "Wheel tokens which had to be verified",
+    lambda: token_cache.misses,
+)
+
+
+def _redis_pools() -> Iterator[tuple[str, PoolStats]]:
+    # The repository only exists while the app is running
+    if (repo := getattr(app.state, "repo", None)) is not None:
+        yield "repository", repo.pool_stats()
+    if state_hub is not None:
+        yield "state_hub", state_hub.pool_stats()
+
+
+registry.gauge(
+    "misfortune_redis_connections",
+    "Redis connections per client pool and state",
+    lambda: (
+        ((client, state), count)
+        for client, stats in _redis_pools()
+        for state, count in (("in_use", stats.in_use), ("idle", stats.idle))
+    ),
+    label_names=("client", "state"),
+)
+registry.gauge(
+    "misfortune_redis_max_connections",
+    "Connection limit per Redis client pool",
+    lambda: (((client,), stats.max_connections) for client, stats in _redis_pools()),
+    label_names=("client",),
+)
+
+_request_latency = registry.histogram(
+    "misfortune_request_seconds",
+    "HTTP request latency per route",
+    label_names=("method", "route"),
+)
+
+
+class _RequestMetrics:
+    # The histogram of a route is looked up once and kept, so recording a request
+    # doesn't allocate anything.
+
+    def __init__(self, app: ASGIApp) -> None:
+        self._app = app
+        # Routes aren't hashable, so they are told apart by their path
+        self._histograms: dict[str, dict[str, Histogram]] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        try:
+            await self._app(scope, receive, send)
+        finally:
+            # Set by the router once the request was matched to a route
+            if route := scope.get("route"):
+                self._histogram(route, scope["method"]).observe(
+                    time.perf_counter() - start
+                )
+
+    def _histogram(self, route: BaseRoute, method: str) -> Histogram:
+        path: str = getattr(route, "path", "")
+        by_method = self._histograms.get(path)
+        if by_method is None:
+            by_method = self._histograms[path] = {}
+
+        histogram = by_method.get(method)
+        if histogram is None:
+            histogram = _request_latency.labels(method, path)
+            by_method[method] = histogram
+
+        return histogram
 
 
 app = FastAPI(lifespan=lifespan)
 
+app.add_middleware(_RequestMetrics)
+
+
+async def _send_to_member(request: Request, member: str) -> httpx.Response:
+    client: httpx.AsyncClient = request.app.state.shard_client
+    headers = {
+        name: value
+        for name in ("authorization", "content-type")
+        if (value := request.headers.get(name))
+    }
+    headers[_FORWARDED_HEADER] = _FORWARDED_PROOF
+    url = httpx.URL(member).copy_with(
+        path=request.url.path,
+        query=request.url.query.encode("ascii"),
+    )
+    return await client.request(
+        request.method,
+        url,
+        headers=headers,
+        content=await request.body(),
+    )
+
+
+@app.exception_handler(_ForwardToOwner)
+async def _forward_request(request: Request, exc: _ForwardToOwner) -> Response:
+    try:
+        response = await _send_to_member(request, exc.owner)
+    except httpx.HTTPError as e:
+        _LOG.error("Could not forward request to %s", exc.owner, exc_info=e)
+        return Response(status_code=status.HTTP_502_BAD_GATEWAY)
+
+    forwarded = Response(content=response.content, status_code=response.status_code)
+    for name, value in response.headers.multi_items():
+        if name not in _HOP_BY_HOP_HEADERS:
+            forwarded.headers.append(name, value)
+
+    return forwarded
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -81,6 +490,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if config.trusted_proxies:
+    # Behind the ingress, every connection comes from the ingress controller. Added
+    # last, so the other middlewares already see the actual client.
+    app.add_middleware(
+        ProxyHeadersMiddleware,
+        trusted_hosts=list(config.trusted_proxies),
+    )
+
 
 @app.get("/", response_class=RedirectResponse)
 async def redirect_to_docs() -> RedirectResponse:
@@ -92,13 +509,110 @@ async def liveness_probe() -> dict[str, Any]:
     return {"status": "ok"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
+_hydrations: dict[uuid.UUID, asyncio.Task[Observable[State] | None]] = {}
+
+
+async def _hydrate_wheel(
+    repo: Repository,
+    wheel_id: uuid.UUID,
+) -> Observable[State] | None:
+    wheel = await repo.find_wheel(wheel_id)
+    if wheel is None:
+        return None
+
+    state = await _observe_wheel(wheel)
+    if (registered := _register_wheel(wheel_id, state)) is not state:
+        return registered
+
+    # The wheel is about to be used, so it doesn't make room for itself
+    observable_states.pin(wheel_id)
+    try:
+        _evict_idle_wheels()
+    finally:
+        observable_states.unpin(wheel_id)
+
+    return state
+
+
+def _evict_idle_wheels() -> None:
+    if config.wheel_loading == WheelLoading.EAGER:
+        return
+
+    for wheel_id in observable_states.evict_idle(config.max_loaded_wheels):
+        _release_wheel(wheel_id)
+        if state_hub is not None:
+            state_hub.release(_wheel_key(wheel_id))
+
+
+async def _get_wheel(
+    repo: Repository,
+    wheel_id: uuid.UUID,
+) -> Observable[State] | None:
+    while True:
+        if state := observable_states.get(wheel_id):
+            observable_states.touch(wheel_id)
+            return state
+
+        if config.wheel_loading == WheelLoading.EAGER:
+            return None
+
+        task = _hydrations.get(wheel_id)
+        if task is None:
+            task = asyncio.create_task(_hydrate_wheel(repo, wheel_id))
+            _hydrations[wheel_id] = task
+            task.add_done_callback(lambda _: _hydrations.pop(wheel_id, None))
+
+        # Shielded because concurrent requests for the same wheel share the task.
+        # Other tasks ran since it finished, which may have evicted the wheel again,
+        # so it is looked up once more.
+        if await asyncio.shield(task) is None:
+            return None
+
+
+@asynccontextmanager
+async def _use_wheel(
+    repo: Repository,
+    wheel_id: uuid.UUID,
+) -> AsyncIterator[Observable[State] | None]:
+    state = await _get_wheel(repo, wheel_id)
+    if state is None:
+        yield None
+        return
+
+    # Pinned before anything else runs, so it isn't evicted while in use
+    observable_states.pin(wheel_id)
+    try:
+        yield state
+    finally:
+        observable_states.unpin(wheel_id)
+
+
+async def _get_owned_wheels(
+    repo: Repository,
+    user_id: int,
+) -> list[tuple[uuid.UUID, Observable[State]]]:
+    if config.wheel_loading == WheelLoading.EAGER:
+        return observable_states.owned_by(user_id)
+
+    result = []
+    for wheel_id in await repo.fetch_owned_wheel_ids(user_id):
+        if state := await _get_wheel(repo, wheel_id):
+            result.append((wheel_id, state))
+
+    return result
+
+
 def _verify_access(
+    state: Observable[State] | None,
     *,
     user: int,
-    wheel: uuid.UUID,
     require_owner: bool = False,
 ) -> Observable[State]:
-    state = observable_states.get(wheel)
     if state is None:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
 
@@ -111,14 +625,35 @@ def _verify_access(
     return state
 
 
+async def _forget_wheel(wheel_id: uuid.UUID) -> None:
+    observable_states.remove(wheel_id)
+    _release_wheel(wheel_id)
+    if state_hub is not None:
+        await state_hub.discard(_wheel_key(wheel_id))
+
+
 @app.get("/user/{user_id}/wheel")
 async def list_wheels(
     user_id: int,
     token: Annotated[HTTPAuthorizationCredentials, Depends(auth_token)],
+    repo: Annotated[Repository, Depends(_repo)],
 ) -> TelegramWheels:
     if token.credentials != config.internal_token:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
 
+    if shards is not None:
+        # Reading the states would load the wheels of other members into this one
+        return TelegramWheels(
+            wheels=[
+                TelegramWheel(
+                    id=wheel.id,
+                    name=wheel.name,
+                    is_owned=wheel.owner == user_id,
+                )
+                for wheel in await repo.fetch_owned_wheels(user_id)
+            ],
+        )
+
     return TelegramWheels(
         wheels=[
             TelegramWheel(
@@ -126,7 +661,7 @@ async def list_wheels(
                 name=state.value.wheel_name,
                 is_owned=state.value.owner == user_id,
             )
-            for wheel_id, state in observable_states.items()
+            for wheel_id, state in await _get_owned_wheels(repo, user_id)
             if state.value.is_accessible(user_id)
         ],
     )
@@ -145,20 +680,22 @@ async def create_wheel(
     if token.credentials != config.internal_token:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
 
-    owned_wheels = sum(
-        1 for state in observable_states.values() if state.value.owner == user_id
-    )
-    if owned_wheels >= config.max_user_wheels:
-        raise HTTPException(status.HTTP_402_PAYMENT_REQUIRED)
-
     wheel = InternalWheel.create(
         owner=user_id,
         name=name,
     )
-    await repo.create_wheel(wheel)
-    observable_states[wheel.id] = observable(
-        State.initial(wheel=wheel, code=generate_code())
-    )
+    # The quota is checked by the repository, because neither lazily loaded wheels
+    # nor the wheels of other workers are complete in memory.
+    try:
+        await repo.create_wheel(wheel, max_owned=config.max_user_wheels)
+    except QuotaExceededError:
+        raise HTTPException(status.HTTP_402_PAYMENT_REQUIRED)
+
+    # Wheels of other members are loaded by their owner once they are accessed
+    if _foreign_owner(wheel.id) is None:
+        _register_wheel(wheel.id, await _observe_wheel(wheel))
+        _evict_idle_wheels()
+
     return TelegramWheel(
         id=wheel.id,
         name=wheel.name,
@@ -166,27 +703,34 @@ async def create_wheel(
     )
 
 
-@app.get("/user/{user_id}/wheel/{wheel_id}")
+@app.get(
+    "/user/{user_id}/wheel/{wheel_id}",
+    dependencies=[Depends(_route_to_owner)],
+)
 async def get_wheel_state(
     user_id: int,
     wheel_id: uuid.UUID,
     token: Annotated[HTTPAuthorizationCredentials, Depends(auth_token)],
+    repo: Annotated[Repository, Depends(_repo)],
 ) -> TelegramWheelState:
     if token.credentials != config.internal_token:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
 
-    state = _verify_access(user=user_id, wheel=wheel_id).value
+    state = _verify_access(await _get_wheel(repo, wheel_id), user=user_id).value
     return TelegramWheelState(
         wheel=TelegramWheel(
             name=state.wheel_name,
             id=wheel_id,
             is_owned=state.owner == user_id,
         ),
-        drinks=state.drinks,
+        drinks=list(state.drinks),
     )
 
 
-@app.patch("/user/{user_id}/wheel/{wheel_id}/name")
+@app.patch(
+    "/user/{user_id}/wheel/{wheel_id}/name",
+    dependencies=[Depends(_route_to_owner)],
+)
 async def update_wheel_name(
     user_id: int,
     wheel_id: uuid.UUID,
@@ -197,9 +741,11 @@ async def update_wheel_name(
     if token.credentials != config.internal_token:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
 
-    state = _verify_access(user=user_id, wheel=wheel_id, require_owner=True)
-    await repo.update_wheel_name(wheel_id, name=name)
-    await state.update(state.value.replace(wheel_name=name))
+    async with _use_wheel(repo, wheel_id) as loaded:
+        state = _verify_access(loaded, user=user_id, require_owner=True)
+        await repo.update_wheel_name(wheel_id, name=name)
+        async with state.atomic() as atom:
+            await atom.update(atom.value.replace(wheel_name=name))
     return TelegramWheel(name=name, id=wheel_id, is_owned=True)
 
 
@@ -209,26 +755,70 @@ async def update_wheel_name(
     response_class=Response,
 )
 async def add_client_registration(
+    request: Request,
     user_id: int,
     wheel_id: uuid.UUID,
     registration_id: uuid.UUID,
     token: Annotated[HTTPAuthorizationCredentials, Depends(auth_token)],
+    repo: Annotated[Repository, Depends(_repo)],
 ) -> None:
     if token.credentials != config.internal_token:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
 
-    _verify_access(user=user_id, wheel=wheel_id)
-    client_wheel = pending_wheel_clients.get(registration_id)
+    # Handled by the member the display is connected to, not the owner of the wheel
+    if _foreign_owner(wheel_id):
+        wheel = await repo.find_wheel(wheel_id)
+        if wheel is None or wheel.owner != user_id:
+            raise HTTPException(status.HTTP_403_FORBIDDEN)
+    else:
+        _verify_access(await _get_wheel(repo, wheel_id), user=user_id)
+
+    client_wheel = registrations.get(registration_id)
+    if client_wheel is None and state_hub is not None:
+        # The display may be connected to another worker
+        client_wheel = await state_hub.get(
+            _registration_key(registration_id),
+            _wheel_id_codec,
+        )
+
     if client_wheel is None:
+        if await _add_registration_elsewhere(request):
+            return
+
         raise HTTPException(status.HTTP_404_NOT_FOUND)
 
     await client_wheel.update(wheel_id)
 
 
+async def _add_registration_elsewhere(request: Request) -> bool:
+    # Without a shared state backend, only the member the display is connected to
+    # knows the registration, so it is looked up on all other members.
+    if shards is None or state_hub is not None or _is_forwarded(request.headers):
+        return False
+
+    members = [m for m in shards.members if m != config.sharding.member]
+    responses = await asyncio.gather(
+        *(_send_to_member(request, member) for member in members),
+        return_exceptions=True,
+    )
+    for member, response in zip(members, responses, strict=True):
+        if isinstance(response, httpx.HTTPError):
+            _LOG.error(
+                "Could not look up registration on %s", member, exc_info=response
+            )
+        elif isinstance(response, BaseException):
+            raise response
+        elif response.is_success:
+            return True
+
+    return False
+
+
 @app.delete(
     "/user/{user_id}/wheel/{wheel_id}",
     status_code=status.HTTP_204_NO_CONTENT,
     response_class=Response,
+    dependencies=[Depends(_route_to_owner)],
 )
 async def delete_wheel(
     user_id: int,
@@ -239,38 +829,84 @@ async def delete_wheel(
     if token.credentials != config.internal_token:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
 
-    _verify_access(user=user_id, wheel=wheel_id, require_owner=True)
-    await repo.delete_wheel(wheel_id)
-    del observable_states[wheel_id]
+    _verify_access(
+        await _get_wheel(repo, wheel_id),
+        user=user_id,
+        require_owner=True,
+    )
+    await repo.delete_wheel(wheel_id, owner=user_id)
+    await _forget_wheel(wheel_id)
 
 
-@app.post("/wheel/{wheel_id}/is_locked", response_class=Response, status_code=204)
+@app.post(
+    "/wheel/{wheel_id}/is_locked",
+    response_class=Response,
+    status_code=204,
+    dependencies=[Depends(_route_to_owner)],
+)
 async def spin(
     wheel_id: uuid.UUID,
     speed: float,
     token: Annotated[HTTPAuthorizationCredentials, Depends(auth_token)],
+    repo: Annotated[Repository, Depends(_repo)],
+) -> None:
+    async with _use_wheel(repo, wheel_id) as observable_state:
+        if observable_state is None:
+            raise HTTPException(status.HTTP_404_NOT_FOUND)
+
+        async with observable_state.atomic() as atom:
+            state: State = atom.value
+            if token.credentials != state.code:
+                raise HTTPException(status.HTTP_403_FORBIDDEN)
+
+            if state.is_locked:
+                raise HTTPException(status.HTTP_409_CONFLICT)
+
+            await atom.update(
+                state.replace(
+                    is_locked=True,
+                    speed=speed,
+                    current_drink=random.randrange(0, len(state.drinks)),
+                )
+            )
+            version = atom.value.version
+
+    unlock_scheduler.schedule((wheel_id, version), _spin_duration(speed))
+
+
+def _spin_duration(speed: float) -> timedelta:
+    spin = config.spin
+    duration = timedelta(seconds=abs(speed) / spin.deceleration)
+    return min(duration, spin.max_duration) + spin.unlock_delay
+
+
+async def _unlock_wheel(
+    observable_state: Observable[State],
+    *,
+    version: int | None = None,
 ) -> None:
-    observable_state = observable_states[wheel_id]
+    # Every display of a wheel unlocks it at the end of a spin, so all but the
+    # first one are answered without taking the lock.
+    if not observable_state.value.is_locked:
+        return
 
     async with observable_state.atomic() as atom:
         state: State = atom.value
-        if token.credentials != state.code:
-            raise HTTPException(status.HTTP_403_FORBIDDEN)
 
-        if state.is_locked:
-            raise HTTPException(status.HTTP_409_CONFLICT)
+        # The wheel may have been unlocked and spun again (on another worker)
+        if not state.is_locked or (version is not None and state.version != version):
+            return
 
         await atom.update(
             state.replace(
-                is_locked=True,
-                speed=speed,
-                current_drink=random.randrange(0, len(state.drinks)),
+                is_locked=False,
+                code=generate_code(),
             )
         )
 
 
 def _decode_wheel_token(token: str) -> uuid.UUID:
-    payload = jwt.decode(token, config.jwt_secret, algorithms=["HS256"])
+    payload = token_cache.decode(token, secret=config.jwt_secret)
     return uuid.UUID(payload["wheelId"])
 
 
@@ -280,31 +916,32 @@ def _decode_wheel_token(token: str) -> uuid.UUID:
     status_code=status.HTTP_204_NO_CONTENT,
 )
 async def unlock(
+    request: Request,
     token: Annotated[HTTPAuthorizationCredentials, Depends(auth_token)],
+    repo: Annotated[Repository, Depends(_repo)],
 ) -> None:
     try:
         wheel_id = _decode_wheel_token(token.credentials)
     except ValidationError:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
 
-    async with observable_states[wheel_id].atomic() as atom:
-        state: State = atom.value
+    await _route_to_owner(request, wheel_id)
 
-        if not state.is_locked:
-            return
+    async with _use_wheel(repo, wheel_id) as observable_state:
+        if observable_state is None:
+            raise HTTPException(status.HTTP_404_NOT_FOUND)
 
-        await atom.update(
-            state.replace(
-                is_locked=False,
-                code=generate_code(),
-            )
-        )
+        version = observable_state.value.version
+        await _unlock_wheel(observable_state)
+
+    unlock_scheduler.cancel((wheel_id, version))
 
 
 @app.post(
     "/user/{user_id}/wheel/{wheel_id}/drink",
     response_class=Response,
     status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(_route_to_owner)],
 )
 async def add_drink(
     user_id: int,
@@ -318,22 +955,23 @@ async def add_drink(
 
     name = name.strip()
 
-    observable_state = _verify_access(user=user_id, wheel=wheel_id)
+    async with _use_wheel(repo, wheel_id) as loaded:
+        observable_state = _verify_access(loaded, user=user_id)
 
-    async with observable_state.atomic() as atom:
-        state: State = atom.value
+        async with observable_state.atomic() as atom:
+            state: State = atom.value
 
-        if name not in (d.name for d in state.drinks):
-            new_drinks = list(state.drinks)
-            new_drinks.append(Drink.create(name))
-            await repo.update_wheel_drinks(wheel_id, drinks=new_drinks)
-            await atom.update(state.replace(drinks=new_drinks))
+            if state.drinks.find_by_name(name) is None:
+                drinks = state.drinks.append(Drink.create(name))
+                await repo.update_wheel_drinks(wheel_id, drinks=drinks)
+                await atom.update(state.replace(drinks=drinks))
 
 
 @app.delete(
     "/user/{user_id}/wheel/{wheel_id}/drink/{drink_id}",
     response_class=Response,
     status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=[Depends(_route_to_owner)],
 )
 async def delete_drink(
     user_id: int,
@@ -345,65 +983,98 @@ async def delete_drink(
     if token.credentials != config.internal_token:
         raise HTTPException(status.HTTP_403_FORBIDDEN)
 
-    observable_state = _verify_access(user=user_id, wheel=wheel_id)
+    async with _use_wheel(repo, wheel_id) as loaded:
+        observable_state = _verify_access(loaded, user=user_id)
 
-    async with observable_state.atomic() as atom:
-        state = atom.value
-        drinks = [drink for drink in state.drinks if drink.id != drink_id]
-        await repo.update_wheel_drinks(wheel_id, drinks=drinks)
-        await atom.update(state.replace(drinks=drinks))
+        async with observable_state.atomic() as atom:
+            state = atom.value
+            if state.drinks.get(drink_id) is None:
+                return
+
+            drinks = state.drinks.remove(drink_id)
+            await repo.update_wheel_drinks(wheel_id, drinks=drinks)
+            await atom.update(state.replace(drinks=drinks))
+
+
+async def _send(websocket: WebSocket, payload: str | bytes) -> None:
+    if isinstance(payload, bytes):
+        await websocket.send_bytes(payload)
+    else:
+        await websocket.send_text(payload)
+
+
+def _create_wheel_token(wheel_id: uuid.UUID) -> str:
+    return jwt.encode(
+        {
+            "exp": datetime.now(tz=UTC) + timedelta(days=1),
+            "wheelId": str(wheel_id),
+        },
+        key=config.jwt_secret,
+        algorithm="HS256",
+    )
 
 
-async def register_wheel_client(websocket: WebSocket) -> uuid.UUID:
+async def register_wheel_client(
+    websocket: WebSocket,
+    encoding: WheelEncoding,
+) -> uuid.UUID:
     registration_id = uuid.uuid4()
-    observable_wheel_id: Observable[uuid.UUID] = observable(None)
-
-    confirmation = asyncio.Event()
-
-    async def __on_confirm(wheel_id: uuid.UUID) -> None:
-        token = jwt.encode(
-            {
-                "exp": datetime.now(tz=UTC) + timedelta(days=1),
-                "wheelId": str(wheel_id),
-            },
-            key=config.jwt_secret,
-            algorithm="HS256",
+    observable_wheel_id: Observable[uuid.UUID]
+    if state_hub is None:
+        observable_wheel_id = observable(None)
+    else:
+        observable_wheel_id = await state_hub.observable(
+            _registration_key(registration_id),
+            None,
+            _wheel_id_codec,
+            ttl=registrations.timeout,
         )
-        await websocket.send_text(WheelCredentials(token=token).model_dump_json())
-        confirmation.set()
-
-    observable_wheel_id.add_listener(__on_confirm)
-    pending_wheel_clients[registration_id] = observable_wheel_id
 
     try:
-        await websocket.send_text(
-            WheelRegistrationInfo.create(
-                bot_name=config.telegram_bot_name, registration_id=registration_id
-            ).model_dump_json(),
+        confirmation = registrations.add(
+            registration_id,
+            client=websocket.client.host if websocket.client else "unknown",
+            wheel_id=observable_wheel_id,
         )
-        await asyncio.wait_for(
-            confirmation.wait(),
-            timedelta(minutes=20).total_seconds(),
+        await _send(
+            websocket,
+            serialize(
+                WheelRegistrationInfo.create(
+                    bot_name=config.telegram_bot_name,
+                    registration_id=registration_id,
+                ),
+                encoding,
+            ),
         )
+        wheel_id = await confirmation
     finally:
-        del pending_wheel_clients[registration_id]
+        registrations.remove(registration_id)
+        if state_hub is not None:
+            await state_hub.discard(_registration_key(registration_id))
 
-    return observable_wheel_id.value
+    token = _create_wheel_token(wheel_id)
+    await _send(websocket, serialize(WheelCredentials(token=token), encoding))
+    return wheel_id
 
 
-async def authenticate_wheel_client(websocket: WebSocket) -> uuid.UUID | None:
+async def authenticate_wheel_client(
+    websocket: WebSocket,
+) -> tuple[uuid.UUID, WheelLogin] | None:
     try:
         login = WheelLogin.model_validate_json(
             await asyncio.wait_for(websocket.receive_text(), timeout=10)
         )
 
         if token := login.token:
-            return _decode_wheel_token(token)
+            return _decode_wheel_token(token), login
 
-        return await register_wheel_client(websocket)
+        return await register_wheel_client(websocket, login.encoding), login
     except jwt.InvalidTokenError:
         _LOG.error("Login attempt with invalid token")
         await websocket.close(status.WS_1008_POLICY_VIOLATION)
+    except RegistrationLimitError as e:
+        _LOG.warning("Too many pending registrations, rejecting %s", e)
+        await websocket.close(status.WS_1013_TRY_AGAIN_LATER)
     except TimeoutError:
         _LOG.warning("Client did not send auth message")
         await websocket.close(status.WS_1008_POLICY_VIOLATION)
@@ -417,31 +1088,183 @@ async def authenticate_wheel_client(websocket: WebSocket) -> uuid.UUID | None:
     return None
 
 
+def _is_pong(message: str) -> bool:
+    try:
+        WheelPong.model_validate_json(message)
+    except ValidationError:
+        return False
+    else:
+        return True
+
+
+def _websocket_url(member: str) -> str:
+    url = httpx.URL(member)
+    scheme = "wss" if url.scheme == "https" else "ws"
+    return str(url.copy_with(scheme=scheme, path="/ws"))
+
+
+async def _forward_websocket(
+    websocket: WebSocket,
+    owner: str,
+    login: WheelLogin,
+    wheel_id: uuid.UUID,
+) -> None:
+    # The display stays connected to this member, which relays all messages
+    # between it and the owner of its wheel.
+    login = login.model_copy(update={"token": _create_wheel_token(wheel_id)})
+    try:
+        async with connect_websocket(
+            _websocket_url(owner),
+            additional_headers={_FORWARDED_HEADER: _FORWARDED_PROOF},
+        ) as upstream:
+            await upstream.send(login.model_dump_json())
+
+            async def __to_display() -> None:
+                async for message in upstream:
+                    await _send(websocket, message)
+
+            async def __to_owner() -> None:
+                async for message in websocket.iter_text():
+                    await upstream.send(message)
+
+            tasks = [
+                asyncio.create_task(__to_display()),
+                asyncio.create_task(__to_owner()),
+            ]
+            try:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+    except OSError, WebSocketException:
+        _LOG.error("Could not forward websocket connection to %s", owner)
+
+    try:
+        await websocket.close(status.WS_1013_TRY_AGAIN_LATER)
+    except RuntimeError:
+        # Already closed by the display
+        pass
+
+
 @app.websocket("/ws")
 async def connect_ws(websocket: WebSocket):
     await websocket.accept()
 
-    wheel_id = await authenticate_wheel_client(websocket)
-    if not wheel_id:
+    login = await authenticate_wheel_client(websocket)
+    if not login:
         return
 
-    observable_state = observable_states[wheel_id]
+    wheel_id, login_message = login
+    if not _is_forwarded(websocket.headers) and (owner := _foreign_owner(wheel_id)):
+        await _forward_websocket(websocket, owner, login_message, wheel_id)
+        return
+
+    protocol = login_message.protocol
+    encoding = login_message.encoding
+    observable_state = await _get_wheel(websocket.app.state.repo, wheel_id)
+    if observable_state is None:
+        await websocket.close(status.WS_1008_POLICY_VIOLATION)
+        return
+
+    # Pinned before anything else runs, so it isn't evicted while connected
+    observable_states.pin(wheel_id)
+
+    last_sent: State | None = None
+    needs_snapshot = True
+
+    def _encode(state: State) -> str | bytes | None:
+        nonlocal last_sent, needs_snapshot
+
+        if protocol == WheelProtocol.FULL:
+            return observable_state.encode(state, full_encoder(encoding))
+
+        if needs_snapshot or last_sent is None:
+            payload = observable_state.encode(state, snapshot_encoder(encoding))
+            needs_snapshot = False
+        elif state.version <= last_sent.version:
+            # Already covered by a resync snapshot
+            return None
+        else:
+            payload = observable_state.encode(
+                state,
+                PatchEncoder.from_base(last_sent, encoding),
+            )
+
+        last_sent = state
+        return payload
 
     async def __on_state(state: State) -> None:
+        payload = _encode(state)
+        if payload is None:
+            return
+
         try:
-            await websocket.send_text(state.model_dump_json())
+            await _send(websocket, payload)
         except WebSocketDisconnect:
             _LOG.warning("Got disconnect during send")
 
-    on_state = __on_state
+    async def __on_overflow() -> None:
+        await websocket.close(status.WS_1013_TRY_AGAIN_LATER)
+
+    on_state = QueuedListener(
+        __on_state,
+        max_size=config.broadcast.queue_size,
+        policy=config.broadcast.overflow_policy,
+        on_overflow=__on_overflow,
+    )
+
+    async def __ping() -> None:
+        await _send(websocket, _ping_payloads[encoding])
+
+    async def __reap() -> None:
+        _LOG.warning("Reaping websocket connection that missed its heartbeats")
+        # The listener is removed right away, because closing a half-open
+        # connection only ends once the close handshake times out.
+        observable_state.remove_listener(on_state)
+        await on_state.close()
+        try:
+            await asyncio.wait_for(
+                websocket.close(status.WS_1001_GOING_AWAY),
+                timeout=config.heartbeat.interval.total_seconds(),
+            )
+        except TimeoutError, RuntimeError, WebSocketDisconnect:
+            _LOG.info("Could not close reaped websocket connection cleanly")
+
+    connection_id = uuid.uuid4()
+    if login_message.heartbeat:
+        heartbeats.add(connection_id, ping=__ping, reap=__reap)
+
+    _websockets[wheel_id] = _websockets.get(wheel_id, 0) + 1
 
     try:
         async with observable_state.atomic() as atom:
             await on_state(atom.value)
             atom.add_listener(on_state)
 
-        async for message in websocket.iter_json():
+        async for message in websocket.iter_text():
+            heartbeats.seen(connection_id)
+            if login_message.heartbeat and _is_pong(message):
+                continue
+
+            if protocol == WheelProtocol.DELTA:
+                try:
+                    WheelResyncRequest.model_validate_json(message)
+                except ValidationError:
+                    _LOG.warning("Received invalid message: %s", message)
+                else:
+                    needs_snapshot = True
+                    on_state.offer(observable_state.value)
+                continue
+
             _LOG.warning("Received unexpected message: %s", message)
     finally:
+        if remaining := _websockets[wheel_id] - 1:
+            _websockets[wheel_id] = remaining
+        else:
+            del _websockets[wheel_id]
+        heartbeats.remove(connection_id)
         observable_state.remove_listener(on_state)
+        observable_states.unpin(wheel_id)
+        await on_state.close()
         _LOG.info("Ended websocket connection")
@@ -1,16 +1,52 @@
 import base64
+import enum
 import uuid
-from collections.abc import Sequence
+from collections.abc import Iterable, Iterator, Sequence
 from datetime import UTC, datetime, timedelta
-from typing import Self
+from typing import TYPE_CHECKING, Any, Literal, Self, overload
 
-from pydantic_core import Url
+from pydantic import Field
+from pydantic_core import Url, core_schema
 
+from misfortune.observable import Versioned
 from misfortune.shared_model import Drink, MisfortuneModel
 
+if TYPE_CHECKING:
+    from pydantic import GetCoreSchemaHandler
+
+
+class WheelProtocol(enum.StrEnum):
+    # Every update is sent as the complete State
+    FULL = "full"
+    # A versioned StateSnapshot on connect/resync, StatePatch messages afterwards
+    DELTA = "delta"
+
+
+class WheelEncoding(enum.StrEnum):
+    # Text frames containing JSON
+    JSON = "json"
+    # Binary frames containing MessagePack, with the same structure as the JSON
+    MSGPACK = "msgpack"
+
 
 class WheelLogin(MisfortuneModel):
     token: str | None
+    protocol: WheelProtocol = WheelProtocol.FULL
+    encoding: WheelEncoding = WheelEncoding.JSON
+    # The display answers WheelPing messages and is disconnected if it stops doing so
+    heartbeat: bool = False
+
+
+class WheelResyncRequest(MisfortuneModel):
+    type: Literal["resync"]
+
+
+class WheelPing(MisfortuneModel):
+    type: Literal["ping"] = "ping"
+
+
+class WheelPong(MisfortuneModel):
+    type: Literal["pong"]
 
 
 class WheelRegistrationInfo(MisfortuneModel):
@@ -35,8 +71,112 @@ class WheelCredentials(MisfortuneModel):
     token: str
 
 
-class State(MisfortuneModel):
-    drinks: Sequence[Drink]
+def normalize_drink_name(name: str) -> str:
+    return name.strip().casefold()
+
+
+class Drinks(Sequence[Drink]):
+    # Immutable, so derived collections share the Drink instances and indexes of
+    # their base instead of copying or revalidating them.
+
+    __slots__ = ("_by_id", "_by_name", "_drinks")
+
+    def __init__(self, drinks: Iterable[Drink] = ()) -> None:
+        self._drinks = tuple(drinks)
+        self._by_id = {drink.id: drink for drink in self._drinks}
+        self._by_name = {
+            normalize_drink_name(drink.name): drink for drink in self._drinks
+        }
+
+    @classmethod
+    def _derive(
+        cls,
+        drinks: tuple[Drink, ...],
+        by_id: dict[uuid.UUID, Drink],
+        by_name: dict[str, Drink],
+    ) -> Self:
+        result = cls.__new__(cls)
+        result._drinks = drinks
+        result._by_id = by_id
+        result._by_name = by_name
+        return result
+
+    @overload
+    def __getitem__(self, index: int) -> Drink: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> Sequence[Drink]: ...
+
+    def __getitem__(self, index: int | slice) -> Drink | Sequence[Drink]:
+        return self._drinks[index]
+
+    def __len__(self) -> int:
+        return len(self._drinks)
+
+    def __iter__(self) -> Iterator[Drink]:
+        return iter(self._drinks)
+
+    def __contains__(self, drink: object) -> bool:
+        return isinstance(drink, Drink) and self._by_id.get(drink.id) == drink
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Drinks):
+            return self._drinks == other._drinks
+        if isinstance(other, Sequence):
+            return self._drinks == tuple(other)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self._drinks)
+
+    def __repr__(self) -> str:
+        return f"Drinks({list(self._drinks)!r})"
+
+    def get(self, drink_id: uuid.UUID) -> Drink | None:
+        return self._by_id.get(drink_id)
+
+    def find_by_name(self, name: str) -> Drink | None:
+        return self._by_name.get(normalize_drink_name(name))
+
+    def append(self, drink: Drink) -> Self:
+        name = normalize_drink_name(drink.name)
+        if drink.id in self._by_id or name in self._by_name:
+            raise ValueError(f"Drink {drink.name} is already on the wheel")
+
+        by_id = self._by_id.copy()
+        by_id[drink.id] = drink
+        by_name = self._by_name.copy()
+        by_name[name] = drink
+        return self._derive((*self._drinks, drink), by_id, by_name)
+
+    def remove(self, drink_id: uuid.UUID) -> Self:
+        if drink_id not in self._by_id:
+            return self
+
+        return type(self)(drink for drink in self._drinks if drink.id != drink_id)
+
+    @classmethod
+    def __get_pydantic_core_schema__(
+        cls,
+        source: Any,
+        handler: GetCoreSchemaHandler,
+    ) -> core_schema.CoreSchema:
+        list_schema = handler.generate_schema(list[Drink])
+        from_list = core_schema.no_info_after_validator_function(cls, list_schema)
+        return core_schema.json_or_python_schema(
+            json_schema=from_list,
+            python_schema=core_schema.union_schema(
+                [core_schema.is_instance_schema(cls), from_list]
+            ),
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                list,
+                return_schema=list_schema,
+            ),
+        )
+
+
+class State(MisfortuneModel, Versioned):
+    drinks: Drinks
     wheel_name: str
     code: str
     owner: int
@@ -44,6 +184,7 @@ class State(MisfortuneModel):
     is_locked: bool = False
     current_drink: int = 0
     speed: float = 0.0
+    version: int = Field(default=0, exclude=True)
 
     @classmethod
     def initial(cls, *, wheel: InternalWheel, code: str) -> Self:
@@ -67,14 +208,40 @@ class State(MisfortuneModel):
         return delta > timedelta(minutes=1)
 
     def replace(self, **kwargs) -> Self:
-        return self.model_validate(self.model_copy(update=kwargs))
+        changes = {
+            key: value
+            for key, value in kwargs.items()
+            if getattr(self, key) is not value and getattr(self, key) != value
+        }
+        if not changes:
+            return self
+
+        # Only the changed fields are validated, the copy shares everything else
+        result = self.model_copy(update={"version": self.version + 1})
+        validator = self.__pydantic_validator__
+        for key, value in changes.items():
+            validator.validate_assignment(result, key, value)
+        return result
+
+
+class StateSnapshot(MisfortuneModel):
+    type: Literal["snapshot"] = "snapshot"
+    version: int
+    state: State
+
+
+class StatePatch(MisfortuneModel):
+    type: Literal["patch"] = "patch"
+    base_version: int
+    version: int
+    changes: dict[str, Any]
 
 
 class InternalWheel(MisfortuneModel):
     id: uuid.UUID
     name: str
     owner: int
-    drinks: list[Drink]
+    drinks: Drinks
 
     @classmethod
     def create(cls, owner: int, name: str) -> Self:
@@ -82,5 +249,5 @@ class InternalWheel(MisfortuneModel):
             name=name,
             owner=owner,
             id=uuid.uuid4(),
-            drinks=[],
+            drinks=Drinks(),
         )
@@ -0,0 +1,102 @@
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+import msgpack
+
+from misfortune.api.model import State, StatePatch, StateSnapshot, WheelEncoding
+from misfortune.observable import Codec
+
+if TYPE_CHECKING:
+    from pydantic import BaseModel
+
+    from misfortune.observable import Encoder
+
+_PATCHABLE_FIELDS = frozenset(State.model_fields) - {"version"}
+
+
+def _pack(model: BaseModel) -> bytes:
+    return msgpack.packb(model.model_dump(mode="json"))
+
+
+def serialize(model: BaseModel, encoding: WheelEncoding) -> str | bytes:
+    if encoding == WheelEncoding.MSGPACK:
+        return _pack(model)
+
+    return model.model_dump_json()
+
+
+def encode_full(state: State) -> str:
+    return state.model_dump_json()
+
+
+def encode_full_msgpack(state: State) -> bytes:
+    return _pack(state)
+
+
+def _snapshot(state: State) -> StateSnapshot:
+    return StateSnapshot(version=state.version, state=state)
+
+
+def encode_snapshot(state: State) -> str:
+    return _snapshot(state).model_dump_json()
+
+
+def encode_snapshot_msgpack(state: State) -> bytes:
+    return _pack(_snapshot(state))
+
+
+def full_encoder(encoding: WheelEncoding) -> Encoder[State, str | bytes]:
+    if encoding == WheelEncoding.MSGPACK:
+        return encode_full_msgpack
+
+    return encode_full
+
+
+def snapshot_encoder(encoding: WheelEncoding) -> Encoder[State, str | bytes]:
+    if encoding == WheelEncoding.MSGPACK:
+        return encode_snapshot_msgpack
+
+    return encode_snapshot
+
+
+def _decode_snapshot(raw: bytes) -> State:
+    snapshot = StateSnapshot.model_validate_json(raw)
+    return snapshot.state.model_copy(update={"version": snapshot.version})
+
+
+# Used to share states between processes, so the version is retained
+state_codec = Codec(
+    encode=lambda state: encode_snapshot(state).encode(),
+    decode=_decode_snapshot,
+)
+
+
+@dataclass(frozen=True)
+class PatchEncoder:
+    # Compared by base version and encoding only, so every subscriber that last
+    # received the same version shares one encoded patch.
+    base_version: int
+    base: State = field(compare=False)
+    encoding: WheelEncoding = WheelEncoding.JSON
+
+    @classmethod
+    def from_base(
+        cls,
+        base: State,
+        encoding: WheelEncoding = WheelEncoding.JSON,
+    ) -> PatchEncoder:
+        return cls(base_version=base.version, base=base, encoding=encoding)
+
+    def __call__(self, state: State) -> str | bytes:
+        base = self.base
+        changed = {
+            name
+            for name in _PATCHABLE_FIELDS
+            if getattr(base, name) != getattr(state, name)
+        }
+        patch = StatePatch(
+            base_version=base.version,
+            version=state.version,
+            changes=state.model_dump(mode="json", include=changed),
+        )
+        return serialize(patch, self.encoding)
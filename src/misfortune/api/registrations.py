@@ -0,0 +1,134 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import TYPE_CHECKING
+
+from misfortune.api.scheduler import Scheduler
+
+if TYPE_CHECKING:
+    import uuid
+
+    from misfortune.observable import Observable
+
+
+class RegistrationLimitError(Exception):
+    pass
+
+
+@dataclass(frozen=True, kw_only=True)
+class RegistrationStats:
+    pending: int
+    oldest_age: timedelta | None
+    rejected: int
+    expired: int
+
+
+@dataclass(frozen=True, kw_only=True)
+class _Registration:
+    client: str
+    created_at: float
+    wheel_id: Observable[uuid.UUID]
+    confirmation: asyncio.Future[uuid.UUID]
+
+
+class RegistrationManager:
+    # Registrations share one timeout and are kept in creation order, so the first
+    # one is always the oldest. A single scheduler task expires all of them.
+
+    def __init__(
+        self,
+        *,
+        max_pending: int,
+        max_pending_per_client: int,
+        timeout: timedelta,
+    ) -> None:
+        self._max_pending = max_pending
+        self._max_pending_per_client = max_pending_per_client
+        self._timeout = timeout
+        self._registrations: dict[uuid.UUID, _Registration] = {}
+        self._by_client: dict[str, int] = {}
+        self._expiry = Scheduler(self._expire)
+        self.rejected = 0
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._registrations)
+
+    @property
+    def timeout(self) -> timedelta:
+        return self._timeout
+
+    def get(self, registration_id: uuid.UUID) -> Observable[uuid.UUID] | None:
+        if registration := self._registrations.get(registration_id):
+            return registration.wheel_id
+        return None
+
+    def add(
+        self,
+        registration_id: uuid.UUID,
+        *,
+        client: str,
+        wheel_id: Observable[uuid.UUID],
+    ) -> asyncio.Future[uuid.UUID]:
+        client_count = self._by_client.get(client, 0)
+        if (
+            len(self._registrations) >= self._max_pending
+            or client_count >= self._max_pending_per_client
+        ):
+            self.rejected += 1
+            raise RegistrationLimitError(client)
+
+        confirmation = asyncio.get_running_loop().create_future()
+
+        async def __on_confirm(value: uuid.UUID) -> None:
+            if not confirmation.done():
+                confirmation.set_result(value)
+
+        wheel_id.add_listener(__on_confirm)
+        self._registrations[registration_id] = _Registration(
+            client=client,
+            created_at=time.monotonic(),
+            wheel_id=wheel_id,
+            confirmation=confirmation,
+        )
+        self._by_client[client] = client_count + 1
+        self._expiry.schedule(registration_id, self._timeout)
+        return confirmation
+
+    def remove(self, registration_id: uuid.UUID) -> None:
+        registration = self._registrations.pop(registration_id, None)
+        if registration is None:
+            return
+
+        self._expiry.cancel(registration_id)
+        registration.confirmation.cancel()
+
+        client = registration.client
+        remaining = self._by_client[client] - 1
+        if remaining:
+            self._by_client[client] = remaining
+        else:
+            del self._by_client[client]
+
+    async def _expire(self, registration_id: uuid.UUID) -> None:
+        registration = self._registrations.get(registration_id)
+        if registration is not None and not registration.confirmation.done():
+            self.expired += 1
+            registration.confirmation.set_exception(TimeoutError())
+
+    def stats(self) -> RegistrationStats:
+        oldest = next(iter(self._registrations.values()), None)
+        return RegistrationStats(
+            pending=len(self._registrations),
+            oldest_age=(
+                timedelta(seconds=time.monotonic() - oldest.created_at)
+                if oldest
+                else None
+            ),
+            rejected=self.rejected,
+            expired=self.expired,
+        )
+
+    async def close(self) -> None:
+        await self._expiry.close()
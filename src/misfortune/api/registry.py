@@ -0,0 +1,91 @@
+import uuid
+from collections.abc import Iterator, Mapping
+
+from misfortune.api.model import State
+from misfortune.observable import Observable
+
+
+class WheelRegistry(Mapping[uuid.UUID, Observable[State]]):
+    # All mutations are synchronous, so no other task can ever observe the states
+    # and the owner index out of sync.
+
+    def __init__(self) -> None:
+        self._states: dict[uuid.UUID, Observable[State]] = {}
+        self._owners: dict[uuid.UUID, int] = {}
+        self._by_owner: dict[int, dict[uuid.UUID, None]] = {}
+        self._pins: dict[uuid.UUID, int] = {}
+
+    def __getitem__(self, wheel_id: uuid.UUID) -> Observable[State]:
+        return self._states[wheel_id]
+
+    def __iter__(self) -> Iterator[uuid.UUID]:
+        return iter(self._states)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, wheel_id: object) -> bool:
+        return wheel_id in self._states
+
+    def _index(self, wheel_id: uuid.UUID, owner: int) -> None:
+        self._owners[wheel_id] = owner
+        self._by_owner.setdefault(owner, {})[wheel_id] = None
+
+    def _unindex(self, wheel_id: uuid.UUID) -> None:
+        owner = self._owners.pop(wheel_id)
+        owned = self._by_owner[owner]
+        del owned[wheel_id]
+        if not owned:
+            del self._by_owner[owner]
+
+    def add(self, wheel_id: uuid.UUID, state: Observable[State]) -> None:
+        if wheel_id in self._states:
+            raise ValueError(f"Wheel {wheel_id} is already registered")
+
+        self._states[wheel_id] = state
+        self._index(wheel_id, state.value.owner)
+
+    def touch(self, wheel_id: uuid.UUID) -> None:
+        # Moves the wheel to the end of the eviction order
+        self._states[wheel_id] = self._states.pop(wheel_id)
+
+    def pin(self, wheel_id: uuid.UUID) -> None:
+        # Pinned wheels are in use by a request, so they are never evicted
+        self._pins[wheel_id] = self._pins.get(wheel_id, 0) + 1
+
+    def unpin(self, wheel_id: uuid.UUID) -> None:
+        if remaining := self._pins[wheel_id] - 1:
+            self._pins[wheel_id] = remaining
+        else:
+            del self._pins[wheel_id]
+
+    def evict_idle(self, max_loaded: int) -> list[uuid.UUID]:
+        excess = len(self._states) - max_loaded
+        if excess <= 0:
+            return []
+
+        evicted = []
+        pins = self._pins
+        for wheel_id, state in self._states.items():
+            # Locked wheels are kept, so their scheduled unlock finds them
+            if state.is_idle and not state.value.is_locked and wheel_id not in pins:
+                evicted.append(wheel_id)
+                if len(evicted) == excess:
+                    break
+
+        for wheel_id in evicted:
+            self.remove(wheel_id)
+
+        return evicted
+
+    def remove(self, wheel_id: uuid.UUID) -> Observable[State] | None:
+        state = self._states.pop(wheel_id, None)
+        if state is not None:
+            self._unindex(wheel_id)
+        return state
+
+    def owned_by(self, owner: int) -> list[tuple[uuid.UUID, Observable[State]]]:
+        states = self._states
+        return [
+            (wheel_id, states[wheel_id]) for wheel_id in self._by_owner.get(owner, ())
+        ]
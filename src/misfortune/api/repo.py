@@ -1,75 +1,636 @@
 import asyncio
+import enum
 import logging
-from typing import TYPE_CHECKING
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import TYPE_CHECKING, cast
 from uuid import UUID
 
-from redis.asyncio import Redis
+from more_itertools import chunked
+from pydantic import TypeAdapter
+from redis.exceptions import WatchError
 
-from .model import InternalWheel
+from misfortune.metrics import registry, timed
+from misfortune.redis_pool import (
+    PoolStats,
+    create_client,
+    create_replica_reader,
+    pool_stats,
+)
+
+from .model import Drinks, InternalWheel
 
 if TYPE_CHECKING:
+    from collections.abc import Awaitable, Iterable
+
+    from redis.asyncio import Redis
+    from redis.asyncio.client import Pipeline
+
     from misfortune.config import RepoConfig
-    from misfortune.shared_model import Drink
 
 _logger = logging.getLogger(__name__)
 
+_drinks_adapter = TypeAdapter(Drinks)
+
+_redis_latency = registry.histogram(
+    "misfortune_repository_seconds",
+    "Redis round-trip time per repository method",
+    label_names=("method",),
+)
+
+# Every write bumps the revision, records it as the last change of the wheel and
+# appends it to the change log, with the revision as entry ID. Readers can catch up
+# with only the wheels changed since a known revision.
+_RECORD_CHANGE_SCRIPT = """
+local revision = redis.call("INCR", KEYS[1])
+redis.call("ZADD", KEYS[2], revision, ARGV[2])
+redis.call(
+    "XADD", KEYS[3], "MAXLEN", "~", ARGV[1], revision .. "-0",
+    "wheel", ARGV[2], "type", ARGV[3], unpack(ARGV, 4)
+)
+return revision
+"""
+
+# Only updates a field of an existing wheel, so a concurrent deletion can't leave a
+# partial wheel behind. Returns -1 if the wheel doesn't exist.
+_SET_FIELD_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return -1
+end
+local result = redis.call("HSET", KEYS[1], ARGV[1], ARGV[2])
+local revision = redis.call("INCR", KEYS[2])
+redis.call("ZADD", KEYS[3], revision, ARGV[4])
+redis.call(
+    "XADD", KEYS[4], "MAXLEN", "~", ARGV[3], revision .. "-0",
+    "wheel", ARGV[4], "type", ARGV[5], ARGV[1], ARGV[2]
+)
+return result
+"""
+
+
+def _to_hash(wheel: InternalWheel) -> dict[str, str]:
+    return {
+        "name": wheel.name,
+        "owner": str(wheel.owner),
+        "drinks": _drinks_adapter.dump_json(wheel.drinks).decode("utf-8"),
+    }
+
+
+def _from_hash(wheel_id: UUID, raw: dict[bytes, bytes]) -> InternalWheel:
+    return InternalWheel(
+        id=wheel_id,
+        name=raw[b"name"].decode("utf-8"),
+        owner=int(raw[b"owner"]),
+        drinks=_drinks_adapter.validate_json(raw[b"drinks"]),
+    )
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+class ChangeType(enum.StrEnum):
+    CREATE = "create"
+    RENAME = "rename"
+    DRINKS = "drinks"
+    DELETE = "delete"
+
+
+_FIELD_CHANGE_TYPES = {
+    "name": ChangeType.RENAME,
+    "drinks": ChangeType.DRINKS,
+}
+
+
+@dataclass(frozen=True, kw_only=True)
+class ChangeLogEntry:
+    # The repository revision of the change, which is also its offset in the log
+    revision: int
+    wheel_id: UUID
+    type: ChangeType
+    # Set for creations and deletions
+    owner: int | None = None
+    # Set for creations and renames
+    name: str | None = None
+    # Set for creations and drink changes
+    drinks: Drinks | None = None
+
+
+def _parse_entry(entry_id: bytes, fields: dict[bytes, bytes]) -> ChangeLogEntry:
+    owner = fields.get(b"owner")
+    name = fields.get(b"name")
+    drinks = fields.get(b"drinks")
+    return ChangeLogEntry(
+        revision=int(entry_id.split(b"-", 1)[0]),
+        wheel_id=UUID(fields[b"wheel"].decode("utf-8")),
+        type=ChangeType(fields[b"type"].decode("utf-8")),
+        owner=int(owner) if owner is not None else None,
+        name=name.decode("utf-8") if name is not None else None,
+        drinks=_drinks_adapter.validate_json(drinks) if drinks is not None else None,
+    )
+
+
+@dataclass(frozen=True, kw_only=True)
+class WheelChanges:
+    revision: int
+    # The current data of the created and updated wheels
+    wheels: list[InternalWheel]
+    deleted: set[UUID]
+
 
 class Repository:
+    _BATCH_SIZE = 500
+    _SCHEMA_VERSION = 2
+
     def __init__(self, config: RepoConfig) -> None:
-        self._client = Redis(
-            host=config.host,
-            username=config.username,
-            password=config.password,
-            protocol=3,
-        )
+        self._client = create_client(config)
+        # Bulk reads go to the replicas. Everything which must see the writes of
+        # this instance, like the reads before updates, stays on the primary.
+        self._replicas = create_replica_reader(self._client, config)
         self._prefix = f"{config.username}:api"
+        # Every change increments the revision, so it is written without retries
+        self._writer = create_client(config, retry=False)
+        self._set_field = self._writer.register_script(_SET_FIELD_SCRIPT)
+        self._record_change = self._writer.register_script(_RECORD_CHANGE_SCRIPT)
+        self._changelog_max_length = config.changelog_max_length
+
+        # Write-behind mode: field updates are collected per wheel and flushed
+        # periodically, so at most one interval of updates is lost on a crash.
+        self._write_behind_interval = config.write_behind_interval
+        self._write_behind_batch_size = config.write_behind_batch_size
+        self._pending: dict[UUID, dict[str, str]] = {}
+        # Count every buffered update, including those coalesced into one field,
+        # per wheel and in total
+        self._pending_counts: dict[UUID, int] = {}
+        self._pending_updates = 0
+        self._flush_requested = asyncio.Event()
+        self._flush_task: asyncio.Task[None] | None = None
+
+    def _wheel_key(self, wheel_id: UUID) -> str:
+        return f"{self._prefix}:wheel:{wheel_id}"
+
+    def _owner_key(self, owner: int) -> str:
+        return f"{self._prefix}:owner:{owner}:wheels"
+
+    @property
+    def _index_key(self) -> str:
+        return f"{self._prefix}:wheels"
+
+    @property
+    def _revision_key(self) -> str:
+        return f"{self._prefix}:revision"
+
+    @property
+    def _changes_key(self) -> str:
+        return f"{self._prefix}:changes"
+
+    @property
+    def _changelog_key(self) -> str:
+        return f"{self._prefix}:changelog"
+
+    @timed(_redis_latency.labels("migrate"))
+    async def migrate(self) -> None:
+        version_key = f"{self._prefix}:schema_version"
+        version = int(await self._client.get(version_key) or 0)
+        if version >= self._SCHEMA_VERSION:
+            return
+
+        if version < 1:
+            await self._build_indexes()
+
+        if version < 2:
+            await self._convert_to_hashes()
+
+        await self._client.set(version_key, self._SCHEMA_VERSION)
+
+    async def _build_indexes(self) -> None:
+        _logger.info("Building wheel indexes from existing keys")
+        wheel_ids = set()
+        async for key in self._client.scan_iter(match=f"{self._prefix}:wheel:*"):
+            wheel_ids.add(UUID(key.decode("utf-8").split(":")[-1]))
+
+        wheels = await self._fetch_json_wheels(wheel_ids)
+        for batch in chunked(wheels, self._BATCH_SIZE):
+            async with self._client.pipeline(transaction=False) as pipe:
+                for wheel in batch:
+                    pipe.sadd(self._index_key, str(wheel.id))
+                    pipe.sadd(self._owner_key(wheel.owner), str(wheel.id))
+                await pipe.execute()
+
+    async def _convert_to_hashes(self) -> None:
+        _logger.info("Converting wheels from JSON strings to hashes")
+        raw_ids = await cast(
+            "Awaitable[set[bytes]]",
+            self._client.smembers(self._index_key),
+        )
+        wheels = await self._fetch_json_wheels(
+            UUID(raw_id.decode("utf-8")) for raw_id in raw_ids
+        )
+        for batch in chunked(wheels, self._BATCH_SIZE):
+            async with self._client.pipeline(transaction=True) as pipe:
+                for wheel in batch:
+                    key = self._wheel_key(wheel.id)
+                    pipe.delete(key)
+                    pipe.hset(key, mapping=_to_hash(wheel))
+                await pipe.execute()
+
+    async def _fetch_json_wheels(
+        self,
+        wheel_ids: Iterable[UUID],
+    ) -> list[InternalWheel]:
+        wheels: list[InternalWheel] = []
+        for batch in chunked(wheel_ids, self._BATCH_SIZE):
+            # Keys which have already been converted to hashes are returned as None
+            raws = await self._client.mget([self._wheel_key(i) for i in batch])
+            wheels.extend(
+                InternalWheel.model_validate_json(raw)
+                for raw in raws
+                if raw is not None
+            )
+
+        return wheels
+
+    @timed(_redis_latency.labels("find_wheel"))
+    async def find_wheel(self, wheel_id: UUID, /) -> InternalWheel | None:
+        raw = await cast(
+            "Awaitable[dict[bytes, bytes]]",
+            self._client.hgetall(self._wheel_key(wheel_id)),
+        )
+        if not raw:
+            return None
+
+        return _from_hash(wheel_id, self._with_pending(wheel_id, raw))
 
     async def fetch_wheel(self, wheel_id: UUID, /) -> InternalWheel:
-        raw = await self._client.get(f"{self._prefix}:wheel:{wheel_id}")
-        if raw is None:
+        wheel = await self.find_wheel(wheel_id)
+        if wheel is None:
             raise RuntimeError(f"Did not find wheel {wheel_id}")
 
-        wheel = InternalWheel.model_validate_json(raw)
         return wheel
 
+    @timed(_redis_latency.labels("fetch_owned_wheel_ids"))
+    async def fetch_owned_wheel_ids(self, owner: int) -> set[UUID]:
+        raw_ids = await cast(
+            "Awaitable[set[bytes]]",
+            self._client.smembers(self._owner_key(owner)),
+        )
+        return {UUID(raw_id.decode("utf-8")) for raw_id in raw_ids}
+
+    async def fetch_owned_wheels(self, owner: int) -> list[InternalWheel]:
+        return await self._fetch_wheels(
+            await self.fetch_owned_wheel_ids(owner),
+            client=self._client,
+        )
+
     async def fetch_wheels(self) -> list[InternalWheel]:
-        client = self._client
+        _, wheels = await self.fetch_wheels_at_revision()
+        return wheels
 
-        wheel_ids = set()
-        async for key in client.scan_iter(match=f"{self._prefix}:wheel:*"):
-            wheel_ids.add(UUID(key.decode("utf-8").split(":")[-1]))
+    @timed(_redis_latency.labels("fetch_wheels"))
+    async def fetch_wheels_at_revision(self) -> tuple[int, list[InternalWheel]]:
+        # Both are read from the same replica, and the revision first, so the
+        # wheels are at least as recent as the revision.
+        client = await self._replicas.client()
+        revision = int(await client.get(self._revision_key) or 0)
+        raw_ids = await cast(
+            "Awaitable[set[bytes]]",
+            client.smembers(self._index_key),
+        )
+        wheels = await self._fetch_wheels(
+            (UUID(raw_id.decode("utf-8")) for raw_id in raw_ids),
+            client=client,
+        )
+        return revision, wheels
+
+    async def _fetch_hashes(
+        self,
+        wheel_ids: Iterable[UUID],
+        *,
+        client: Redis,
+    ) -> list[tuple[UUID, dict[bytes, bytes]]]:
+        hashes = []
+        for batch in chunked(wheel_ids, self._BATCH_SIZE):
+            async with client.pipeline(transaction=False) as pipe:
+                for wheel_id in batch:
+                    pipe.hgetall(self._wheel_key(wheel_id))
+                raws = await pipe.execute()
 
+            hashes.extend(zip(batch, raws, strict=True))
+
+        return hashes
+
+    async def _fetch_wheels(
+        self,
+        wheel_ids: Iterable[UUID],
+        *,
+        client: Redis,
+    ) -> list[InternalWheel]:
         wheels = []
+        for wheel_id, raw in await self._fetch_hashes(wheel_ids, client=client):
+            if not raw:
+                _logger.warning("Indexed wheel %s does not exist", wheel_id)
+                continue
+
+            wheels.append(_from_hash(wheel_id, self._with_pending(wheel_id, raw)))
 
-        async with asyncio.TaskGroup() as tg:
-            for wheel_id in wheel_ids:
-                wheels.append(tg.create_task(self.fetch_wheel(wheel_id)))
+        return wheels
 
-        return [task.result() for task in wheels]
+    @timed(_redis_latency.labels("fetch_revision"))
+    async def fetch_revision(self) -> int:
+        return int(await self._client.get(self._revision_key) or 0)
 
-    async def create_wheel(self, wheel: InternalWheel) -> None:
-        await self._client.set(
-            f"{self._prefix}:wheel:{wheel.id}", wheel.model_dump_json()
+    @timed(_redis_latency.labels("fetch_changes"))
+    async def fetch_changes(self, *, since: int) -> WheelChanges | None:
+        client = await self._replicas.client()
+        changes = await self._fetch_changes(client, since=since)
+        if changes is None and client is not self._client:
+            # The replica may only be behind, which the primary can tell
+            _logger.debug("Replica is behind revision %d, reading primary", since)
+            changes = await self._fetch_changes(self._client, since=since)
+
+        return changes
+
+    async def _fetch_changes(
+        self,
+        client: Redis,
+        *,
+        since: int,
+    ) -> WheelChanges | None:
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.get(self._revision_key)
+            pipe.zrangebyscore(self._changes_key, f"({since}", "+inf")
+            raw_revision, raw_ids = await pipe.execute()
+
+        revision = int(raw_revision or 0)
+        if revision < since:
+            # The data was reset, so the changes since the given revision are unknown
+            return None
+
+        wheels = []
+        deleted = set()
+        hashes = await self._fetch_hashes(
+            (UUID(raw_id.decode("utf-8")) for raw_id in raw_ids),
+            client=client,
         )
+        for wheel_id, raw in hashes:
+            if raw:
+                wheels.append(_from_hash(wheel_id, self._with_pending(wheel_id, raw)))
+            else:
+                deleted.add(wheel_id)
 
-    async def update_wheel_name(self, wheel_id: UUID, /, *, name: str) -> None:
-        old_wheel = await self.fetch_wheel(wheel_id)
-        new_wheel = InternalWheel.model_validate(
-            old_wheel.model_copy(update={"name": name})
+        return WheelChanges(revision=revision, wheels=wheels, deleted=deleted)
+
+    @timed(_redis_latency.labels("read_changelog"))
+    async def read_changelog(
+        self,
+        *,
+        after: int,
+        count: int,
+    ) -> list[ChangeLogEntry] | None:
+        client = await self._replicas.client()
+        entries = await self._read_changelog(client, after=after, count=count)
+        if entries is None and client is not self._client:
+            _logger.debug("Replica is behind revision %d, reading primary", after)
+            entries = await self._read_changelog(self._client, after=after, count=count)
+
+        return entries
+
+    async def _read_changelog(
+        self,
+        client: Redis,
+        *,
+        after: int,
+        count: int,
+    ) -> list[ChangeLogEntry] | None:
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.get(self._revision_key)
+            pipe.xrange(self._changelog_key, "-", "+", count=1)
+            pipe.xrange(self._changelog_key, f"{after + 1}-0", "+", count=count)
+            raw_revision, first, entries = await pipe.execute()
+
+        revision = int(raw_revision or 0)
+        if first:
+            first_revision = int(first[0][0].split(b"-", 1)[0])
+        else:
+            first_revision = revision + 1
+
+        # Returns None if the entries following the offset were already trimmed
+        if revision < after or first_revision > after + 1:
+            return None
+
+        return [_parse_entry(entry_id, fields) for entry_id, fields in entries]
+
+    @timed(_redis_latency.labels("fetch_compacted_changelog"))
+    async def fetch_compacted_changelog(self) -> bytes | None:
+        # Consumers replay the change log after it, so it may be stale
+        client = await self._replicas.client()
+        return await client.get(f"{self._changelog_key}:compacted")
+
+    @timed(_redis_latency.labels("store_compacted_changelog"))
+    async def store_compacted_changelog(self, data: bytes) -> None:
+        await self._client.set(f"{self._changelog_key}:compacted", data)
+
+    async def try_lock_compaction(self, *, ttl: timedelta) -> bool:
+        # Expires instead of being released, so compaction runs once per interval
+        # across all instances.
+        return bool(
+            await self._client.set(
+                f"{self._changelog_key}:compaction",
+                1,
+                nx=True,
+                px=ttl // timedelta(milliseconds=1),
+            )
         )
-        await self.create_wheel(new_wheel)
 
-    async def update_wheel_drinks(
-        self, wheel_id: UUID, /, *, drinks: list[Drink]
+    def _with_pending(
+        self,
+        wheel_id: UUID,
+        raw: dict[bytes, bytes],
+    ) -> dict[bytes, bytes]:
+        pending = self._pending.get(wheel_id)
+        if not pending:
+            return raw
+
+        return raw | {
+            field.encode("utf-8"): value.encode("utf-8")
+            for field, value in pending.items()
+        }
+
+    async def _flush_periodically(self, interval: float) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), interval)
+            except TimeoutError:
+                pass
+
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                _logger.error("Could not flush pending wheel updates", exc_info=e)
+
+    @timed(_redis_latency.labels("flush"))
+    async def flush(self) -> None:
+        pending = self._pending
+        if not pending:
+            return
+
+        counts = self._pending_counts
+        updates = self._pending_updates
+        self._pending = {}
+        self._pending_counts = {}
+        self._pending_updates = 0
+        try:
+            async with self._writer.pipeline(transaction=False) as pipe:
+                for wheel_id, fields in pending.items():
+                    for field, value in fields.items():
+                        await self._set_field(
+                            keys=self._set_field_keys(wheel_id),
+                            args=self._set_field_args(wheel_id, field, value),
+                            client=pipe,
+                        )
+                await pipe.execute()
+        except BaseException:
+            # Updates which arrived during the flush are newer and take precedence
+            for wheel_id, fields in pending.items():
+                self._pending[wheel_id] = fields | self._pending.get(wheel_id, {})
+                count = counts[wheel_id] + self._pending_counts.get(wheel_id, 0)
+                self._pending_counts[wheel_id] = count
+            self._pending_updates += updates
+            raise
+
+    def _set_field_keys(self, wheel_id: UUID) -> list[str]:
+        return [
+            self._wheel_key(wheel_id),
+            self._revision_key,
+            self._changes_key,
+            self._changelog_key,
+        ]
+
+    def _set_field_args(self, wheel_id: UUID, field: str, value: str) -> list[str]:
+        change_type = _FIELD_CHANGE_TYPES[field]
+        return [
+            field,
+            value,
+            str(self._changelog_max_length),
+            str(wheel_id),
+            change_type,
+        ]
+
+    async def _append_change(
+        self,
+        pipe: Pipeline,
+        wheel_id: UUID,
+        change_type: ChangeType,
+        fields: dict[str, str],
     ) -> None:
-        old_wheel = await self.fetch_wheel(wheel_id)
-        new_wheel = InternalWheel.model_validate(
-            old_wheel.model_copy(update={"drinks": drinks})
+        await self._record_change(
+            keys=[self._revision_key, self._changes_key, self._changelog_key],
+            args=[
+                str(self._changelog_max_length),
+                str(wheel_id),
+                change_type,
+                *(item for pair in fields.items() for item in pair),
+            ],
+            client=pipe,
+        )
+
+    async def _update_field(self, wheel_id: UUID, field: str, value: str) -> None:
+        if (interval := self._write_behind_interval) is not None:
+            self._pending.setdefault(wheel_id, {})[field] = value
+            self._pending_counts[wheel_id] = self._pending_counts.get(wheel_id, 0) + 1
+            self._pending_updates += 1
+            if self._flush_task is None:
+                self._flush_task = asyncio.create_task(
+                    self._flush_periodically(interval.total_seconds())
+                )
+            if self._pending_updates >= self._write_behind_batch_size:
+                self._flush_requested.set()
+            return
+
+        result = await self._set_field(
+            keys=self._set_field_keys(wheel_id),
+            args=self._set_field_args(wheel_id, field, value),
+        )
+        if result == -1:
+            raise RuntimeError(f"Did not find wheel {wheel_id}")
+
+    @timed(_redis_latency.labels("create_wheel"))
+    async def create_wheel(self, wheel: InternalWheel, *, max_owned: int) -> None:
+        owner_key = self._owner_key(wheel.owner)
+        async with self._writer.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(owner_key)
+                    owned = await cast("Awaitable[int]", pipe.scard(owner_key))
+                    if owned >= max_owned:
+                        raise QuotaExceededError(
+                            f"User {wheel.owner} already owns {owned} wheels"
+                        )
+
+                    pipe.multi()
+                    pipe.hset(self._wheel_key(wheel.id), mapping=_to_hash(wheel))
+                    pipe.sadd(self._index_key, str(wheel.id))
+                    pipe.sadd(owner_key, str(wheel.id))
+                    await self._append_change(
+                        pipe,
+                        wheel.id,
+                        ChangeType.CREATE,
+                        _to_hash(wheel),
+                    )
+                    await pipe.execute()
+                    return
+                except WatchError:
+                    _logger.debug("Owner index of %d changed, retrying", wheel.owner)
+
+    @timed(_redis_latency.labels("update_wheel_name"))
+    async def update_wheel_name(self, wheel_id: UUID, /, *, name: str) -> None:
+        await self._update_field(wheel_id, "name", name)
+
+    @timed(_redis_latency.labels("update_wheel_drinks"))
+    async def update_wheel_drinks(self, wheel_id: UUID, /, *, drinks: Drinks) -> None:
+        await self._update_field(
+            wheel_id,
+            "drinks",
+            _drinks_adapter.dump_json(drinks).decode("utf-8"),
         )
-        await self.create_wheel(new_wheel)
 
-    async def delete_wheel(self, wheel_id: UUID, /) -> None:
-        await self._client.delete(f"{self._prefix}:wheel:{wheel_id}")
+    @timed(_redis_latency.labels("delete_wheel"))
+    async def delete_wheel(self, wheel_id: UUID, /, *, owner: int) -> None:
+        if self._pending.pop(wheel_id, None) is not None:
+            self._pending_updates -= self._pending_counts.pop(wheel_id)
+        async with self._writer.pipeline(transaction=True) as pipe:
+            pipe.delete(self._wheel_key(wheel_id))
+            pipe.srem(self._index_key, str(wheel_id))
+            pipe.srem(self._owner_key(owner), str(wheel_id))
+            await self._append_change(
+                pipe,
+                wheel_id,
+                ChangeType.DELETE,
+                {"owner": str(owner)},
+            )
+            await pipe.execute()
+
+    def pool_stats(self) -> PoolStats:
+        reads = pool_stats(self._client)
+        writes = pool_stats(self._writer)
+        return PoolStats(
+            max_connections=reads.max_connections + writes.max_connections,
+            in_use=reads.in_use + writes.in_use,
+            idle=reads.idle + writes.idle,
+        )
 
     async def close(self) -> None:
-        await self._client.aclose()
+        if task := self._flush_task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        try:
+            await self.flush()
+        finally:
+            await self._replicas.aclose()
+            await self._client.aclose()
+            await self._writer.aclose()
@@ -0,0 +1,87 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable, Hashable
+    from datetime import timedelta
+
+_LOG = logging.getLogger(__name__)
+
+
+class Scheduler[K: Hashable]:
+    # A single task serves the deadlines of all keys. Rescheduling or cancelling a
+    # key doesn't touch the heap, outdated entries are skipped once they come up.
+
+    def __init__(self, callback: Callable[[K], Awaitable[None]]) -> None:
+        self._callback = callback
+        self._heap: list[tuple[float, int, K]] = []
+        self._current: dict[K, int] = {}
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+        self._running: set[asyncio.Task[None]] = set()
+
+    def __len__(self) -> int:
+        return len(self._current)
+
+    def schedule(self, key: K, delay: timedelta) -> None:
+        deadline = asyncio.get_running_loop().time() + delay.total_seconds()
+        sequence = next(self._sequence)
+        self._current[key] = sequence
+        heapq.heappush(self._heap, (deadline, sequence, key))
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        elif self._heap[0][1] == sequence:
+            self._wakeup.set()
+
+    def cancel(self, key: K) -> bool:
+        return self._current.pop(key, None) is not None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        heap = self._heap
+        current = self._current
+        while True:
+            while heap and current.get(heap[0][2]) != heap[0][1]:
+                heapq.heappop(heap)
+
+            self._wakeup.clear()
+            if not heap:
+                await self._wakeup.wait()
+                continue
+
+            deadline, _, key = heap[0]
+            delay = deadline - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(heap)
+            del current[key]
+            task = asyncio.create_task(self._fire(key))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _fire(self, key: K) -> None:
+        try:
+            await self._callback(key)
+        except Exception as e:
+            _LOG.error("Scheduled callback for %s failed", key, exc_info=e)
+
+    async def close(self) -> None:
+        tasks = [*self._running]
+        if task := self._task:
+            tasks.append(task)
+            self._task = None
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+from uuid import UUID
+
+from misfortune.api.model import Drinks, InternalWheel
+from misfortune.api.repo import ChangeType
+from misfortune.shared_model import Drink
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from datetime import timedelta
+    from pathlib import Path
+
+    from misfortune.api.repo import ChangeLogEntry, Repository, WheelChanges
+
+_LOG = logging.getLogger(__name__)
+
+# Little endian layout, strings are stored as their UTF-8 length followed by the data:
+#   header: magic, format version, repository revision, wheel count, CRC32 of the body
+#   wheel: id, owner, drink count, name
+#   drink: id, name
+_MAGIC = b"MWSN"
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sHQII")
+_WHEEL = struct.Struct("<16sqI")
+_DRINK_ID = struct.Struct("<16s")
+_LENGTH = struct.Struct("<I")
+
+
+@dataclass(frozen=True, kw_only=True)
+class WheelSnapshot:
+    # All changes up to this repository revision are contained
+    revision: int
+    wheels: dict[UUID, InternalWheel]
+
+    def apply(self, changes: WheelChanges) -> WheelSnapshot:
+        wheels = self.wheels | {wheel.id: wheel for wheel in changes.wheels}
+        for wheel_id in changes.deleted:
+            wheels.pop(wheel_id, None)
+
+        return WheelSnapshot(revision=changes.revision, wheels=wheels)
+
+    def replay(self, entries: Iterable[ChangeLogEntry]) -> WheelSnapshot:
+        wheels = dict(self.wheels)
+        revision = self.revision
+        for entry in entries:
+            revision = entry.revision
+            wheel_id = entry.wheel_id
+            match entry.type:
+                case ChangeType.CREATE:
+                    wheels[wheel_id] = InternalWheel.model_construct(
+                        id=wheel_id,
+                        name=entry.name,
+                        owner=entry.owner,
+                        drinks=entry.drinks,
+                    )
+                case ChangeType.RENAME if wheel := wheels.get(wheel_id):
+                    wheels[wheel_id] = wheel.model_copy(update={"name": entry.name})
+                case ChangeType.DRINKS if wheel := wheels.get(wheel_id):
+                    wheels[wheel_id] = wheel.model_copy(update={"drinks": entry.drinks})
+                case ChangeType.DELETE:
+                    wheels.pop(wheel_id, None)
+
+        return WheelSnapshot(revision=revision, wheels=wheels)
+
+
+async def fetch_snapshot(repo: Repository) -> WheelSnapshot:
+    # Changes made during the fetch are after the revision, so they are fetched
+    # again later.
+    revision, wheels = await repo.fetch_wheels_at_revision()
+    return WheelSnapshot(
+        revision=revision,
+        wheels={wheel.id: wheel for wheel in wheels},
+    )
+
+
+def _encode_string(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    return _LENGTH.pack(len(raw)) + raw
+
+
+def dump_snapshot(snapshot: WheelSnapshot) -> bytes:
+    parts = []
+    for wheel in snapshot.wheels.values():
+        parts.append(_WHEEL.pack(wheel.id.bytes, wheel.owner, len(wheel.drinks)))
+        parts.append(_encode_string(wheel.name))
+        for drink in wheel.drinks:
+            parts.append(_DRINK_ID.pack(drink.id.bytes))
+            parts.append(_encode_string(drink.name))
+
+    body = b"".join(parts)
+    header = _HEADER.pack(
+        _MAGIC,
+        _FORMAT_VERSION,
+        snapshot.revision,
+        len(snapshot.wheels),
+        zlib.crc32(body),
+    )
+    return header + body
+
+
+def _decode_string(buffer: bytes | memoryview, offset: int) -> tuple[str, int]:
+    (length,) = _LENGTH.unpack_from(buffer, offset)
+    start = offset + _LENGTH.size
+    end = start + length
+    if end > len(buffer):
+        raise ValueError("Snapshot is truncated")
+
+    return str(buffer[start:end], "utf-8"), end
+
+
+def load_snapshot(buffer: bytes | memoryview) -> WheelSnapshot:
+    magic, version, revision, count, checksum = _HEADER.unpack_from(buffer)
+    if magic != _MAGIC or version != _FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {magic!r} {version}")
+
+    if zlib.crc32(buffer[_HEADER.size :]) != checksum:
+        raise ValueError("Snapshot checksum does not match")
+
+    # The wheels were validated before they were written, so they are only
+    # constructed here.
+    wheels = {}
+    offset = _HEADER.size
+    for _ in range(count):
+        raw_id, owner, drink_count = _WHEEL.unpack_from(buffer, offset)
+        name, offset = _decode_string(buffer, offset + _WHEEL.size)
+        drinks = []
+        for _ in range(drink_count):
+            (raw_drink_id,) = _DRINK_ID.unpack_from(buffer, offset)
+            drink_name, offset = _decode_string(buffer, offset + _DRINK_ID.size)
+            drinks.append(
+                Drink.model_construct(name=drink_name, id=UUID(bytes=raw_drink_id))
+            )
+
+        wheel_id = UUID(bytes=raw_id)
+        wheels[wheel_id] = InternalWheel.model_construct(
+            id=wheel_id,
+            name=name,
+            owner=owner,
+            drinks=Drinks(drinks),
+        )
+
+    return WheelSnapshot(revision=revision, wheels=wheels)
+
+
+def read_snapshot(path: Path) -> WheelSnapshot | None:
+    try:
+        file = path.open("rb")
+    except FileNotFoundError:
+        return None
+
+    with file:
+        if os.fstat(file.fileno()).st_size < _HEADER.size:
+            _LOG.warning("Ignoring truncated snapshot %s", path)
+            return None
+
+        # The view is released explicitly, a logged traceback may still reference it
+        with (
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped,
+            memoryview(mapped) as buffer,
+        ):
+            try:
+                return load_snapshot(buffer)
+            except (ValueError, struct.error) as e:
+                _LOG.warning("Ignoring unreadable snapshot %s", path, exc_info=e)
+                return None
+
+
+def write_snapshot(path: Path, snapshot: WheelSnapshot) -> None:
+    # Replaced atomically, so a crash while writing leaves the previous snapshot
+    temp_path = path.with_name(f"{path.name}.tmp")
+    with temp_path.open("wb") as file:
+        file.write(dump_snapshot(snapshot))
+        file.flush()
+        os.fsync(file.fileno())
+
+    temp_path.replace(path)
+
+
+class SnapshotManager:
+    def __init__(self, repo: Repository, *, path: Path, interval: timedelta) -> None:
+        self._repo = repo
+        self._path = path
+        self._interval = interval.total_seconds()
+        self._snapshot: WheelSnapshot | None = None
+        self._saved_revision: int | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    async def _reconcile(self, snapshot: WheelSnapshot) -> WheelSnapshot:
+        changes = await self._repo.fetch_changes(since=snapshot.revision)
+        if changes is None:
+            _LOG.warning("Snapshot is newer than the repository, reloading all wheels")
+            return await fetch_snapshot(self._repo)
+
+        return snapshot.apply(changes)
+
+    async def load(self) -> Iterable[InternalWheel]:
+        snapshot = await asyncio.to_thread(read_snapshot, self._path)
+        if snapshot is None:
+            snapshot = await fetch_snapshot(self._repo)
+        else:
+            revision = self._saved_revision = snapshot.revision
+            snapshot = await self._reconcile(snapshot)
+            _LOG.info(
+                "Loaded %d wheels from snapshot at revision %d (now %d)",
+                len(snapshot.wheels),
+                revision,
+                snapshot.revision,
+            )
+
+        self._snapshot = snapshot
+        return snapshot.wheels.values()
+
+    async def save(self) -> None:
+        current = self._snapshot
+        if current is None:
+            return
+
+        snapshot = await self._reconcile(current)
+        self._snapshot = snapshot
+        if snapshot.revision != self._saved_revision:
+            await asyncio.to_thread(write_snapshot, self._path, snapshot)
+            self._saved_revision = snapshot.revision
+
+    async def _save_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.save()
+            except Exception as e:
+                _LOG.error("Could not save wheel snapshot", exc_info=e)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._save_periodically())
+
+    async def close(self) -> None:
+        if task := self._task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        # Pending writes are flushed first, so the last snapshot contains them
+        try:
+            await self._repo.flush()
+            await self.save()
+        except Exception as e:
+            _LOG.error("Could not save wheel snapshot on shutdown", exc_info=e)
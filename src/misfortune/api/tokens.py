@@ -0,0 +1,52 @@
+import hashlib
+import time
+from typing import Any
+
+import jwt
+
+
+class VerifiedTokenCache:
+    # Remembers the claims of tokens that passed verification, keyed by a digest of
+    # the token, so repeated logins with the same token skip the HMAC check.
+
+    def __init__(self, *, max_size: int, algorithm: str = "HS256") -> None:
+        self._max_size = max_size
+        self._algorithm = algorithm
+        self._secret: str | None = None
+        self._entries: dict[bytes, tuple[float, dict[str, Any]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def decode(self, token: str, *, secret: str) -> dict[str, Any]:
+        if secret != self._secret:
+            # Tokens verified with a previous secret must be verified again
+            self._entries.clear()
+            self._secret = secret
+
+        entries = self._entries
+        digest = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        entry = entries.pop(digest, None)
+        if entry is not None:
+            expires_at, payload = entry
+            if expires_at > time.time():
+                # Moves the entry to the end of the eviction order
+                entries[digest] = entry
+                self.hits += 1
+                return payload
+
+        self.misses += 1
+        payload = jwt.decode(token, secret, algorithms=[self._algorithm])
+
+        # Tokens without an expiry are never cached
+        if isinstance(exp := payload.get("exp"), int | float):
+            entries[digest] = (exp, payload)
+            if len(entries) > self._max_size:
+                del entries[next(iter(entries))]
+
+        return payload
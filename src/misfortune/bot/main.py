@@ -34,6 +34,7 @@ from telegram.ext import (
 from misfortune.bot.model import UserState
 from misfortune.bot.repo import Repository
 from misfortune.config import Config, init_config
+from misfortune.sharding import HashRing, ShardRoutingTransport
 from misfortune.shared_model import (
     Drink,
     TelegramWheel,
@@ -61,9 +62,12 @@ class MisfortuneBot:
         user_states: dict[int, UserState],
     ) -> None:
         self.telegram = telegram_bot
+        members = config.sharding.members
         self._api = httpx.AsyncClient(
             base_url=config.api_url,
             headers=dict(Authorization=f"Bearer {config.internal_token}"),
+            # Wheel requests skip the forwarding by going to the owner directly
+            transport=ShardRoutingTransport(HashRing(members)) if members else None,
         )
         self._repo = repo
         self._max_wheels = config.max_user_wheels
@@ -641,6 +645,7 @@ def run():
     )
 
     with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+        runner.run(repo.migrate())
         user_states = runner.run(repo.load_user_states())
         bot = MisfortuneBot(app.bot, config, repo, user_states)
 
@@ -1,48 +1,84 @@
-import asyncio
-from typing import TYPE_CHECKING
+import logging
+from typing import TYPE_CHECKING, cast
 
-from redis.asyncio import Redis
+from more_itertools import chunked
 
 from misfortune.bot.model import UserState
+from misfortune.redis_pool import PoolStats, create_client, pool_stats
 
 if TYPE_CHECKING:
+    from collections.abc import Awaitable, Iterable
+
     from misfortune.config import RepoConfig
 
+_logger = logging.getLogger(__name__)
+
 
 class Repository:
+    _BATCH_SIZE = 500
+    _SCHEMA_VERSION = 1
+
     def __init__(self, config: RepoConfig) -> None:
-        self._client = Redis(
-            host=config.host,
-            username=config.username,
-            password=config.password,
-            protocol=3,
-        )
+        # Not read from the replicas: the states loaded on startup are kept and
+        # written back, so a stale one would overwrite a newer state.
+        self._client = create_client(config)
         self._prefix = f"{config.username}:bot"
 
-    async def __fetch_state(self, user_id: int) -> UserState:
-        raw = await self._client.get(f"{self._prefix}:user_state:{user_id}")
-        if raw is None:
-            raise RuntimeError(f"No state for user {user_id}")
+    def _state_key(self, user_id: int) -> str:
+        return f"{self._prefix}:user_state:{user_id}"
 
-        return UserState.model_validate_json(raw)
+    @property
+    def _index_key(self) -> str:
+        return f"{self._prefix}:user_states"
 
-    async def load_user_states(self) -> dict[int, UserState]:
-        user_ids = set()
+    async def migrate(self) -> None:
+        version_key = f"{self._prefix}:schema_version"
+        version = int(await self._client.get(version_key) or 0)
+        if version >= self._SCHEMA_VERSION:
+            return
+
+        if version < 1:
+            await self._build_index()
+
+        await self._client.set(version_key, self._SCHEMA_VERSION)
+
+    async def _build_index(self) -> None:
+        _logger.info("Building user state index from existing keys")
+        user_ids = []
         async for key in self._client.scan_iter(match=f"{self._prefix}:user_state:*"):
-            user_ids.add(int(key.decode("utf-8").split(":")[-1]))
+            user_ids.append(key.decode("utf-8").split(":")[-1])
+
+        for batch in chunked(user_ids, self._BATCH_SIZE):
+            await cast("Awaitable[int]", self._client.sadd(self._index_key, *batch))
 
+    async def load_user_states(self) -> dict[int, UserState]:
+        raw_ids = await cast(
+            "Awaitable[set[bytes]]",
+            self._client.smembers(self._index_key),
+        )
+        return await self._fetch_states(int(raw_id) for raw_id in raw_ids)
+
+    async def _fetch_states(self, user_ids: Iterable[int]) -> dict[int, UserState]:
         result = {}
+        for batch in chunked(user_ids, self._BATCH_SIZE):
+            raws = await self._client.mget([self._state_key(i) for i in batch])
+            for user_id, raw in zip(batch, raws, strict=True):
+                if raw is None:
+                    _logger.warning("Indexed state of user %d does not exist", user_id)
+                    continue
 
-        async with asyncio.TaskGroup() as tg:
-            for user_id in user_ids:
-                result[user_id] = tg.create_task(self.__fetch_state(user_id))
+                result[user_id] = UserState.model_validate_json(raw)
 
-        return {user_id: task.result() for user_id, task in result.items()}
+        return result
 
     async def update_user_state(self, user_id: int, state: UserState) -> None:
-        await self._client.set(
-            f"{self._prefix}:user_state:{user_id}", state.model_dump_json()
-        )
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.set(self._state_key(user_id), state.model_dump_json())
+            pipe.sadd(self._index_key, user_id)
+            await pipe.execute()
+
+    def pool_stats(self) -> PoolStats:
+        return pool_stats(self._client)
 
     async def close(self) -> None:
         await self._client.aclose()
@@ -1,5 +1,7 @@
+import enum
 import logging
 from dataclasses import dataclass
+from datetime import timedelta
 from pathlib import Path
 from typing import Self
 
@@ -13,13 +15,204 @@ class RepoConfig:
     host: str
     username: str | None
     password: str | None
+    max_connections: int = 50
+    pool_timeout: timedelta = timedelta(seconds=2)
+    socket_timeout: timedelta | None = timedelta(seconds=5)
+    connect_timeout: timedelta = timedelta(seconds=2)
+    health_check_interval: timedelta = timedelta(seconds=30)
+    retries: int = 2
+    # Wheel updates are buffered and flushed in this interval, or once this many
+    # are pending. Only the buffering process sees them before, so every wheel must
+    # be written by a single process, as with sharding or the memory backend.
+    write_behind_interval: timedelta | None = None
+    write_behind_batch_size: int = 100
+    # The change log is trimmed to roughly this many entries
+    changelog_max_length: int = 10_000
+    # How often the change log is compacted into a snapshot of all wheels
+    changelog_compaction_interval: timedelta | None = timedelta(minutes=10)
+    # Bulk reads which tolerate some staleness are spread over these replicas
+    replica_hosts: tuple[str, ...] = ()
+    # Replicas whose replication offset is further behind the primary are skipped
+    replica_max_lag_bytes: int = 64 * 1024
 
     @classmethod
     def from_env(cls, env: Env) -> Self:
+        socket_timeout_ms = env.get_int("socket-timeout-ms", default=5000)
+        write_behind_ms = env.get_int("write-behind-interval-ms")
+        compaction_seconds = env.get_int(
+            "changelog-compaction-interval-seconds",
+            default=600,
+        )
+        replica_hosts = env.get_string("replica-hosts", default="")
         return cls(
             host=env.get_string("host", required=True),
             username=env.get_string("username"),
             password=env.get_string("password"),
+            max_connections=env.get_int("max-connections", default=50),
+            pool_timeout=timedelta(
+                milliseconds=env.get_int("pool-timeout-ms", default=2000),
+            ),
+            socket_timeout=(
+                timedelta(milliseconds=socket_timeout_ms) if socket_timeout_ms else None
+            ),
+            connect_timeout=timedelta(
+                milliseconds=env.get_int("connect-timeout-ms", default=2000),
+            ),
+            health_check_interval=timedelta(
+                seconds=env.get_int("health-check-interval-seconds", default=30),
+            ),
+            retries=env.get_int("retries", default=2),
+            write_behind_interval=(
+                timedelta(milliseconds=write_behind_ms) if write_behind_ms else None
+            ),
+            write_behind_batch_size=env.get_int(
+                "write-behind-batch-size",
+                default=100,
+            ),
+            changelog_max_length=env.get_int("changelog-max-length", default=10_000),
+            changelog_compaction_interval=(
+                timedelta(seconds=compaction_seconds) if compaction_seconds else None
+            ),
+            replica_hosts=tuple(
+                host.strip() for host in replica_hosts.split(",") if host.strip()
+            ),
+            replica_max_lag_bytes=env.get_int(
+                "replica-max-lag-bytes",
+                default=64 * 1024,
+            ),
+        )
+
+
+class StateBackend(enum.Enum):
+    # Wheel states only live in the process, so the API must run as a single worker
+    MEMORY = "memory"
+    # Wheel states are shared between workers and replicas through Redis
+    REDIS = "redis"
+
+
+class OverflowPolicy(enum.Enum):
+    # Discard the oldest pending value, so the subscriber only skips intermediate
+    # values and eventually receives the latest one.
+    CONFLATE = "conflate"
+    # Stop delivering to the subscriber and invoke its overflow callback.
+    DISCONNECT = "disconnect"
+
+
+class WheelLoading(enum.Enum):
+    # All wheels are loaded on startup
+    EAGER = "eager"
+    # Wheels are loaded on first access and evicted again when idle
+    LAZY = "lazy"
+
+
+@dataclass(frozen=True, kw_only=True)
+class BroadcastConfig:
+    queue_size: int
+    overflow_policy: OverflowPolicy
+
+    @classmethod
+    def from_env(cls, env: Env) -> Self:
+        return cls(
+            queue_size=env.get_int("queue-size", default=16),
+            overflow_policy=OverflowPolicy(
+                env.get_string("overflow-policy", default="conflate")
+            ),
+        )
+
+
+@dataclass(frozen=True, kw_only=True)
+class HeartbeatConfig:
+    # Dead connections of displays without heartbeats are closed by the websocket
+    # pings of uvicorn instead, see --ws-ping-interval and --ws-ping-timeout.
+
+    # How often displays that opted into heartbeats are pinged
+    interval: timedelta
+    # Displays that didn't send anything for this long are disconnected
+    timeout: timedelta
+
+    @classmethod
+    def from_env(cls, env: Env) -> Self:
+        return cls(
+            interval=timedelta(
+                seconds=env.get_int("interval-seconds", default=20),
+            ),
+            timeout=timedelta(
+                seconds=env.get_int("timeout-seconds", default=60),
+            ),
+        )
+
+
+@dataclass(frozen=True, kw_only=True)
+class RegistrationConfig:
+    max_pending: int
+    max_pending_per_client: int
+    timeout: timedelta
+
+    @classmethod
+    def from_env(cls, env: Env) -> Self:
+        return cls(
+            max_pending=env.get_int("max-pending", default=1000),
+            max_pending_per_client=env.get_int("max-pending-per-client", default=10),
+            timeout=timedelta(
+                seconds=env.get_int("timeout-seconds", default=20 * 60),
+            ),
+        )
+
+
+@dataclass(frozen=True, kw_only=True)
+class ShardingConfig:
+    # Base URLs of all API instances. If set, every wheel is owned by one of them,
+    # requests for wheels of other members are forwarded to the owner.
+    members: tuple[str, ...]
+    # The base URL of this instance, as listed in the members
+    member: str | None
+
+    @classmethod
+    def from_env(cls, env: Env) -> Self:
+        members = env.get_string("members", default="")
+        return cls(
+            members=tuple(
+                member.strip() for member in members.split(",") if member.strip()
+            ),
+            member=env.get_string("member"),
+        )
+
+
+@dataclass(frozen=True, kw_only=True)
+class SnapshotConfig:
+    # Eagerly loaded wheels are written to this file periodically and on shutdown.
+    # On startup, only the wheels changed since the snapshot are read from Redis.
+    path: Path | None
+    interval: timedelta
+
+    @classmethod
+    def from_env(cls, env: Env) -> Self:
+        return cls(
+            path=env.get_string("path", transform=Path),
+            interval=timedelta(
+                seconds=env.get_int("interval-seconds", default=300),
+            ),
+        )
+
+
+@dataclass(frozen=True, kw_only=True)
+class SpinConfig:
+    # The wheel is assumed to slow down linearly, so a spin lasts speed / deceleration
+    deceleration: float
+    # Added to the computed spin duration before the wheel is unlocked automatically
+    unlock_delay: timedelta
+    max_duration: timedelta
+
+    @classmethod
+    def from_env(cls, env: Env) -> Self:
+        return cls(
+            deceleration=float(env.get_string("deceleration", default="1.0")),
+            unlock_delay=timedelta(
+                milliseconds=env.get_int("unlock-delay-ms", default=2000),
+            ),
+            max_duration=timedelta(
+                seconds=env.get_int("max-duration-seconds", default=60),
+            ),
         )
 
 
@@ -27,35 +220,75 @@ class RepoConfig:
 class Config:
     api_url: str
     app_version: str
+    broadcast: BroadcastConfig
+    heartbeat: HeartbeatConfig
     internal_token: str
     jwt_secret: str
+    # Enables the lock instrumentation of wheel states, holds longer than this are
+    # logged as warnings.
+    lock_hold_warning: timedelta | None
+    max_loaded_wheels: int
     max_user_wheels: int
     max_wheel_name_length: int
     nats: NatsConfig
+    registration: RegistrationConfig
     run_signal_file: Path | None
     sentry_dsn: str | None
+    sharding: ShardingConfig
+    snapshot: SnapshotConfig
+    spin: SpinConfig
     repo: RepoConfig
+    state_backend: StateBackend
     telegram_token: str
     telegram_bot_name: str
+    token_cache_size: int
+    # Peers whose X-Forwarded-For header identifies the client, like the ingress
+    # controller. Addresses, networks or "*".
+    trusted_proxies: tuple[str, ...]
+    wheel_loading: WheelLoading
 
     @classmethod
     def from_env(cls, env: Env) -> Self:
+        lock_hold_warning_ms = env.get_int("lock-hold-warning-ms")
+        trusted_proxies = env.get_string("trusted-proxies", default="")
         return cls(
             api_url=env.get_string("api-url", default="https://api.bembel.party"),
             app_version=env.get_string("app-version", default="dev"),
+            broadcast=BroadcastConfig.from_env(env / "broadcast"),
+            heartbeat=HeartbeatConfig.from_env(env / "heartbeat"),
             internal_token=env.get_string("internal-token", required=True),
             jwt_secret=env.get_string("jwt-secret", required=True),
+            lock_hold_warning=(
+                timedelta(milliseconds=lock_hold_warning_ms)
+                if lock_hold_warning_ms
+                else None
+            ),
+            max_loaded_wheels=env.get_int("max-loaded-wheels", default=10_000),
             max_user_wheels=env.get_int("max-user-wheels", default=5),
             max_wheel_name_length=env.get_int("max-wheel-name-length", default=64),
             nats=NatsConfig.from_env(env / "nats"),
+            registration=RegistrationConfig.from_env(env / "registration"),
             run_signal_file=env.get_string("run-signal-file", transform=Path),
             sentry_dsn=env.get_string("sentry-dsn"),
+            sharding=ShardingConfig.from_env(env / "sharding"),
+            snapshot=SnapshotConfig.from_env(env / "snapshot"),
+            spin=SpinConfig.from_env(env / "spin"),
             repo=RepoConfig.from_env(env / "repo"),
+            state_backend=StateBackend(
+                env.get_string("state-backend", default="memory")
+            ),
             telegram_bot_name=env.get_string(
                 "telegram-bot-name",
                 default="misfortune_bot",
             ),
             telegram_token=env.get_string("telegram-token", required=True),
+            token_cache_size=env.get_int("token-cache-size", default=10_000),
+            trusted_proxies=tuple(
+                proxy.strip() for proxy in trusted_proxies.split(",") if proxy.strip()
+            ),
+            wheel_loading=WheelLoading(
+                env.get_string("wheel-loading", default="eager")
+            ),
         )
 
     def basic_setup(self) -> None:
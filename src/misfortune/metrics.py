@@ -0,0 +1,242 @@
+import functools
+import time
+from bisect import bisect_left
+from collections.abc import Awaitable, Callable, Iterable
+from typing import Literal
+
+# Metrics are rendered in the Prometheus text exposition format. Observations only
+# increment preallocated counters, all formatting happens when the metrics are
+# scraped.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+type Samples = float | Iterable[tuple[tuple[str, ...], float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)
+    )
+    return f"{{{pairs}}}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return str(value)
+
+
+class Histogram:
+    __slots__ = ("_bounds", "_buckets", "count", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self._bounds = bounds
+        # The last bucket counts the observations above the highest bound
+        self._buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self._buckets[bisect_left(self._bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> Iterable[tuple[float, int]]:
+        total = 0
+        for bound, count in zip(
+            (*self._bounds, float("inf")),
+            self._buckets,
+            strict=True,
+        ):
+            total += count
+            yield bound, total
+
+
+class HistogramFamily:
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        *,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._buckets = buckets
+        self._children: dict[tuple[str, ...], Histogram] = {}
+
+    def labels(self, *values: str) -> Histogram:
+        # Callers on hot paths should keep the returned child instead of looking it
+        # up for every observation.
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"Expected labels {self.label_names}, got {values}")
+            child = self._children[values] = Histogram(self._buckets)
+
+        return child
+
+    def remove(self, *values: str) -> None:
+        self._children.pop(values, None)
+
+    def render(self) -> Iterable[str]:
+        name = self.name
+        yield f"# HELP {name} {self.description}"
+        yield f"# TYPE {name} histogram"
+        names = self.label_names
+        bucket_names = (*names, "le")
+        for values, histogram in self._children.items():
+            for bound, count in histogram.cumulative():
+                labels = _format_labels(bucket_names, (*values, _format_value(bound)))
+                yield f"{name}_bucket{labels} {count}"
+
+            labels = _format_labels(names, values)
+            yield f"{name}_sum{labels} {_format_value(histogram.sum)}"
+            yield f"{name}_count{labels} {histogram.count}"
+
+
+class CallbackMetric:
+    # Gauges and counters which are already tracked elsewhere are read on scrape
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        *,
+        kind: Literal["counter", "gauge"],
+        callback: Callable[[], Samples],
+        label_names: tuple[str, ...] = (),
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self.label_names = label_names
+        self._callback = callback
+
+    def render(self) -> Iterable[str]:
+        name = self.name
+        yield f"# HELP {name} {self.description}"
+        yield f"# TYPE {name} {self.kind}"
+        samples = self._callback()
+        if isinstance(samples, int | float):
+            yield f"{name} {_format_value(samples)}"
+            return
+
+        for values, value in samples:
+            labels = _format_labels(self.label_names, values)
+            yield f"{name}{labels} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, HistogramFamily | CallbackMetric] = {}
+
+    def _register[M: HistogramFamily | CallbackMetric](self, metric: M) -> M:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+
+        self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        *,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> HistogramFamily:
+        return self._register(
+            HistogramFamily(
+                name,
+                description,
+                label_names=label_names,
+                buckets=buckets,
+            )
+        )
+
+    def gauge(
+        self,
+        name: str,
+        description: str,
+        callback: Callable[[], Samples],
+        *,
+        label_names: tuple[str, ...] = (),
+    ) -> CallbackMetric:
+        return self._register(
+            CallbackMetric(
+                name,
+                description,
+                kind="gauge",
+                callback=callback,
+                label_names=label_names,
+            )
+        )
+
+    def counter(
+        self,
+        name: str,
+        description: str,
+        callback: Callable[[], Samples],
+        *,
+        label_names: tuple[str, ...] = (),
+    ) -> CallbackMetric:
+        return self._register(
+            CallbackMetric(
+                name,
+                description,
+                kind="counter",
+                callback=callback,
+                label_names=label_names,
+            )
+        )
+
+    def render(self) -> str:
+        lines = [line for metric in self._metrics.values() for line in metric.render()]
+        lines.append("")
+        return "\n".join(lines)
+
+
+registry = MetricsRegistry()
+
+
+def timed[**P, R](
+    histogram: Histogram,
+) -> Callable[[Callable[P, Awaitable[R]]], Callable[P, Awaitable[R]]]:
+    def _decorator(func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+        @functools.wraps(func)
+        async def _wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        return _wrapper
+
+    return _decorator
@@ -1,12 +1,179 @@
 import abc
 import asyncio
 import logging
+import time
 from collections.abc import AsyncIterator, Awaitable, Callable
-from contextlib import asynccontextmanager
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import TYPE_CHECKING, Any, cast
+
+from redis.exceptions import LockError, LockNotOwnedError
+
+from misfortune.config import OverflowPolicy
+from misfortune.metrics import registry
+from misfortune.redis_pool import PoolStats, create_client, pool_stats
+
+if TYPE_CHECKING:
+    from redis.asyncio.client import PubSub
+
+    from misfortune.config import RepoConfig
 
 _LOG = logging.getLogger(__name__)
 
 type Listener[T] = Callable[[T], Awaitable[None]]
+type Encoder[T, P] = Callable[[T], P]
+
+
+@dataclass
+class PayloadStats:
+    encoded: int = 0
+    reused: int = 0
+
+
+payload_stats = PayloadStats()
+
+
+@dataclass
+class QueueStats:
+    dropped: int = 0
+
+
+queue_stats = QueueStats()
+
+registry.counter(
+    "misfortune_payloads_encoded_total",
+    "State payloads which had to be encoded",
+    lambda: payload_stats.encoded,
+)
+registry.counter(
+    "misfortune_payloads_reused_total",
+    "State payloads which were reused from the cache",
+    lambda: payload_stats.reused,
+)
+registry.counter(
+    "misfortune_broadcast_dropped_total",
+    "Values which queued listeners skipped or never delivered",
+    lambda: queue_stats.dropped,
+)
+
+_fanout_latency = registry.histogram(
+    "misfortune_broadcast_fanout_seconds",
+    "Time to hand a new value to all listeners of an observable",
+).labels()
+
+_lock_wait = registry.histogram(
+    "misfortune_lock_wait_seconds",
+    "Time waited for the update lock of an observable",
+    label_names=("observable",),
+)
+_lock_hold = registry.histogram(
+    "misfortune_lock_hold_seconds",
+    "Time the update lock of an observable was held",
+    label_names=("observable",),
+)
+_lock_queue_depth = registry.histogram(
+    "misfortune_lock_queue_depth",
+    "Tasks holding or waiting for the update lock when another one arrives",
+    label_names=("observable",),
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64),
+)
+_notification_latency = registry.histogram(
+    "misfortune_listener_notification_seconds",
+    "Time to notify the listeners of an observable about a new value",
+    label_names=("observable",),
+)
+
+
+class LockMonitor:
+    def __init__(self, name: str, *, hold_warning: timedelta) -> None:
+        self._name = name
+        self._hold_warning = hold_warning.total_seconds()
+        self._wait = _lock_wait.labels(name)
+        self._hold = _lock_hold.labels(name)
+        self._queue_depth = _lock_queue_depth.labels(name)
+        self._notification = _notification_latency.labels(name)
+        self._pending = 0
+
+    @asynccontextmanager
+    async def track(
+        self,
+        lock: AbstractAsyncContextManager[Any],
+    ) -> AsyncIterator[None]:
+        self._queue_depth.observe(self._pending)
+        self._pending += 1
+        start = time.perf_counter()
+        try:
+            async with lock:
+                acquired = time.perf_counter()
+                self._wait.observe(acquired - start)
+                try:
+                    yield
+                finally:
+                    held = time.perf_counter() - acquired
+                    self._hold.observe(held)
+                    if held > self._hold_warning:
+                        _LOG.warning("Held lock of %s for %.3fs", self._name, held)
+        finally:
+            self._pending -= 1
+
+    def notified(self, duration: float) -> None:
+        self._notification.observe(duration)
+
+
+class LockMonitoring:
+    # Hands out one monitor per observable name, so an observable which is loaded
+    # again continues the series of its predecessor.
+
+    def __init__(self, *, hold_warning: timedelta) -> None:
+        self._hold_warning = hold_warning
+        self._monitors: dict[str, LockMonitor] = {}
+
+    def monitor(self, name: str) -> LockMonitor:
+        monitor = self._monitors.get(name)
+        if monitor is None:
+            monitor = LockMonitor(name, hold_warning=self._hold_warning)
+            self._monitors[name] = monitor
+
+        return monitor
+
+    def release(self, name: str) -> None:
+        if self._monitors.pop(name, None) is not None:
+            for family in (
+                _lock_wait,
+                _lock_hold,
+                _lock_queue_depth,
+                _notification_latency,
+            ):
+                family.remove(name)
+
+
+class _PayloadCache[T]:
+    # Keeps the payloads of the last few values, because queued listeners may still
+    # be delivering an older value after the observable has moved on.
+    def __init__(self, max_values: int = 4) -> None:
+        self._max_values = max_values
+        self._entries: dict[int, tuple[T, dict[Encoder[T, Any], Any]]] = {}
+
+    def get[P](self, value: T, encoder: Encoder[T, P]) -> P:
+        entries = self._entries
+        entry = entries.get(id(value))
+        if entry is None or entry[0] is not value:
+            entry = (value, {})
+            entries[id(value)] = entry
+            if len(entries) > self._max_values:
+                del entries[next(iter(entries))]
+
+        payloads = entry[1]
+        try:
+            payload = payloads[encoder]
+        except KeyError:
+            payload = payloads[encoder] = encoder(value)
+            payload_stats.encoded += 1
+        else:
+            payload_stats.reused += 1
+
+        return payload
 
 
 class Observable[T](abc.ABC):
@@ -15,6 +182,11 @@ class Observable[T](abc.ABC):
     def value(self) -> T:
         pass
 
+    @property
+    @abc.abstractmethod
+    def is_idle(self) -> bool:
+        pass
+
     @abc.abstractmethod
     async def update(self, value: T) -> None:
         pass
@@ -24,6 +196,10 @@ class Observable[T](abc.ABC):
     def atomic(self) -> AsyncIterator[Observable[T]]:
         pass
 
+    @abc.abstractmethod
+    def encode[P](self, value: T, encoder: Encoder[T, P]) -> P:
+        pass
+
     @abc.abstractmethod
     def add_listener(self, listener: Listener[T]) -> None:
         pass
@@ -33,28 +209,63 @@ class Observable[T](abc.ABC):
         pass
 
 
-def observable[T](value: T | None) -> Observable[T]:
-    return _ObservableImpl(value)
+def observable[T](
+    value: T | None,
+    *,
+    monitor: LockMonitor | None = None,
+) -> Observable[T]:
+    return _ObservableImpl(value, monitor=monitor)
+
+
+class Versioned:
+    # Values which bump their version on every change. Observables compare only the
+    # versions of such values, which saves a deep comparison. It must be declared
+    # explicitly, because other values may have an unrelated version, like UUIDs.
+    version: int
+
+
+def _is_unchanged(current: object, value: object) -> bool:
+    if current is value:
+        return True
+
+    if isinstance(current, Versioned) and isinstance(value, Versioned):
+        return current.version == value.version
+
+    return current == value
 
 
 class _ObservableImpl[T](Observable[T]):
-    def __init__(self, value: T | None):
+    def __init__(self, value: T | None, *, monitor: LockMonitor | None = None):
         self._update_lock = asyncio.Lock()
-        self._unsafe = _UnsafeObservableImpl(value)
+        self._monitor = monitor
+        self._unsafe = _UnsafeObservableImpl(value, monitor=monitor)
 
     @property
     def value(self) -> T:
         return self._unsafe.value
 
+    @property
+    def is_idle(self) -> bool:
+        return not self._update_lock.locked() and self._unsafe.is_idle
+
+    def _locked(self) -> AbstractAsyncContextManager[Any]:
+        if monitor := self._monitor:
+            return monitor.track(self._update_lock)
+
+        return self._update_lock
+
     @asynccontextmanager
     async def atomic(self) -> AsyncIterator[Observable[T]]:
-        async with self._update_lock:
+        async with self._locked():
             yield self._unsafe
 
     async def update(self, value: T) -> None:
-        async with self._update_lock:
+        async with self._locked():
             await self._unsafe.update(value)
 
+    def encode[P](self, value: T, encoder: Encoder[T, P]) -> P:
+        return self._unsafe.encode(value, encoder)
+
     def add_listener(self, listener: Listener[T]) -> None:
         self._unsafe.add_listener(listener)
 
@@ -63,11 +274,12 @@ class _ObservableImpl[T](Observable[T]):
 
 
 class _UnsafeObservableImpl[T](Observable[T]):
-    def __init__(self, value: T | None):
+    def __init__(self, value: T | None, *, monitor: LockMonitor | None = None):
         self._value = value
+        self._monitor = monitor
 
         self._listeners: list[Listener[T]] = []
-        self._value = value
+        self._payloads: _PayloadCache[T] = _PayloadCache()
 
     @property
     def value(self) -> T:
@@ -76,26 +288,37 @@ class _UnsafeObservableImpl[T](Observable[T]):
 
         raise ValueError("No initial value set")
 
+    @property
+    def is_idle(self) -> bool:
+        return not self._listeners
+
     @staticmethod
     async def _notify(listener: Listener[T], value: T) -> None:
         try:
             await listener(value)
         except Exception as e:
             _LOG.error("Received exception from listener", exc_info=e)
-            raise asyncio.CancelledError from e
 
     @asynccontextmanager
     async def atomic(self) -> AsyncIterator[Observable[T]]:
         yield self
 
     async def update(self, value: T) -> None:
-        if self._value == value:
+        if _is_unchanged(self._value, value):
             return
 
         self._value = value
+        start = time.perf_counter()
         async with asyncio.TaskGroup() as task_group:
             for listener in self._listeners:
                 task_group.create_task(self._notify(listener, value))
+        duration = time.perf_counter() - start
+        _fanout_latency.observe(duration)
+        if monitor := self._monitor:
+            monitor.notified(duration)
+
+    def encode[P](self, value: T, encoder: Encoder[T, P]) -> P:
+        return self._payloads.get(value, encoder)
 
     def add_listener(self, listener: Listener[T]) -> None:
         self._listeners.append(listener)
@@ -107,3 +330,473 @@ class _UnsafeObservableImpl[T](Observable[T]):
             return False
         else:
             return True
+
+
+class QueuedListener[T]:
+    def __init__(
+        self,
+        listener: Listener[T],
+        *,
+        max_size: int,
+        policy: OverflowPolicy,
+        on_overflow: Callable[[], Awaitable[None]] | None = None,
+    ) -> None:
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+
+        self._listener = listener
+        self._policy = policy
+        self._on_overflow = on_overflow
+        self._queue: asyncio.Queue[T] = asyncio.Queue(max_size)
+        self._task: asyncio.Task[None] | None = None
+        self._is_overflowed = False
+        self.dropped = 0
+
+    def _drop(self, count: int) -> None:
+        self.dropped += count
+        queue_stats.dropped += count
+
+    async def __call__(self, value: T) -> None:
+        self.offer(value)
+
+    def offer(self, value: T) -> None:
+        if self._is_overflowed:
+            self._drop(1)
+            return
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain())
+
+        queue = self._queue
+        if not queue.full():
+            queue.put_nowait(value)
+            return
+
+        match self._policy:
+            case OverflowPolicy.CONFLATE:
+                queue.get_nowait()
+                self._drop(1)
+                queue.put_nowait(value)
+            case OverflowPolicy.DISCONNECT:
+                # The drain task may be stuck on a stalled send, so it is cancelled
+                # instead of being asked to stop.
+                self._is_overflowed = True
+                self._drop(queue.qsize() + 1)
+                self._task.cancel()
+                self._task = asyncio.create_task(self._handle_overflow())
+
+    async def _drain(self) -> None:
+        queue = self._queue
+        while True:
+            value = await queue.get()
+            try:
+                await self._listener(value)
+            except Exception as e:
+                _LOG.error("Received exception from queued listener", exc_info=e)
+
+    async def _handle_overflow(self) -> None:
+        _LOG.warning("Dropping subscriber that could not keep up")
+        if on_overflow := self._on_overflow:
+            try:
+                await on_overflow()
+            except Exception as e:
+                _LOG.error("Received exception from overflow handler", exc_info=e)
+
+    async def close(self) -> None:
+        task = self._task
+        if task is None:
+            return
+
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            if (current := asyncio.current_task()) and current.cancelling():
+                raise
+
+
+@dataclass(frozen=True)
+class Codec[T]:
+    encode: Callable[[T], bytes]
+    decode: Callable[[bytes], T]
+
+
+@dataclass(frozen=True)
+class _Watcher[T]:
+    codec: Codec[T]
+    on_created: Callable[[str, Observable[T]], Awaitable[None]]
+    on_discarded: Callable[[str], Awaitable[None]]
+    monitoring: LockMonitoring | None
+
+
+_DISCARDED_REVISION = -1
+
+# Only writes on top of the expected revision are applied, so a writer whose lock
+# expired can't overwrite a newer value with the same revision. Finding the value
+# already written means the client retried a write which had succeeded.
+_WRITE_SCRIPT = """
+local current = tonumber(redis.call("HGET", KEYS[1], "revision") or "0")
+if current == tonumber(ARGV[2]) and redis.call("HGET", KEYS[1], "value") == ARGV[3] then
+    return -1
+end
+if current ~= tonumber(ARGV[1]) then
+    return current
+end
+redis.call("HSET", KEYS[1], "value", ARGV[3], "revision", ARGV[2])
+redis.call("PUBLISH", KEYS[1], ARGV[2] .. ":" .. ARGV[3])
+return -1
+"""
+
+
+class StaleRevisionError(Exception):
+    pass
+
+
+def _decode_hash[T](raw: dict[bytes, bytes], codec: Codec[T]) -> T | None:
+    payload = raw.get(b"value")
+    if not payload:
+        return None
+
+    return codec.decode(payload)
+
+
+def _hash_revision(raw: dict[bytes, bytes]) -> int:
+    return int(raw.get(b"revision", 0))
+
+
+class RedisObservableHub:
+    # Observables are stored as hashes with a revision and the encoded value. Every
+    # write happens under a distributed lock, is only applied on top of the revision
+    # the writer has seen and is published as "<revision>:<value>" on a channel per
+    # key, where an empty value means the key was discarded.
+
+    def __init__(
+        self,
+        config: RepoConfig,
+        *,
+        lock_timeout: timedelta = timedelta(seconds=10),
+    ) -> None:
+        self._client = create_client(config)
+        self._subscriber = create_client(config, blocking_reads=True)
+        self._write_script = self._client.register_script(_WRITE_SCRIPT)
+        self._prefix = f"{config.username}:api:observable:"
+        self._lock_timeout = lock_timeout.total_seconds()
+        self._observables: dict[str, _RedisObservable[Any]] = {}
+        self._watchers: dict[str, _Watcher[Any]] = {}
+        self._pubsub: PubSub | None = None
+        self._reader: asyncio.Task[None] | None = None
+
+    def _redis_key(self, key: str) -> str:
+        return f"{self._prefix}{key}"
+
+    async def start(self) -> None:
+        pubsub = self._subscriber.pubsub()
+        await pubsub.psubscribe(f"{self._prefix}*")
+        self._pubsub = pubsub
+        self._reader = asyncio.create_task(self._read(pubsub))
+
+    async def close(self) -> None:
+        if reader := self._reader:
+            reader.cancel()
+            try:
+                await reader
+            except asyncio.CancelledError:
+                pass
+
+        if pubsub := self._pubsub:
+            await pubsub.aclose()
+
+        await self._subscriber.aclose()
+        await self._client.aclose()
+
+    def pool_stats(self) -> PoolStats:
+        return pool_stats(self._client)
+
+    def watch[T](
+        self,
+        key_prefix: str,
+        codec: Codec[T],
+        *,
+        on_created: Callable[[str, Observable[T]], Awaitable[None]],
+        on_discarded: Callable[[str], Awaitable[None]],
+        monitoring: LockMonitoring | None = None,
+    ) -> None:
+        self._watchers[key_prefix] = _Watcher(
+            codec,
+            on_created,
+            on_discarded,
+            monitoring,
+        )
+
+    async def observable[T](
+        self,
+        key: str,
+        value: T | None,
+        codec: Codec[T],
+        *,
+        ttl: timedelta | None = None,
+        monitor: LockMonitor | None = None,
+    ) -> Observable[T]:
+        if existing := self._observables.get(key):
+            return existing
+
+        redis_key = self._redis_key(key)
+        payload = b"" if value is None else codec.encode(value)
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.hsetnx(redis_key, "value", payload)  # type: ignore[arg-type]
+            pipe.hsetnx(redis_key, "revision", "0")
+            if ttl is not None:
+                pipe.expire(redis_key, ttl)
+            pipe.hgetall(redis_key)
+            results = await pipe.execute()
+
+        is_created = results[0]
+        if existing := self._observables.get(key):
+            # Announced by another process in the meantime, and already passed to
+            # its watcher, which must keep receiving the updates.
+            return existing
+
+        raw = results[-1]
+        result = _RedisObservable(
+            self,
+            key,
+            codec,
+            _decode_hash(raw, codec),
+            _hash_revision(raw),
+            monitor=monitor,
+        )
+        self._observables[key] = result
+        if is_created:
+            await self._client.publish(redis_key, b"0:" + payload)
+
+        return result
+
+    async def get[T](self, key: str, codec: Codec[T]) -> Observable[T] | None:
+        if existing := self._observables.get(key):
+            return existing
+
+        raw = await self._fetch(key)
+        if not raw:
+            return None
+
+        # Not registered, so it won't receive updates from other processes
+        return _RedisObservable(
+            self,
+            key,
+            codec,
+            _decode_hash(raw, codec),
+            _hash_revision(raw),
+        )
+
+    def release(self, key: str) -> None:
+        # Stops tracking the key in this process without deleting it
+        self._observables.pop(key, None)
+
+    async def discard(self, key: str) -> None:
+        self._observables.pop(key, None)
+        redis_key = self._redis_key(key)
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.delete(redis_key)
+            pipe.publish(redis_key, f"{_DISCARDED_REVISION}:".encode())
+            await pipe.execute()
+
+    @asynccontextmanager
+    async def _lock(self, key: str) -> AsyncIterator[None]:
+        lock = self._client.lock(
+            f"{self._prefix}lock:{key}",
+            timeout=self._lock_timeout,
+            sleep=0.01,
+        )
+        if not await lock.acquire():
+            raise LockError(f"Could not acquire lock of {key}")
+
+        try:
+            yield
+        finally:
+            # Writes check the revision, so an expired lock didn't let them clash
+            try:
+                await lock.release()
+            except LockNotOwnedError:
+                _LOG.warning("Lock of %s expired before it was released", key)
+
+    async def _fetch(self, key: str) -> dict[bytes, bytes]:
+        return await cast(
+            "Awaitable[dict[bytes, bytes]]",
+            self._client.hgetall(self._redis_key(key)),
+        )
+
+    async def _write(self, key: str, revision: int, payload: bytes) -> None:
+        current = await self._write_script(
+            keys=[self._redis_key(key)],
+            args=[revision - 1, revision, payload],
+        )
+        if current != -1:
+            raise StaleRevisionError(
+                f"Revision of {key} is {current}, expected {revision - 1}"
+            )
+
+    async def _read(self, pubsub: PubSub) -> None:
+        prefix_length = len(self._prefix)
+        async for message in pubsub.listen():
+            if message["type"] != "pmessage":
+                continue
+
+            key = message["channel"].decode("utf-8")[prefix_length:]
+            raw_revision, _, payload = message["data"].partition(b":")
+            try:
+                await self._dispatch(key, int(raw_revision), payload)
+            except Exception as e:
+                _LOG.error("Could not handle update of %s", key, exc_info=e)
+
+    async def _dispatch(self, key: str, revision: int, payload: bytes) -> None:
+        if revision == _DISCARDED_REVISION:
+            if self._observables.pop(key, None) is not None and (
+                watcher := self._find_watcher(key)
+            ):
+                await watcher.on_discarded(key)
+            return
+
+        if existing := self._observables.get(key):
+            await existing._receive(revision, payload)
+            return
+
+        # Updates of keys this process doesn't track are irrelevant, only new keys
+        # are picked up.
+        if not payload or revision != 0:
+            return
+
+        if watcher := self._find_watcher(key):
+            monitoring = watcher.monitoring
+            created = _RedisObservable(
+                self,
+                key,
+                watcher.codec,
+                watcher.codec.decode(payload),
+                revision,
+                monitor=monitoring.monitor(key) if monitoring else None,
+            )
+            self._observables[key] = created
+            await watcher.on_created(key, created)
+
+    def _find_watcher(self, key: str) -> _Watcher[Any] | None:
+        for key_prefix, watcher in self._watchers.items():
+            if key.startswith(key_prefix):
+                return watcher
+
+        return None
+
+
+class _RedisObservable[T](Observable[T]):
+    def __init__(
+        self,
+        hub: RedisObservableHub,
+        key: str,
+        codec: Codec[T],
+        value: T | None,
+        revision: int,
+        *,
+        monitor: LockMonitor | None = None,
+    ) -> None:
+        self._hub = hub
+        self._key = key
+        self._codec = codec
+        self._revision = revision
+        # The revision the current atomic block read, which its writes build on
+        self._base_revision = revision
+        self._monitor = monitor
+        self._local = _UnsafeObservableImpl(value, monitor=monitor)
+        self._update_lock = asyncio.Lock()
+        self._unsafe = _UnsafeRedisObservable(self)
+
+    @property
+    def value(self) -> T:
+        return self._local.value
+
+    @property
+    def is_idle(self) -> bool:
+        return not self._update_lock.locked() and self._local.is_idle
+
+    @asynccontextmanager
+    async def _acquire(self) -> AsyncIterator[None]:
+        async with self._update_lock, self._hub._lock(self._key):
+            yield
+
+    def _locked(self) -> AbstractAsyncContextManager[None]:
+        # Waiting includes the distributed lock, which is what queued spins wait for
+        if monitor := self._monitor:
+            return monitor.track(self._acquire())
+
+        return self._acquire()
+
+    @asynccontextmanager
+    async def atomic(self) -> AsyncIterator[Observable[T]]:
+        async with self._locked():
+            # Another process may have written since the last published update
+            # reached us.
+            raw = await self._hub._fetch(self._key)
+            revision = _hash_revision(raw)
+            value = _decode_hash(raw, self._codec)
+            if revision > self._revision and value is not None:
+                self._revision = revision
+                await self._local.update(value)
+
+            self._base_revision = revision
+            yield self._unsafe
+
+    async def update(self, value: T) -> None:
+        async with self.atomic() as atom:
+            await atom.update(value)
+
+    def encode[P](self, value: T, encoder: Encoder[T, P]) -> P:
+        return self._local.encode(value, encoder)
+
+    def add_listener(self, listener: Listener[T]) -> None:
+        self._local.add_listener(listener)
+
+    def remove_listener(self, listener: Listener[T]) -> bool:
+        return self._local.remove_listener(listener)
+
+    async def _write(self, value: T) -> None:
+        if _is_unchanged(self._local._value, value):
+            return
+
+        revision = self._base_revision + 1
+        await self._hub._write(self._key, revision, self._codec.encode(value))
+        self._base_revision = self._revision = revision
+        await self._local.update(value)
+
+    async def _receive(self, revision: int, payload: bytes) -> None:
+        if revision <= self._revision or not payload:
+            return
+
+        self._revision = revision
+        await self._local.update(self._codec.decode(payload))
+
+
+class _UnsafeRedisObservable[T](Observable[T]):
+    def __init__(self, parent: _RedisObservable[T]) -> None:
+        self._parent = parent
+
+    @property
+    def value(self) -> T:
+        return self._parent.value
+
+    @property
+    def is_idle(self) -> bool:
+        return False
+
+    @asynccontextmanager
+    async def atomic(self) -> AsyncIterator[Observable[T]]:
+        yield self
+
+    async def update(self, value: T) -> None:
+        await self._parent._write(value)
+
+    def encode[P](self, value: T, encoder: Encoder[T, P]) -> P:
+        return self._parent.encode(value, encoder)
+
+    def add_listener(self, listener: Listener[T]) -> None:
+        self._parent.add_listener(listener)
+
+    def remove_listener(self, listener: Listener[T]) -> bool:
+        return self._parent.remove_listener(listener)
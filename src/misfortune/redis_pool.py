@@ -0,0 +1,163 @@
+import itertools
+import logging
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import RedisError
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from misfortune.config import RepoConfig
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, kw_only=True)
+class PoolStats:
+    max_connections: int
+    in_use: int
+    idle: int
+
+
+def create_client(
+    config: RepoConfig,
+    *,
+    blocking_reads: bool = False,
+    retry: bool = True,
+    host: str | None = None,
+) -> Redis:
+    # Pub/sub connections block on reads until a message arrives, so they must not
+    # be subject to the socket timeout.
+    socket_timeout = None if blocking_reads else config.socket_timeout
+    # A command which failed with a connection error or timeout may have been
+    # executed anyway, so commands which mustn't run twice are never retried.
+    retries = config.retries if retry else 0
+    pool = BlockingConnectionPool(
+        max_connections=config.max_connections,
+        timeout=config.pool_timeout.total_seconds(),
+        host=host or config.host,
+        username=config.username,
+        password=config.password,
+        protocol=3,
+        socket_timeout=socket_timeout.total_seconds() if socket_timeout else None,
+        socket_connect_timeout=config.connect_timeout.total_seconds(),
+        socket_keepalive=True,
+        health_check_interval=config.health_check_interval.total_seconds(),
+        retry=Retry(ExponentialBackoff(), retries),
+        retry_on_timeout=retries > 0,
+    )
+    return Redis.from_pool(pool)
+
+
+def pool_stats(client: Redis) -> PoolStats:
+    pool = client.connection_pool
+    # redis-py doesn't expose any public accessors for the pool usage
+    return PoolStats(
+        max_connections=pool.max_connections,
+        in_use=len(pool._in_use_connections),
+        idle=len(pool._available_connections),
+    )
+
+
+@dataclass(kw_only=True)
+class _Replica:
+    client: Redis
+    healthy: bool = False
+    checked_at: float = float("-inf")
+
+
+class ReplicaReader:
+    # Reads which tolerate some staleness go to the replicas in turn. A replica is
+    # skipped while its link to the primary is down or its replication offset is more
+    # than max_lag bytes behind the offset of the primary. Without a healthy replica,
+    # the primary is used.
+
+    _CHECK_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        primary: Redis,
+        replicas: Sequence[Redis],
+        *,
+        max_lag: int,
+    ) -> None:
+        self._primary = primary
+        self._replicas = [_Replica(client=replica) for replica in replicas]
+        self._order = itertools.cycle(self._replicas)
+        self._max_lag = max_lag
+        self._primary_offset: int | None = None
+        self._primary_checked_at = float("-inf")
+        self.fallbacks = 0
+
+    async def _fetch_primary_offset(self, now: float) -> int | None:
+        if now - self._primary_checked_at < self._CHECK_INTERVAL:
+            return self._primary_offset
+
+        self._primary_checked_at = now
+        try:
+            info = await self._primary.info("replication")
+        except RedisError, OSError:
+            _logger.warning(
+                "Could not check replication offset of primary", exc_info=True
+            )
+            self._primary_offset = None
+        else:
+            self._primary_offset = int(info["master_repl_offset"])
+
+        return self._primary_offset
+
+    async def _is_healthy(self, replica: _Replica) -> bool:
+        now = time.monotonic()
+        if now - replica.checked_at < self._CHECK_INTERVAL:
+            return replica.healthy
+
+        replica.checked_at = now
+        # Read before the offset of the replica, so the lag is never underestimated
+        primary_offset = await self._fetch_primary_offset(now)
+        if primary_offset is None:
+            replica.healthy = False
+            return False
+
+        try:
+            info = await replica.client.info("replication")
+        except RedisError, OSError:
+            _logger.warning("Could not check replica", exc_info=True)
+            replica.healthy = False
+        else:
+            offset = int(info.get("slave_repl_offset", -1))
+            replica.healthy = (
+                info.get("role") == "slave"
+                and info.get("master_link_status") == "up"
+                and 0 <= offset
+                and primary_offset - offset <= self._max_lag
+            )
+
+        return replica.healthy
+
+    async def client(self) -> Redis:
+        for _ in range(len(self._replicas)):
+            replica = next(self._order)
+            if await self._is_healthy(replica):
+                return replica.client
+
+        if self._replicas:
+            self.fallbacks += 1
+
+        return self._primary
+
+    async def aclose(self) -> None:
+        for replica in self._replicas:
+            await replica.client.aclose()
+
+
+def create_replica_reader(primary: Redis, config: RepoConfig) -> ReplicaReader:
+    return ReplicaReader(
+        primary,
+        [create_client(config, host=host) for host in config.replica_hosts],
+        max_lag=config.replica_max_lag_bytes,
+    )
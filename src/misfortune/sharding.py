@@ -0,0 +1,84 @@
+import hashlib
+import re
+from bisect import bisect_right
+from typing import TYPE_CHECKING
+from uuid import UUID
+
+import httpx
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+# Matches both /user/{user_id}/wheel/{wheel_id}/... and /wheel/{wheel_id}/...
+_WHEEL_PATH = re.compile(r"/wheel/([0-9a-fA-F-]{36})(?:/|$)")
+# Registrations are kept by the member the display is connected to, not the owner
+_REGISTRATION_PATH = re.compile(r"/wheel/[^/]+/registration/?$")
+
+
+def _hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest())
+
+
+class HashRing:
+    # Every member is placed on the ring many times, so the wheels are spread
+    # evenly and adding or removing a member only moves the wheels of its share.
+
+    def __init__(self, members: Sequence[str], *, points_per_member: int = 128) -> None:
+        if not members:
+            raise ValueError("At least one member is required")
+
+        points = sorted(
+            (_hash(f"{member}#{index}".encode()), member)
+            for member in members
+            for index in range(points_per_member)
+        )
+        self.members = tuple(members)
+        self._hashes = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, wheel_id: UUID) -> str:
+        index = bisect_right(self._hashes, _hash(wheel_id.bytes))
+        return self._owners[index % len(self._owners)]
+
+
+def wheel_id_from_path(path: str) -> UUID | None:
+    if match := _WHEEL_PATH.search(path):
+        try:
+            return UUID(match[1])
+        except ValueError:
+            return None
+
+    return None
+
+
+class ShardRoutingTransport(httpx.AsyncBaseTransport):
+    # Sends requests for a wheel directly to the member owning it, all other
+    # requests (including registrations) go to the original URL.
+
+    def __init__(
+        self,
+        ring: HashRing,
+        *,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        self._ring = ring
+        self._transport = transport or httpx.AsyncHTTPTransport()
+        self._urls = {member: httpx.URL(member) for member in ring.members}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if not _REGISTRATION_PATH.search(path) and (
+            wheel_id := wheel_id_from_path(path)
+        ):
+            member = self._urls[self._ring.owner(wheel_id)]
+            request.url = request.url.copy_with(
+                scheme=member.scheme,
+                host=member.host,
+                port=member.port,
+            )
+            request.headers["Host"] = member.netloc.decode("ascii")
+
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
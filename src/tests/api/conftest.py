@@ -1,19 +1,26 @@
+import itertools
+from datetime import UTC, datetime, timedelta
 from pathlib import Path
 from typing import TYPE_CHECKING
+from unittest import mock
 from uuid import UUID
 
+import jwt
 from bs_config import Env
 from fastapi.testclient import TestClient
 from pytest import fixture
 
 from misfortune.config import Config
 from tests.bearer_auth import BearerAuth
+from tests.fake_redis import fake_redis
 
 if TYPE_CHECKING:
-    from collections.abc import Callable
+    from collections.abc import Callable, Iterator
 
     import httpx
 
+_user_ids = itertools.count(1)
+
 
 @fixture(scope="session")
 def config() -> Config:
@@ -26,14 +33,17 @@ def config() -> Config:
     return Config.from_env(env)
 
 
-@fixture()
-def client(config, mocker) -> TestClient:  # type: ignore
-    mocker.patch("misfortune.config.init_config", return_value=config)
-    from misfortune.api.main import app
+@fixture(scope="session")
+def client(config) -> Iterator[TestClient]:
+    # The app keeps its state in module globals, so it is only started once
+    with (
+        fake_redis(),
+        mock.patch("misfortune.config.init_config", return_value=config),
+    ):
+        from misfortune.api.main import app
 
-    client = TestClient(app, follow_redirects=False)
-    yield client
-    client.close()
+        with TestClient(app, follow_redirects=False) as client:
+            yield client
 
 
 @fixture
@@ -42,13 +52,45 @@ def internal_auth(config) -> httpx.Auth:
 
 
 @fixture
-def spin_auth_factory() -> Callable[[], httpx.Auth]:
+def user_id() -> int:
+    return next(_user_ids)
+
+
+@fixture
+def wheel_id(client, internal_auth, user_id) -> Iterator[UUID]:
+    response = client.post(
+        f"/user/{user_id}/wheel",
+        auth=internal_auth,
+        params=dict(name="Test"),
+    )
+    response.raise_for_status()
+    wheel_id = UUID(response.json()["id"])
+    yield wheel_id
+    client.delete(
+        f"/user/{user_id}/wheel/{wheel_id}",
+        auth=internal_auth,
+    ).raise_for_status()
+
+
+@fixture
+def wheel_auth(config, wheel_id) -> httpx.Auth:
+    token = jwt.encode(
+        {
+            "exp": datetime.now(tz=UTC) + timedelta(hours=1),
+            "wheelId": str(wheel_id),
+        },
+        key=config.jwt_secret,
+        algorithm="HS256",
+    )
+    return BearerAuth(token=token)
+
+
+@fixture
+def spin_auth_factory(wheel_id) -> Callable[[], httpx.Auth]:
     def _generate() -> httpx.Auth:
         from misfortune.api.main import observable_states
 
-        observable_state = observable_states[UUID(int=0)]
-
-        state = observable_state.value
+        state = observable_states[wheel_id].value
         return BearerAuth(token=state.code)
 
     return _generate
@@ -0,0 +1,165 @@
+import asyncio
+from datetime import timedelta
+from unittest import mock
+
+from fakeredis import FakeAsyncRedis, FakeServer
+
+from misfortune.api.changelog import ChangeLogCompactor, ChangeLogConsumer
+from misfortune.api.model import Drinks, InternalWheel
+from misfortune.api.repo import ChangeType, Repository
+from misfortune.api.snapshot import WheelSnapshot, fetch_snapshot
+from misfortune.redis_pool import ReplicaReader
+from misfortune.shared_model import Drink
+from tests.fake_redis import fake_redis
+
+
+async def _mutate(repo: Repository) -> tuple[InternalWheel, InternalWheel]:
+    kept = InternalWheel.create(owner=1, name="Kept")
+    deleted = InternalWheel.create(owner=2, name="Deleted")
+    await repo.create_wheel(kept, max_owned=10)
+    await repo.create_wheel(deleted, max_owned=10)
+    await repo.update_wheel_name(kept.id, name="Renamed")
+    await repo.update_wheel_drinks(kept.id, drinks=Drinks([Drink.create("Beer")]))
+    await repo.delete_wheel(deleted.id, owner=deleted.owner)
+    return kept, deleted
+
+
+async def _trim(server, repo: Repository, *, before: int) -> None:
+    client = FakeAsyncRedis(server=server)
+    await client.xtrim(repo._changelog_key, minid=f"{before}-0", approximate=False)
+    await client.aclose()
+
+
+def test_read_changelog__records_every_write(config):
+    async def _run() -> None:
+        repo = Repository(config.repo)
+        kept, deleted = await _mutate(repo)
+
+        entries = await repo.read_changelog(after=0, count=100)
+
+        assert entries is not None
+        assert [(e.revision, e.wheel_id, e.type) for e in entries] == [
+            (1, kept.id, ChangeType.CREATE),
+            (2, deleted.id, ChangeType.CREATE),
+            (3, kept.id, ChangeType.RENAME),
+            (4, kept.id, ChangeType.DRINKS),
+            (5, deleted.id, ChangeType.DELETE),
+        ]
+        assert entries[0].owner == 1
+        assert entries[2].name == "Renamed"
+        assert entries[4].owner == 2
+        await repo.close()
+
+    with fake_redis():
+        asyncio.run(_run())
+
+
+def test_consumer__resumes_from_offset(config):
+    async def _run() -> None:
+        repo = Repository(config.repo)
+        await _mutate(repo)
+
+        consumer = ChangeLogConsumer(repo, offset=3, batch_size=1)
+        first = await consumer.poll()
+        second = await consumer.poll()
+
+        assert [e.revision for e in first] == [4]
+        assert [e.revision for e in second] == [5]
+        assert await consumer.poll() == []
+        assert consumer.offset == 5
+
+        snapshot = await ChangeLogConsumer(repo).sync(
+            WheelSnapshot(revision=0, wheels={})
+        )
+        assert snapshot == await fetch_snapshot(repo)
+        await repo.close()
+
+    with fake_redis():
+        asyncio.run(_run())
+
+
+def test_consumer__restarts_from_compacted_snapshot(config):
+    async def _run(server) -> None:
+        repo = Repository(config.repo)
+        kept, _ = await _mutate(repo)
+        assert await ChangeLogCompactor(repo, interval=timedelta(hours=1)).compact()
+
+        renamed = InternalWheel.create(owner=3, name="Later")
+        await repo.create_wheel(renamed, max_owned=10)
+        await _trim(server, repo, before=6)
+
+        consumer = ChangeLogConsumer(repo)
+        with mock.patch.object(
+            repo, "fetch_wheels_at_revision", side_effect=AssertionError
+        ):
+            snapshot = await consumer.poll()
+            entries = await consumer.poll()
+
+        assert isinstance(snapshot, WheelSnapshot)
+        assert snapshot.revision == 5
+        assert snapshot.wheels.keys() == {kept.id}
+        assert [e.wheel_id for e in entries] == [renamed.id]
+        await repo.close()
+
+    with fake_redis() as server:
+        asyncio.run(_run(server))
+
+
+def test_consumer__fetches_all_wheels_without_compacted_snapshot(config):
+    async def _run(server) -> None:
+        repo = Repository(config.repo)
+        await _mutate(repo)
+        await _trim(server, repo, before=5)
+
+        snapshot = await ChangeLogConsumer(repo).poll()
+
+        assert snapshot == await fetch_snapshot(repo)
+        await repo.close()
+
+    with fake_redis() as server:
+        asyncio.run(_run(server))
+
+
+def test_compact__runs_once_per_interval(config):
+    async def _run() -> None:
+        repo = Repository(config.repo)
+        interval = timedelta(hours=1)
+
+        assert await ChangeLogCompactor(repo, interval=interval).compact()
+        assert not await ChangeLogCompactor(repo, interval=interval).compact()
+        await repo.close()
+
+    with fake_redis():
+        asyncio.run(_run())
+
+
+def test_replicas__fall_back_to_primary_when_behind(config):
+    async def _run() -> None:
+        repo = Repository(config.repo)
+        kept, _ = await _mutate(repo)
+        # A replica which hasn't received any of the writes yet
+        replica = FakeAsyncRedis(server=FakeServer(), protocol=3)
+        # Reported within the tolerated lag, so only the revisions show it's behind
+        replica.info = mock.AsyncMock(
+            return_value={
+                "role": "slave",
+                "master_link_status": "up",
+                "slave_repl_offset": 900,
+            }
+        )
+        repo._client.info = mock.AsyncMock(return_value={"master_repl_offset": 1000})
+        repo._replicas = ReplicaReader(repo._client, [replica], max_lag=1000)
+
+        entries = await repo.read_changelog(after=3, count=100)
+        changes = await repo.fetch_changes(since=3)
+
+        assert entries is not None
+        assert [e.revision for e in entries] == [4, 5]
+        assert changes is not None
+        assert changes.revision == 5
+        assert [w.id for w in changes.wheels] == [kept.id]
+        assert await repo.fetch_wheels() == []
+        await repo.close()
+
+    with fake_redis():
+        asyncio.run(_run())
@@ -0,0 +1,92 @@
+import asyncio
+import uuid
+from datetime import timedelta
+
+import pytest
+
+from misfortune.api.heartbeats import HeartbeatMonitor, HeartbeatStats
+
+
+def _monitor() -> HeartbeatMonitor:
+    return HeartbeatMonitor(
+        interval=timedelta(milliseconds=10),
+        timeout=timedelta(milliseconds=35),
+    )
+
+
+def test_init__rejects_timeout_shorter_than_interval():
+    with pytest.raises(ValueError):
+        HeartbeatMonitor(interval=timedelta(seconds=2), timeout=timedelta(seconds=1))
+
+
+def test_add__pings_and_keeps_responsive_connection():
+    async def _run() -> None:
+        monitor = _monitor()
+        connection_id = uuid.uuid4()
+        pings = 0
+        reaped = asyncio.Event()
+
+        async def _ping() -> None:
+            nonlocal pings
+            pings += 1
+            monitor.seen(connection_id)
+
+        async def _reap() -> None:
+            reaped.set()
+
+        monitor.add(connection_id, ping=_ping, reap=_reap)
+        await asyncio.sleep(0.1)
+
+        assert pings > 1
+        assert not reaped.is_set()
+        assert connection_id in monitor
+        assert monitor.stats().reaped == 0
+        await monitor.close()
+
+    asyncio.run(_run())
+
+
+def test_add__reaps_silent_connection():
+    async def _run() -> None:
+        monitor = _monitor()
+        connection_id = uuid.uuid4()
+        reaped = asyncio.Event()
+
+        async def _ping() -> None:
+            pass
+
+        async def _reap() -> None:
+            reaped.set()
+
+        monitor.add(connection_id, ping=_ping, reap=_reap)
+        await asyncio.wait_for(reaped.wait(), timeout=1)
+
+        assert connection_id not in monitor
+        assert monitor.stats() == HeartbeatStats(connections=0, reaped=1)
+        await monitor.close()
+
+    asyncio.run(_run())
+
+
+def test_remove__stops_pinging():
+    async def _run() -> None:
+        monitor = _monitor()
+        connection_id = uuid.uuid4()
+        pings = 0
+
+        async def _ping() -> None:
+            nonlocal pings
+            pings += 1
+
+        async def _reap() -> None:
+            pass
+
+        monitor.add(connection_id, ping=_ping, reap=_reap)
+        monitor.remove(connection_id)
+        await asyncio.sleep(0.05)
+
+        assert pings == 0
+        assert monitor.stats().reaped == 0
+        await monitor.close()
+
+    asyncio.run(_run())
@@ -0,0 +1,51 @@
+import asyncio
+import dataclasses
+from unittest import mock
+
+from misfortune.api.model import InternalWheel
+from misfortune.api.registry import WheelRegistry
+from misfortune.api.repo import Repository
+from misfortune.config import WheelLoading
+
+
+def test_lazy_loading__keeps_wheels_in_use(client, config):
+    from misfortune.api import main
+
+    lazy = dataclasses.replace(
+        config,
+        wheel_loading=WheelLoading.LAZY,
+        max_loaded_wheels=1,
+    )
+
+    async def _run() -> None:
+        repo = Repository(config.repo)
+        wheels = [InternalWheel.create(owner=1, name=f"Lazy {i}") for i in range(3)]
+        for wheel in wheels:
+            await repo.create_wheel(wheel, max_owned=10)
+        used, locked, other = (wheel.id for wheel in wheels)
+        states = main.observable_states
+
+        async with main._use_wheel(repo, used) as state:
+            # Neither the wheel in use nor the one just loaded make room
+            assert await main._get_wheel(repo, other) is not None
+            assert list(states) == [used, other]
+
+            async with state.atomic() as atom:
+                await atom.update(atom.value.replace(wheel_name="Renamed"))
+
+        assert states[used].value.wheel_name == "Renamed"
+
+        async with main._use_wheel(repo, locked) as state:
+            assert list(states) == [locked]
+            async with state.atomic() as atom:
+                await atom.update(atom.value.replace(is_locked=True))
+
+        assert await main._get_wheel(repo, other) is not None
+        assert list(states) == [locked, other]
+        await repo.close()
+
+    with (
+        mock.patch.object(main, "config", lazy),
+        mock.patch.object(main, "observable_states", WheelRegistry()),
+    ):
+        asyncio.run(_run())
@@ -12,3 +12,28 @@ def test_probe_live__responds(client):
     response = client.get("/probe/live")
     assert response.status_code == HTTPStatus.OK
     assert response.json() == {"status": "ok"}
+
+
+def test_metrics__reports_request_latency(client):
+    client.get("/probe/live")
+
+    response = client.get("/metrics")
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["Content-Type"].startswith("text/plain")
+    assert (
+        'misfortune_request_seconds_count{method="GET",route="/probe/live"}'
+        in response.text
+    )
+    assert "# TYPE misfortune_loaded_wheels gauge" in response.text
+
+
+def test_metrics__reports_redis_pools(client):
+    response = client.get("/metrics")
+
+    assert "# TYPE misfortune_redis_connections gauge" in response.text
+    for state in ("in_use", "idle"):
+        assert (
+            f'misfortune_redis_connections{{client="repository",state="{state}"}}'
+            in response.text
+        )
+    assert 'misfortune_redis_max_connections{client="repository"}' in response.text
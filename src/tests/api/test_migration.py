@@ -0,0 +1,42 @@
+import asyncio
+
+from fakeredis import FakeAsyncRedis
+
+from misfortune.api.model import Drinks, InternalWheel
+from misfortune.api.repo import Repository
+from misfortune.shared_model import Drink
+from tests.fake_redis import fake_redis
+
+
+def test_migrate__converts_json_wheels(config):
+    first = InternalWheel.create(owner=1, name="First")
+    first = first.model_copy(update=dict(drinks=Drinks([Drink.create("Beer")])))
+    second = InternalWheel.create(owner=1, name="Second")
+    other = InternalWheel.create(owner=2, name="Other")
+
+    async def _run(server) -> None:
+        repo = Repository(config.repo)
+        # The wheels as the schema without a version stored them
+        client = FakeAsyncRedis(server=server)
+        for wheel in (first, second, other):
+            await client.set(repo._wheel_key(wheel.id), wheel.model_dump_json())
+
+        await repo.migrate()
+        await repo.migrate()
+        # A migration interrupted before storing the version runs again, which
+        # must leave the already converted wheels alone
+        await client.delete(f"{config.repo.username}:api:schema_version")
+        await repo.migrate()
+
+        assert await client.type(repo._wheel_key(first.id)) == b"hash"
+        assert await repo.fetch_wheel(first.id) == first
+        assert await repo.fetch_owned_wheel_ids(1) == {first.id, second.id}
+        owned = await repo.fetch_owned_wheels(1)
+        assert sorted(owned, key=lambda w: w.name) == [first, second]
+        assert await repo.fetch_owned_wheels(2) == [other]
+        assert len(await repo.fetch_wheels()) == 3
+        await client.aclose()
+        await repo.close()
+
+    with fake_redis() as server:
+        asyncio.run(_run(server))
@@ -0,0 +1,70 @@
+import pytest
+from pydantic import ValidationError
+
+from misfortune.api.model import Drinks, InternalWheel, State
+from misfortune.shared_model import Drink
+
+
+def _state() -> State:
+    wheel = InternalWheel.create(owner=1, name="Test")
+    wheel = wheel.model_copy(update={"drinks": [Drink.create("Beer")]})
+    return State.initial(wheel=wheel, code="code")
+
+
+def test_replace__validates_changed_fields():
+    state = _state()
+
+    assert state.replace(speed="1.5").speed == 1.5
+    with pytest.raises(ValidationError):
+        state.replace(current_drink="first")
+
+
+def test_replace__shares_unchanged_fields():
+    state = _state()
+    locked = state.replace(is_locked=True)
+
+    assert locked.is_locked
+    assert not state.is_locked
+    assert locked.drinks is state.drinks
+
+
+def test_drinks__finds_by_id_and_normalized_name():
+    beer = Drink.create("Beer")
+    drinks = Drinks([beer])
+
+    assert drinks.get(beer.id) is beer
+    assert drinks.find_by_name(" BEER ") is beer
+    assert drinks.find_by_name("Wine") is None
+
+
+def test_drinks__append_shares_existing_drinks():
+    beer = Drink.create("Beer")
+    drinks = Drinks([beer])
+    wine = Drink.create("Wine")
+
+    extended = drinks.append(wine)
+
+    assert list(extended) == [beer, wine]
+    assert extended[0] is beer
+    assert len(drinks) == 1
+    with pytest.raises(ValueError):
+        extended.append(Drink.create("wine"))
+
+
+def test_drinks__remove_keeps_order():
+    first, second, third = (Drink.create(name) for name in ("A", "B", "C"))
+    drinks = Drinks([first, second, third])
+
+    remaining = drinks.remove(second.id)
+
+    assert list(remaining) == [first, third]
+    assert remaining.find_by_name("B") is None
+    assert remaining.remove(second.id) is remaining
+
+
+def test_drinks__round_trips_as_list():
+    state = _state()
+    restored = State.model_validate_json(state.model_dump_json())
+
+    assert isinstance(restored.drinks, Drinks)
+    assert restored.drinks == state.drinks
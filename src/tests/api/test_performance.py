@@ -0,0 +1,223 @@
+import asyncio
+import functools
+import json
+import os
+import time
+import uuid
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import jwt
+import pytest
+
+from misfortune.api.model import Drinks, InternalWheel, State
+from misfortune.observable import observable
+from misfortune.shared_model import Drink
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+    from misfortune.config import Config
+
+# Timings are divided by the time of a fixed calibration workload, so the stored
+# baselines are roughly independent of the machine the tests run on. make test sets
+# MISFORTUNE_PERFORMANCE_TESTS=1 to run them. CI runs pytest without it, because
+# timings on shared runners are too noisy. Set MISFORTUNE_UPDATE_BASELINES=1 to store
+# the current results as new baselines.
+
+_BASELINES = Path(__file__).with_name("performance_baselines.json")
+_UPDATE_BASELINES = os.getenv("MISFORTUNE_UPDATE_BASELINES") == "1"
+_DEFAULT_TOLERANCE = 0.75
+_DRINK_COUNT = 100
+_REPEAT = 7
+_TARGET_DURATION = 0.01
+
+pytestmark = pytest.mark.skipif(
+    os.getenv("MISFORTUNE_PERFORMANCE_TESTS") != "1" and not _UPDATE_BASELINES,
+    reason="Performance tests are only run with MISFORTUNE_PERFORMANCE_TESTS=1",
+)
+
+
+def _time_sync(func: Callable[[], object], number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - start
+
+
+def _measure(func: Callable[[], object]) -> float:
+    for _ in range(10):
+        func()
+
+    estimate = _time_sync(func, 10) / 10
+    number = max(1, int(_TARGET_DURATION / max(estimate, 1e-9)))
+    return min(_time_sync(func, number) for _ in range(_REPEAT)) / number
+
+
+def _measure_async(func: Callable[[], Awaitable[object]]) -> float:
+    async def _time_async(number: int) -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            await func()
+        return time.perf_counter() - start
+
+    async def _run() -> float:
+        for _ in range(10):
+            await func()
+
+        estimate = await _time_async(10) / 10
+        number = max(1, int(_TARGET_DURATION / max(estimate, 1e-9)))
+        return min([await _time_async(number) for _ in range(_REPEAT)]) / number
+
+    return asyncio.run(_run())
+
+
+def _calibration_workload() -> None:
+    payload = {"drinks": [{"id": str(i), "name": f"Drink {i}"} for i in range(20)]}
+    json.loads(json.dumps(payload))
+    sum(i * i for i in range(200))
+
+
+@functools.cache
+def _calibration() -> float:
+    return _measure(_calibration_workload)
+
+
+def _load_baselines() -> dict[str, dict[str, float]]:
+    try:
+        return json.loads(_BASELINES.read_text())
+    except FileNotFoundError:
+        return {}
+
+
+def _check_budget(name: str, duration: float) -> None:
+    ratio = duration / _calibration()
+    baselines = _load_baselines()
+    budget = baselines.get(name)
+
+    if _UPDATE_BASELINES:
+        tolerance = budget["tolerance"] if budget else _DEFAULT_TOLERANCE
+        baselines[name] = {"baseline": round(ratio, 3), "tolerance": tolerance}
+        _BASELINES.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        return
+
+    if budget is None:
+        pytest.fail(f"No baseline for {name}, run with MISFORTUNE_UPDATE_BASELINES=1")
+
+    limit = budget["baseline"] * (1 + budget["tolerance"])
+    assert ratio <= limit, (
+        f"{name} took {duration * 1e6:.2f}µs ({ratio:.3f}x calibration),"
+        f" budget is {limit:.3f}x (baseline {budget['baseline']:.3f}x)"
+    )
+
+
+def _wheel() -> InternalWheel:
+    return InternalWheel(
+        id=uuid.uuid4(),
+        name="Benchmark",
+        owner=1,
+        drinks=Drinks(Drink.create(f"Drink {i}") for i in range(_DRINK_COUNT)),
+    )
+
+
+def _state() -> State:
+    return State.initial(wheel=_wheel(), code="code")
+
+
+def _spin(state: State) -> State:
+    return state.replace(
+        is_locked=not state.is_locked,
+        speed=state.speed + 1,
+        current_drink=len(state.drinks) - 1,
+    )
+
+
+def test_state_replace():
+    state = _state()
+    _check_budget("state_replace", _measure(lambda: _spin(state)))
+
+
+def test_state_model_dump_json():
+    state = _spin(_state())
+    _check_budget("state_model_dump_json", _measure(state.model_dump_json))
+
+
+@pytest.mark.parametrize("listener_count", [1, 10, 100])
+def test_observable_update(listener_count: int):
+    state = _state()
+    states = (_spin(state), state)
+    subject = observable(state)
+    updates = 0
+
+    async def _listener(value: State) -> None:
+        pass
+
+    for _ in range(listener_count):
+        subject.add_listener(_listener)
+
+    async def _update() -> None:
+        nonlocal updates
+        updates += 1
+        await subject.update(states[updates % 2])
+
+    _check_budget(
+        f"observable_update_{listener_count}",
+        _measure_async(_update),
+    )
+
+
+def _wheel_token(config: Config) -> tuple[str, uuid.UUID]:
+    wheel_id = uuid.uuid4()
+    token = jwt.encode(
+        {
+            "exp": datetime.now(tz=UTC) + timedelta(hours=1),
+            "wheelId": str(wheel_id),
+        },
+        key=config.jwt_secret,
+        algorithm="HS256",
+    )
+    return token, wheel_id
+
+
+def test_decode_wheel_token__cached(client, config: Config):
+    from misfortune.api.main import _decode_wheel_token
+
+    token, wheel_id = _wheel_token(config)
+    assert _decode_wheel_token(token) == wheel_id
+
+    _check_budget(
+        "decode_wheel_token_cached",
+        _measure(lambda: _decode_wheel_token(token)),
+    )
+
+
+def test_decode_wheel_token__uncached(client, config: Config):
+    from misfortune.api.main import _decode_wheel_token, token_cache
+
+    token, wheel_id = _wheel_token(config)
+
+    def _decode() -> uuid.UUID:
+        token_cache.clear()
+        return _decode_wheel_token(token)
+
+    assert _decode() == wheel_id
+    _check_budget("decode_wheel_token_uncached", _measure(_decode))
+
+
+def test_internal_wheel_model_validate_json():
+    raw = _wheel().model_dump_json()
+    _check_budget(
+        "internal_wheel_model_validate_json",
+        _measure(lambda: InternalWheel.model_validate_json(raw)),
+    )
+
+
+def test_build_buttons():
+    from misfortune.bot.main import MisfortuneBot
+
+    drinks = _wheel().drinks
+    _check_budget(
+        "build_buttons",
+        _measure(lambda: MisfortuneBot._build_buttons(drinks)),
+    )
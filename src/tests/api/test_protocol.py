@@ -0,0 +1,74 @@
+import json
+
+import msgpack
+
+from misfortune.api.model import InternalWheel, State, WheelEncoding
+from misfortune.api.protocol import (
+    PatchEncoder,
+    encode_full,
+    encode_full_msgpack,
+    encode_snapshot,
+    encode_snapshot_msgpack,
+)
+from misfortune.shared_model import Drink
+
+
+def _state() -> State:
+    wheel = InternalWheel.create(owner=1, name="Test")
+    wheel = wheel.model_copy(update={"drinks": [Drink.create("Beer")]})
+    return State.initial(wheel=wheel, code="code")
+
+
+def test_replace__increments_version():
+    state = _state()
+    locked = state.replace(is_locked=True)
+
+    assert locked.version == state.version + 1
+    assert locked.replace(is_locked=True) is locked
+
+
+def test_encode_full__omits_version():
+    assert "version" not in json.loads(encode_full(_state()))
+
+
+def test_encode_snapshot__contains_version():
+    state = _state().replace(speed=2.0)
+    snapshot = json.loads(encode_snapshot(state))
+
+    assert snapshot["type"] == "snapshot"
+    assert snapshot["version"] == state.version
+    assert snapshot["state"]["speed"] == 2.0
+
+
+def test_patch__only_contains_changes():
+    base = _state()
+    state = base.replace(is_locked=True, speed=1.5)
+    patch = json.loads(PatchEncoder.from_base(base)(state))
+
+    assert patch == {
+        "type": "patch",
+        "base_version": base.version,
+        "version": state.version,
+        "changes": {"is_locked": True, "speed": 1.5},
+    }
+
+
+def test_patch_encoder__shared_by_base_version():
+    base = _state()
+    assert PatchEncoder.from_base(base) == PatchEncoder.from_base(base.model_copy())
+
+
+def test_patch_encoder__not_shared_between_encodings():
+    base = _state()
+    assert PatchEncoder.from_base(base) != PatchEncoder.from_base(
+        base, WheelEncoding.MSGPACK
+    )
+
+
+def test_msgpack__same_structure_as_json():
+    state = _state().replace(is_locked=True)
+
+    assert msgpack.unpackb(encode_full_msgpack(state)) == json.loads(encode_full(state))
+    assert msgpack.unpackb(encode_snapshot_msgpack(state)) == json.loads(
+        encode_snapshot(state)
+    )
@@ -0,0 +1,119 @@
+import asyncio
+import uuid
+from contextlib import ExitStack
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from misfortune.api.model import WheelLogin, WheelRegistrationInfo
+from misfortune.api.registrations import RegistrationLimitError, RegistrationManager
+from misfortune.observable import observable
+
+
+def _manager(timeout: timedelta = timedelta(minutes=1)) -> RegistrationManager:
+    return RegistrationManager(
+        max_pending=3,
+        max_pending_per_client=2,
+        timeout=timeout,
+    )
+
+
+def test_add__limits_pending_registrations():
+    async def _run() -> None:
+        manager = _manager()
+        for client in ("a", "a", "b"):
+            manager.add(uuid.uuid4(), client=client, wheel_id=observable(None))
+
+        with pytest.raises(RegistrationLimitError):
+            manager.add(uuid.uuid4(), client="c", wheel_id=observable(None))
+
+        assert manager.stats().rejected == 1
+        await manager.close()
+
+    asyncio.run(_run())
+
+
+def test_add__limits_pending_registrations_per_client():
+    async def _run() -> None:
+        manager = _manager()
+        first = uuid.uuid4()
+        manager.add(first, client="a", wheel_id=observable(None))
+        manager.add(uuid.uuid4(), client="a", wheel_id=observable(None))
+
+        with pytest.raises(RegistrationLimitError):
+            manager.add(uuid.uuid4(), client="a", wheel_id=observable(None))
+
+        manager.remove(first)
+        manager.add(uuid.uuid4(), client="a", wheel_id=observable(None))
+        await manager.close()
+
+    asyncio.run(_run())
+
+
+def test_add__confirmed_by_wheel_id_update():
+    async def _run() -> None:
+        manager = _manager()
+        registration_id = uuid.uuid4()
+        wheel_id = uuid.uuid4()
+        confirmation = manager.add(
+            registration_id,
+            client="a",
+            wheel_id=observable(None),
+        )
+
+        client_wheel = manager.get(registration_id)
+        assert client_wheel is not None
+        await client_wheel.update(wheel_id)
+
+        assert await confirmation == wheel_id
+        await manager.close()
+
+    asyncio.run(_run())
+
+
+def test_add__expires_after_timeout():
+    async def _run() -> None:
+        manager = _manager(timeout=timedelta(milliseconds=10))
+        registration_id = uuid.uuid4()
+        confirmation = manager.add(
+            registration_id,
+            client="a",
+            wheel_id=observable(None),
+        )
+
+        assert manager.stats().pending == 1
+        with pytest.raises(TimeoutError):
+            await asyncio.wait_for(confirmation, timeout=1)
+
+        manager.remove(registration_id)
+        stats = manager.stats()
+        assert (stats.pending, stats.oldest_age, stats.expired) == (0, None, 1)
+        await manager.close()
+
+    asyncio.run(_run())
+
+
+def test_connect__limits_registrations_per_forwarded_client(client):
+    from misfortune.api import main
+
+    def _register(stack: ExitStack, forwarded_for: str) -> None:
+        websocket = stack.enter_context(
+            client.websocket_connect("/ws", headers={"X-Forwarded-For": forwarded_for})
+        )
+        websocket.send_text(WheelLogin(token=None).model_dump_json())
+        WheelRegistrationInfo.model_validate_json(websocket.receive_text())
+
+    with (
+        mock.patch.object(main.registrations, "_max_pending_per_client", 1),
+        ExitStack() as stack,
+    ):
+        _register(stack, "203.0.113.1")
+        # Both connections come from the same proxy, but not from the same client
+        _register(stack, "198.51.100.7, 203.0.113.2")
+
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            _register(stack, "203.0.113.1")
+
+        assert exc_info.value.code == 1013
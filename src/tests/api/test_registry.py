@@ -0,0 +1,71 @@
+import asyncio
+
+from misfortune.api.model import InternalWheel, State
+from misfortune.api.registry import WheelRegistry
+from misfortune.observable import observable
+
+
+def _add_wheel(registry: WheelRegistry, owner: int) -> InternalWheel:
+    wheel = InternalWheel.create(owner=owner, name="Test")
+    registry.add(wheel.id, observable(State.initial(wheel=wheel, code="code")))
+    return wheel
+
+
+def test_owned_by__only_returns_own_wheels():
+    registry = WheelRegistry()
+    own = _add_wheel(registry, owner=1)
+    _add_wheel(registry, owner=2)
+
+    assert [wheel_id for wheel_id, _ in registry.owned_by(1)] == [own.id]
+    assert len(registry) == 2
+
+
+def test_remove__updates_index():
+    registry = WheelRegistry()
+    wheel = _add_wheel(registry, owner=1)
+
+    assert registry.remove(wheel.id) is not None
+    assert registry.remove(wheel.id) is None
+    assert wheel.id not in registry
+    assert registry.owned_by(1) == []
+
+
+def test_evict_idle__evicts_least_recently_used():
+    registry = WheelRegistry()
+    first = _add_wheel(registry, owner=1)
+    second = _add_wheel(registry, owner=1)
+    third = _add_wheel(registry, owner=2)
+    registry.touch(first.id)
+
+    assert registry.evict_idle(max_loaded=2) == [second.id]
+    assert list(registry) == [third.id, first.id]
+    assert [wheel_id for wheel_id, _ in registry.owned_by(1)] == [first.id]
+
+
+def test_evict_idle__keeps_wheels_with_listeners():
+    async def _listener(state: State) -> None:
+        pass
+
+    registry = WheelRegistry()
+    watched = _add_wheel(registry, owner=1)
+    registry[watched.id].add_listener(_listener)
+    idle = _add_wheel(registry, owner=1)
+
+    assert registry.evict_idle(max_loaded=1) == [idle.id]
+    assert watched.id in registry
+
+
+def test_evict_idle__keeps_pinned_and_locked_wheels():
+    registry = WheelRegistry()
+    pinned = _add_wheel(registry, owner=1)
+    locked = _add_wheel(registry, owner=1)
+    state = registry[locked.id]
+    asyncio.run(state.update(state.value.replace(is_locked=True)))
+    idle = _add_wheel(registry, owner=1)
+    registry.pin(pinned.id)
+
+    assert registry.evict_idle(max_loaded=0) == [idle.id]
+
+    registry.unpin(pinned.id)
+    assert registry.evict_idle(max_loaded=0) == [pinned.id]
+    assert list(registry) == [locked.id]
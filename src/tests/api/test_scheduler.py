@@ -0,0 +1,65 @@
+import asyncio
+from datetime import timedelta
+
+from misfortune.api.scheduler import Scheduler
+
+
+def test_schedule__fires_in_deadline_order():
+    async def _run() -> None:
+        fired: list[str] = []
+
+        async def _callback(key: str) -> None:
+            fired.append(key)
+
+        scheduler = Scheduler(_callback)
+        scheduler.schedule("late", timedelta(milliseconds=30))
+        scheduler.schedule("early", timedelta(milliseconds=10))
+
+        await asyncio.sleep(0.06)
+        await scheduler.close()
+
+        assert fired == ["early", "late"]
+        assert len(scheduler) == 0
+
+    asyncio.run(_run())
+
+
+def test_schedule__replaces_previous_deadline():
+    async def _run() -> None:
+        fired: list[str] = []
+
+        async def _callback(key: str) -> None:
+            fired.append(key)
+
+        scheduler = Scheduler(_callback)
+        scheduler.schedule("key", timedelta(milliseconds=10))
+        scheduler.schedule("key", timedelta(seconds=10))
+
+        await asyncio.sleep(0.03)
+        assert fired == []
+        assert len(scheduler) == 1
+        await scheduler.close()
+
+    asyncio.run(_run())
+
+
+def test_cancel__prevents_callback():
+    async def _run() -> None:
+        fired: list[str] = []
+
+        async def _callback(key: str) -> None:
+            fired.append(key)
+
+        scheduler = Scheduler(_callback)
+        scheduler.schedule("cancelled", timedelta(milliseconds=10))
+        scheduler.schedule("kept", timedelta(milliseconds=20))
+
+        assert scheduler.cancel("cancelled")
+        assert not scheduler.cancel("unknown")
+
+        await asyncio.sleep(0.05)
+        await scheduler.close()
+
+        assert fired == ["kept"]
+
+    asyncio.run(_run())
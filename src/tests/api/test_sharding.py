@@ -0,0 +1,212 @@
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+from http import HTTPStatus
+from typing import TYPE_CHECKING
+from unittest import mock
+
+import httpx
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from misfortune.api.model import WheelLogin
+from misfortune.sharding import HashRing
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Iterator
+
+_OWNER = "http://owner:8000"
+
+
+def _forwarded_proof() -> str:
+    from misfortune.api import main
+
+    return main._FORWARDED_PROOF
+
+
+@pytest.fixture
+def forwarded(client, wheel_id) -> Iterator[list[httpx.Request]]:
+    from misfortune.api import main
+
+    requests: list[httpx.Request] = []
+
+    def _handle(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(
+            HTTPStatus.CREATED,
+            json={"forwarded": True},
+            headers={"Location": "/elsewhere", "Connection": "close"},
+        )
+
+    shard_client = httpx.AsyncClient(transport=httpx.MockTransport(_handle))
+    # This instance isn't a member, so it owns none of the wheels
+    with (
+        mock.patch.object(main, "shards", HashRing([_OWNER])),
+        mock.patch.object(client.app.state, "shard_client", shard_client),
+    ):
+        yield requests
+
+
+def test_forward__sends_wheel_requests_to_owner(
+    client,
+    config,
+    forwarded,
+    internal_auth,
+    user_id,
+    wheel_id,
+):
+    response = client.post(
+        f"/user/{user_id}/wheel/{wheel_id}/drink",
+        auth=internal_auth,
+        params=dict(name="Beer"),
+    )
+
+    assert response.status_code == HTTPStatus.CREATED
+    assert response.json() == {"forwarded": True}
+    assert response.headers["Location"] == "/elsewhere"
+    assert "Connection" not in response.headers
+    [request] = forwarded
+    assert request.method == "POST"
+    assert request.url == f"{_OWNER}/user/{user_id}/wheel/{wheel_id}/drink?name=Beer"
+    assert request.headers["Authorization"] == f"Bearer {config.internal_token}"
+    assert request.headers["X-Misfortune-Forwarded"] == _forwarded_proof()
+
+
+def test_forward__handles_forwarded_requests_locally(
+    client,
+    forwarded,
+    internal_auth,
+    user_id,
+    wheel_id,
+):
+    response = client.get(
+        f"/user/{user_id}/wheel/{wheel_id}",
+        auth=internal_auth,
+        headers={"X-Misfortune-Forwarded": _forwarded_proof()},
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["wheel"]["id"] == str(wheel_id)
+    assert forwarded == []
+
+
+def test_forward__ignores_forged_forwarded_header(
+    client,
+    forwarded,
+    internal_auth,
+    user_id,
+    wheel_id,
+):
+    response = client.get(
+        f"/user/{user_id}/wheel/{wheel_id}",
+        auth=internal_auth,
+        headers={"X-Misfortune-Forwarded": "1"},
+    )
+
+    assert response.json() == {"forwarded": True}
+    assert len(forwarded) == 1
+
+
+def test_registration__looks_up_other_members(
+    client,
+    forwarded,
+    internal_auth,
+    user_id,
+    wheel_id,
+):
+    registration_id = uuid.uuid4()
+
+    response = client.post(
+        f"/user/{user_id}/wheel/{wheel_id}/registration",
+        auth=internal_auth,
+        params=dict(registration_id=str(registration_id)),
+    )
+
+    assert response.status_code == HTTPStatus.NO_CONTENT
+    [request] = forwarded
+    assert request.url == (
+        f"{_OWNER}/user/{user_id}/wheel/{wheel_id}/registration"
+        f"?registration_id={registration_id}"
+    )
+    assert request.headers["X-Misfortune-Forwarded"] == _forwarded_proof()
+
+
+def test_registration__looks_up_forwarded_requests_locally(
+    client,
+    forwarded,
+    internal_auth,
+    user_id,
+    wheel_id,
+):
+    response = client.post(
+        f"/user/{user_id}/wheel/{wheel_id}/registration",
+        auth=internal_auth,
+        params=dict(registration_id=str(uuid.uuid4())),
+        headers={"X-Misfortune-Forwarded": _forwarded_proof()},
+    )
+
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    assert forwarded == []
+
+
+class _Upstream:
+    # Echoes every message back like an owner answering it, and closes the connection
+    # after the given number of messages.
+    def __init__(self, *, messages: int) -> None:
+        self.sent: list[str] = []
+        self._messages = messages
+        self._received: asyncio.Queue[str | None] = asyncio.Queue()
+
+    async def send(self, message: str) -> None:
+        self.sent.append(message)
+        await self._received.put(message)
+        if len(self.sent) == self._messages:
+            await self._received.put(None)
+
+    def __aiter__(self) -> _Upstream:
+        return self
+
+    async def __anext__(self) -> str:
+        message = await self._received.get()
+        if message is None:
+            raise StopAsyncIteration
+
+        return message
+
+
+def test_forward__relays_websocket_to_owner(client, forwarded, wheel_id):
+    from misfortune.api import main
+
+    upstream = _Upstream(messages=2)
+    connections: list[tuple[str, dict[str, str]]] = []
+
+    @asynccontextmanager
+    async def _connect(
+        url: str,
+        *,
+        additional_headers: dict[str, str],
+    ) -> AsyncIterator[_Upstream]:
+        connections.append((url, additional_headers))
+        yield upstream
+
+    login = WheelLogin(token=main._create_wheel_token(wheel_id))
+    with (
+        mock.patch.object(main, "connect_websocket", _connect),
+        client.websocket_connect("/ws") as websocket,
+    ):
+        websocket.send_text(login.model_dump_json())
+        relayed_login = WheelLogin.model_validate_json(websocket.receive_text())
+        websocket.send_text('{"type":"pong"}')
+        assert websocket.receive_text() == '{"type":"pong"}'
+
+        # The display is disconnected once the owner closes the connection
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            websocket.receive_text()
+
+    assert exc_info.value.code == 1013
+    assert connections == [
+        ("ws://owner:8000/ws", {"X-Misfortune-Forwarded": _forwarded_proof()})
+    ]
+    assert relayed_login.token is not None
+    assert main._decode_wheel_token(relayed_login.token) == wheel_id
+    assert upstream.sent[1:] == ['{"type":"pong"}']
@@ -0,0 +1,109 @@
+import asyncio
+from datetime import timedelta
+from unittest import mock
+
+from misfortune.api.model import Drinks, InternalWheel
+from misfortune.api.repo import Repository
+from misfortune.api.snapshot import (
+    SnapshotManager,
+    WheelSnapshot,
+    read_snapshot,
+    write_snapshot,
+)
+from misfortune.shared_model import Drink
+from tests.fake_redis import fake_redis
+
+
+def _wheel(name: str, drink_count: int = 3) -> InternalWheel:
+    wheel = InternalWheel.create(owner=42, name=name)
+    return wheel.model_copy(
+        update={
+            "drinks": Drinks(Drink.create(f"Drink {i} 🍺") for i in range(drink_count))
+        }
+    )
+
+
+def test_write_snapshot__round_trip(tmp_path):
+    path = tmp_path / "wheels.snapshot"
+    wheels = [_wheel("First"), _wheel("Zweites Rad", drink_count=0)]
+    snapshot = WheelSnapshot(revision=17, wheels={w.id: w for w in wheels})
+
+    write_snapshot(path, snapshot)
+
+    assert read_snapshot(path) == snapshot
+
+
+def test_read_snapshot__ignores_missing_and_corrupt_files(tmp_path):
+    path = tmp_path / "wheels.snapshot"
+    assert read_snapshot(path) is None
+
+    wheel = _wheel("Test")
+    write_snapshot(path, WheelSnapshot(revision=1, wheels={wheel.id: wheel}))
+    raw = bytearray(path.read_bytes())
+    raw[-1] ^= 0xFF
+    path.write_bytes(raw)
+    assert read_snapshot(path) is None
+
+    path.write_bytes(raw[:10])
+    assert read_snapshot(path) is None
+
+
+def test_load__reconciles_changes_since_snapshot(config, tmp_path):
+    path = tmp_path / "wheels.snapshot"
+
+    async def _run() -> None:
+        repo = Repository(config.repo)
+        kept, renamed, deleted = _wheel("Kept"), _wheel("Renamed"), _wheel("Deleted")
+        for wheel in (kept, renamed, deleted):
+            await repo.create_wheel(wheel, max_owned=10)
+
+        snapshots = SnapshotManager(repo, path=path, interval=timedelta(hours=1))
+        assert {w.id for w in await snapshots.load()} == {
+            kept.id,
+            renamed.id,
+            deleted.id,
+        }
+        await snapshots.close()
+
+        created = _wheel("Created")
+        await repo.create_wheel(created, max_owned=10)
+        await repo.update_wheel_name(renamed.id, name="New name")
+        await repo.delete_wheel(deleted.id, owner=deleted.owner)
+
+        snapshots = SnapshotManager(repo, path=path, interval=timedelta(hours=1))
+        with mock.patch.object(repo, "fetch_wheels", side_effect=AssertionError):
+            wheels = {w.id: w for w in await snapshots.load()}
+
+        assert wheels == {
+            kept.id: kept,
+            renamed.id: renamed.model_copy(update={"name": "New name"}),
+            created.id: created,
+        }
+        await snapshots.close()
+        await repo.close()
+
+        assert read_snapshot(path) == WheelSnapshot(
+            revision=6,
+            wheels=wheels,
+        )
+
+    with fake_redis():
+        asyncio.run(_run())
+
+
+def test_load__reloads_everything_if_repository_was_reset(config, tmp_path):
+    path = tmp_path / "wheels.snapshot"
+    stale = _wheel("Stale")
+    write_snapshot(path, WheelSnapshot(revision=100, wheels={stale.id: stale}))
+
+    async def _run() -> None:
+        repo = Repository(config.repo)
+        wheel = _wheel("Current")
+        await repo.create_wheel(wheel, max_owned=10)
+
+        snapshots = SnapshotManager(repo, path=path, interval=timedelta(hours=1))
+        assert list(await snapshots.load()) == [wheel]
+        await repo.close()
+
+    with fake_redis():
+        asyncio.run(_run())
@@ -1,100 +1,142 @@
+import asyncio
 from http import HTTPStatus
+from unittest import mock
 
 import pytest
 
+from misfortune.api.model import InternalWheel, State
+from misfortune.api.protocol import state_codec
+from misfortune.api.scheduler import Scheduler
+from misfortune.observable import RedisObservableHub
 from tests.bearer_auth import BearerAuth
 
 
 @pytest.fixture(autouse=True)
-def setup(client, internal_auth, wheel_auth):
+def setup(client, internal_auth, user_id, wheel_id, wheel_auth):
     client.post(
-        "/drink",
+        f"/user/{user_id}/wheel/{wheel_id}/drink",
         auth=internal_auth,
         params=dict(name="Example"),
     ).raise_for_status()
     try:
         yield
     finally:
-        responses = [
-            client.put("/unlock", auth=wheel_auth),
-            client.delete(
-                "/drink",
-                auth=internal_auth,
-                params=dict(drink_id=None),
-            ),
-        ]
-        for response in responses:
-            response.raise_for_status()
-
-
-@pytest.mark.xfail(reason="Bug in FastAPI")
-def test_spin__no_auth(client):
+        client.delete("/wheel/is_locked", auth=wheel_auth).raise_for_status()
+
+
+def _is_locked(wheel_id) -> bool:
+    from misfortune.api.main import observable_states
+
+    return observable_states[wheel_id].value.is_locked
+
+
+def test_spin__no_auth(client, wheel_id):
     response = client.post(
-        "/spin",
+        f"/wheel/{wheel_id}/is_locked",
         params=dict(speed=1.0),
     )
     assert response.status_code == HTTPStatus.UNAUTHORIZED
 
 
-@pytest.mark.skip
-def test_spin__invalid_auth(client):
+def test_spin__invalid_auth(client, wheel_id):
     response = client.post(
-        "/spin",
+        f"/wheel/{wheel_id}/is_locked",
         auth=BearerAuth("invalid"),
         params=dict(speed=1.0),
     )
     assert response.status_code == HTTPStatus.FORBIDDEN
 
 
-@pytest.mark.skip
-def test_spin__internal_auth(client, internal_auth):
+def test_spin__internal_auth(client, internal_auth, wheel_id):
     response = client.post(
-        "/spin",
+        f"/wheel/{wheel_id}/is_locked",
         auth=internal_auth,
         params=dict(speed=1.0),
     )
     assert response.status_code == HTTPStatus.FORBIDDEN
 
 
-@pytest.mark.skip
-def test_spin__wheel_auth(client, internal_auth):
+def test_spin__wheel_auth(client, wheel_auth, wheel_id):
     response = client.post(
-        "/spin",
-        auth=internal_auth,
+        f"/wheel/{wheel_id}/is_locked",
+        auth=wheel_auth,
         params=dict(speed=1.0),
     )
     assert response.status_code == HTTPStatus.FORBIDDEN
 
 
-@pytest.mark.skip
-def test_spin__success(client, spin_auth_factory, internal_auth):
+def test_spin__success(client, spin_auth_factory, wheel_id):
     response = client.post(
-        "/spin",
+        f"/wheel/{wheel_id}/is_locked",
         auth=spin_auth_factory(),
         params=dict(speed=1.0),
     )
 
     assert response.status_code == HTTPStatus.NO_CONTENT
-
-    state_response = client.get("/state", auth=internal_auth)
-    assert state_response.status_code == HTTPStatus.OK
-    body = state_response.json()
-    assert body["is_locked"]
+    assert _is_locked(wheel_id)
 
 
-@pytest.mark.skip
-def test_spin__twice_fails(client, spin_auth_factory):
+def test_spin__twice_fails(client, spin_auth_factory, wheel_id):
     auth = spin_auth_factory()
     response = client.post(
-        "/spin",
+        f"/wheel/{wheel_id}/is_locked",
         auth=auth,
         params=dict(speed=1.0),
     )
     assert response.status_code == HTTPStatus.NO_CONTENT
 
     second_response = client.post(
-        "/spin",
+        f"/wheel/{wheel_id}/is_locked",
         auth=auth,
         params=dict(speed=1.0),
     )
     assert second_response.status_code == HTTPStatus.CONFLICT
+
+
+def test_unlock__allows_next_spin(client, spin_auth_factory, wheel_auth, wheel_id):
+    client.post(
+        f"/wheel/{wheel_id}/is_locked",
+        auth=spin_auth_factory(),
+        params=dict(speed=1.0),
+    ).raise_for_status()
+
+    response = client.delete("/wheel/is_locked", auth=wheel_auth)
+    assert response.status_code == HTTPStatus.NO_CONTENT
+    assert not _is_locked(wheel_id)
+
+    client.post(
+        f"/wheel/{wheel_id}/is_locked",
+        auth=spin_auth_factory(),
+        params=dict(speed=1.0),
+    ).raise_for_status()
+
+
+def test_load__schedules_unlock_of_wheel_locked_by_other_process(client, config):
+    from misfortune.api import main
+
+    wheel = InternalWheel.create(owner=1, name="Crashed")
+    locked = State.initial(wheel=wheel, code="code").replace(is_locked=True, speed=2.0)
+    scheduler = mock.Mock(spec=Scheduler)
+
+    async def _run() -> State:
+        # The process which spun the wheel died before unlocking it
+        crashed = RedisObservableHub(config.repo)
+        await crashed.observable(main._wheel_key(wheel.id), locked, state_codec)
+        await crashed.close()
+
+        hub = RedisObservableHub(config.repo)
+        with (
+            mock.patch.object(main, "state_hub", hub),
+            mock.patch.object(main, "unlock_scheduler", scheduler),
+        ):
+            state = await main._observe_wheel(wheel)
+        await hub.close()
+        return state.value
+
+    value = asyncio.run(_run())
+
+    assert value.is_locked
+    scheduler.schedule.assert_called_once_with(
+        (wheel.id, value.version),
+        main._spin_duration(2.0),
+    )
@@ -0,0 +1,73 @@
+from datetime import UTC, datetime, timedelta
+
+import jwt
+import pytest
+
+from misfortune.api.tokens import VerifiedTokenCache
+
+_SECRET = "a-secret-that-is-long-enough-for-hs256"
+_OTHER_SECRET = "another-secret-that-is-long-enough-for-hs256"
+
+
+def _token(secret: str, *, expires_in: timedelta = timedelta(days=1)) -> str:
+    return jwt.encode(
+        {"exp": datetime.now(tz=UTC) + expires_in, "wheelId": "wheel"},
+        key=secret,
+        algorithm="HS256",
+    )
+
+
+def test_decode__caches_verified_tokens():
+    cache = VerifiedTokenCache(max_size=10)
+    token = _token(_SECRET)
+
+    assert cache.decode(token, secret=_SECRET)["wheelId"] == "wheel"
+    assert cache.decode(token, secret=_SECRET)["wheelId"] == "wheel"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_decode__does_not_cache_invalid_tokens():
+    cache = VerifiedTokenCache(max_size=10)
+    token = _token(_OTHER_SECRET)
+
+    for _ in range(2):
+        with pytest.raises(jwt.InvalidSignatureError):
+            cache.decode(token, secret=_SECRET)
+
+    assert len(cache) == 0
+    assert cache.misses == 2
+
+
+def test_decode__rejects_expired_entries():
+    cache = VerifiedTokenCache(max_size=10)
+    token = _token(_SECRET, expires_in=timedelta(seconds=-1))
+
+    with pytest.raises(jwt.ExpiredSignatureError):
+        cache.decode(token, secret=_SECRET)
+
+
+def test_decode__invalidates_on_secret_rotation():
+    cache = VerifiedTokenCache(max_size=10)
+    token = _token(_SECRET)
+    cache.decode(token, secret=_SECRET)
+
+    with pytest.raises(jwt.InvalidSignatureError):
+        cache.decode(token, secret=_OTHER_SECRET)
+
+    assert cache.hits == 0
+
+
+def test_decode__evicts_least_recently_used():
+    cache = VerifiedTokenCache(max_size=2)
+    first, second, third = (
+        _token(_SECRET, expires_in=timedelta(days=1, seconds=i)) for i in range(3)
+    )
+    cache.decode(first, secret=_SECRET)
+    cache.decode(second, secret=_SECRET)
+    cache.decode(first, secret=_SECRET)
+    cache.decode(third, secret=_SECRET)
+
+    cache.decode(first, secret=_SECRET)
+    cache.decode(second, secret=_SECRET)
+
+    assert (cache.hits, cache.misses) == (2, 4)
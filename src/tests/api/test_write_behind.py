@@ -0,0 +1,151 @@
+import asyncio
+import dataclasses
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from redis.exceptions import ConnectionError
+
+from misfortune.api.model import Drinks, InternalWheel
+from misfortune.api.repo import ChangeType, Repository
+from misfortune.shared_model import Drink
+from tests.fake_redis import fake_redis
+
+
+def _write_behind_config(config, *, batch_size: int = 100):
+    return dataclasses.replace(
+        config.repo,
+        write_behind_interval=timedelta(hours=1),
+        write_behind_batch_size=batch_size,
+    )
+
+
+def test_write_behind__coalesces_updates_until_flush(config):
+    async def _run() -> None:
+        repo = Repository(_write_behind_config(config))
+        other = Repository(config.repo)
+        wheel = InternalWheel.create(owner=1, name="Created")
+        drinks = Drinks([Drink.create("Beer")])
+        await repo.create_wheel(wheel, max_owned=10)
+
+        await repo.update_wheel_name(wheel.id, name="First")
+        await repo.update_wheel_name(wheel.id, name="Second")
+        await repo.update_wheel_drinks(wheel.id, drinks=drinks)
+
+        # Only the buffering repository sees the updates before they are flushed
+        assert (await repo.fetch_wheel(wheel.id)).name == "Second"
+        assert (await other.fetch_wheel(wheel.id)).name == "Created"
+
+        await repo.flush()
+
+        assert await other.fetch_wheel(wheel.id) == wheel.model_copy(
+            update=dict(name="Second", drinks=drinks)
+        )
+        entries = await other.read_changelog(after=1, count=100)
+        assert entries is not None
+        assert [e.type for e in entries] == [ChangeType.RENAME, ChangeType.DRINKS]
+        await other.close()
+        await repo.close()
+
+    with fake_redis():
+        asyncio.run(_run())
+
+
+def test_write_behind__flushes_after_batch_size_updates(config):
+    async def _run() -> None:
+        repo = Repository(_write_behind_config(config, batch_size=3))
+        wheel = InternalWheel.create(owner=1, name="Created")
+        await repo.create_wheel(wheel, max_owned=10)
+
+        # Coalesced updates of a single wheel count as well
+        for name in ("First", "Second"):
+            await repo.update_wheel_name(wheel.id, name=name)
+        await asyncio.sleep(0)
+        assert repo._pending
+
+        await repo.update_wheel_name(wheel.id, name="Third")
+        async with asyncio.timeout(1):
+            while repo._pending:
+                await asyncio.sleep(0)
+
+        assert await repo.fetch_revision() == 2
+        await repo.close()
+
+    with fake_redis():
+        asyncio.run(_run())
+
+
+def test_write_behind__requeues_failed_flush(config):
+    async def _run() -> None:
+        repo = Repository(_write_behind_config(config))
+        wheel = InternalWheel.create(owner=1, name="Created")
+        drinks = Drinks([Drink.create("Beer")])
+        await repo.create_wheel(wheel, max_owned=10)
+        await repo.update_wheel_name(wheel.id, name="Failed")
+        await repo.update_wheel_drinks(wheel.id, drinks=drinks)
+
+        async def _fail(**kwargs) -> None:
+            # Arrives while the flush is in progress
+            await repo.update_wheel_name(wheel.id, name="Newer")
+            raise ConnectionError
+
+        with (
+            mock.patch.object(repo, "_set_field", side_effect=_fail),
+            pytest.raises(ConnectionError),
+        ):
+            await repo.flush()
+
+        assert repo._pending_updates == 3
+        await repo.flush()
+
+        assert await repo.fetch_wheel(wheel.id) == wheel.model_copy(
+            update=dict(name="Newer", drinks=drinks)
+        )
+        assert await repo.fetch_revision() == 3
+        await repo.close()
+
+    with fake_redis():
+        asyncio.run(_run())
+
+
+def test_write_behind__drops_updates_of_deleted_wheel(config):
+    async def _run() -> None:
+        repo = Repository(_write_behind_config(config, batch_size=3))
+        deleted = InternalWheel.create(owner=1, name="Deleted")
+        kept = InternalWheel.create(owner=1, name="Kept")
+        await repo.create_wheel(deleted, max_owned=10)
+        await repo.create_wheel(kept, max_owned=10)
+        for name in ("First", "Second"):
+            await repo.update_wheel_name(deleted.id, name=name)
+
+        await repo.delete_wheel(deleted.id, owner=1)
+        assert repo._pending_updates == 0
+
+        # The updates of the deleted wheel don't count towards the batch size
+        for name in ("First", "Second"):
+            await repo.update_wheel_name(kept.id, name=name)
+        await asyncio.sleep(0)
+        assert repo._pending_updates == 2
+        assert await repo.find_wheel(deleted.id) is None
+        assert (await repo.fetch_wheel(kept.id)).name == "Second"
+        await repo.close()
+
+    with fake_redis():
+        asyncio.run(_run())
+
+
+def test_write_behind__flushes_on_close(config):
+    async def _run() -> None:
+        repo = Repository(_write_behind_config(config))
+        wheel = InternalWheel.create(owner=1, name="Created")
+        await repo.create_wheel(wheel, max_owned=10)
+        await repo.update_wheel_name(wheel.id, name="Renamed")
+
+        await repo.close()
+
+        other = Repository(config.repo)
+        assert (await other.fetch_wheel(wheel.id)).name == "Renamed"
+        await other.close()
+
+    with fake_redis():
+        asyncio.run(_run())
@@ -0,0 +1,45 @@
+import timeit
+from typing import TYPE_CHECKING
+
+from misfortune.api.model import InternalWheel, State, WheelEncoding
+from misfortune.api.protocol import PatchEncoder, full_encoder
+from misfortune.shared_model import Drink
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+_DRINK_COUNTS = (10, 100, 1000)
+_ROUNDS = 500
+
+
+def _state(drink_count: int) -> State:
+    wheel = InternalWheel.create(owner=1, name="Benchmark")
+    wheel = wheel.model_copy(
+        update={"drinks": [Drink.create(f"Drink {i}") for i in range(drink_count)]}
+    )
+    return State.initial(wheel=wheel, code="code")
+
+
+def _measure(func: Callable[[], object]) -> float:
+    return min(timeit.repeat(func, number=_ROUNDS, repeat=5)) / _ROUNDS * 1e6
+
+
+def main() -> None:
+    print("drinks  message  encoding  encode (µs)  size (bytes)")
+    for drink_count in _DRINK_COUNTS:
+        state = _state(drink_count)
+        spun = state.replace(is_locked=True, speed=2.5, current_drink=drink_count - 1)
+        for encoding in WheelEncoding:
+            encoders: dict[str, Callable[[], str | bytes]] = {
+                "full": lambda: full_encoder(encoding)(spun),
+                "patch": lambda: PatchEncoder.from_base(state, encoding)(spun),
+            }
+            for message, encode in encoders.items():
+                print(
+                    f"{drink_count:>6}  {message:<7}  {encoding:<8}"
+                    f"  {_measure(encode):>11.2f}  {len(encode()):>12}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,488 @@
+import argparse
+import asyncio
+import dataclasses
+import enum
+import json
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+from unittest import mock
+
+import httpx
+import jwt
+import msgpack
+import uvicorn
+from bs_config import Env
+from websockets.asyncio.client import connect
+
+from misfortune.api.model import WheelEncoding, WheelProtocol
+from misfortune.config import Config, StateBackend, WheelLoading
+from tests.fake_redis import fake_redis
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Sequence
+
+    from fastapi import FastAPI
+
+# Starts the API in-process against a fake Redis server and simulates displays, spins,
+# drink changes and bot requests. The results are written as JSON, so runs of
+# different builds can be compared.
+
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class LoadConfig:
+    wheels: int
+    displays: int
+    spin_rate: float
+    drink_churn: float
+    bot_rate: float
+    drinks: int
+    duration: float
+    protocol: WheelProtocol
+    encoding: WheelEncoding
+    state_backend: StateBackend
+    seed: int
+
+
+def _parse_args(argv: Sequence[str] | None) -> tuple[LoadConfig, Path | None]:
+    parser = argparse.ArgumentParser(description="Load test the wheel API")
+    parser.add_argument("--wheels", type=int, default=20)
+    parser.add_argument("--displays", type=int, default=3, help="per wheel")
+    parser.add_argument(
+        "--spin-rate",
+        type=float,
+        default=0.5,
+        help="spins per second and wheel",
+    )
+    parser.add_argument(
+        "--drink-churn",
+        type=float,
+        default=0.2,
+        help="drink additions/removals per second and wheel",
+    )
+    parser.add_argument(
+        "--bot-rate",
+        type=float,
+        default=20.0,
+        help="bot requests per second in total",
+    )
+    parser.add_argument("--drinks", type=int, default=10, help="initial drinks")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument(
+        "--protocol",
+        type=WheelProtocol,
+        choices=list(WheelProtocol),
+        default=WheelProtocol.FULL,
+    )
+    parser.add_argument(
+        "--encoding",
+        type=WheelEncoding,
+        choices=list(WheelEncoding),
+        default=WheelEncoding.JSON,
+    )
+    parser.add_argument(
+        "--state-backend",
+        type=StateBackend,
+        choices=list(StateBackend),
+        default=StateBackend.MEMORY,
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="defaults to stdout")
+    args = parser.parse_args(argv)
+    if args.displays < 1:
+        parser.error("every wheel needs a display, which provides the spin code")
+
+    config = LoadConfig(
+        **{
+            field.name: getattr(args, field.name)
+            for field in dataclasses.fields(LoadConfig)
+        }
+    )
+    return config, args.output
+
+
+def _percentile(samples: Sequence[float], percent: float) -> float | None:
+    if not samples:
+        return None
+
+    # Nearest rank
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def _summary(samples: Sequence[float]) -> dict[str, float | int | None]:
+    def _ms(value: float | None) -> float | None:
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        "count": len(samples),
+        "p50_ms": _ms(_percentile(samples, 50)),
+        "p99_ms": _ms(_percentile(samples, 99)),
+        "max_ms": _ms(max(samples, default=None)),
+    }
+
+
+@dataclasses.dataclass
+class _Wheel:
+    id: uuid.UUID
+    owner: int
+    token: str
+    state: dict[str, Any] = dataclasses.field(default_factory=dict)
+    spin_sent_at: float | None = None
+    churn_count: int = 0
+
+
+class _Recorder:
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.failures: dict[str, int] = defaultdict(int)
+        self.broadcast_delays: list[float] = []
+        self.messages = 0
+        self.bytes = 0
+
+    async def request(
+        self,
+        operation: str,
+        request: Awaitable[httpx.Response],
+    ) -> httpx.Response | None:
+        start = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            self.failures[operation] += 1
+            return None
+
+        self.latencies[operation].append(time.perf_counter() - start)
+        self.statuses[operation][response.status_code] += 1
+        return response
+
+    def report(self, duration: float) -> dict[str, Any]:
+        operations = {}
+        for operation, latencies in sorted(self.latencies.items()):
+            statuses = self.statuses[operation]
+            operations[operation] = {
+                **_summary(latencies),
+                "throughput_per_second": round(len(latencies) / duration, 3),
+                "failures": self.failures[operation],
+                "statuses": {str(code): count for code, count in statuses.items()},
+            }
+
+        return {
+            "operations": operations,
+            "broadcast_delay": _summary(self.broadcast_delays),
+            "messages": {
+                "count": self.messages,
+                "bytes": self.bytes,
+                "per_second": round(self.messages / duration, 3),
+            },
+        }
+
+
+def _api_config(load: LoadConfig) -> Config:
+    env = Env.load(
+        include_default_dotenv=True,
+        toml_configs=[Path("config-test.toml")],
+    )
+    config = Config.from_env(env)
+    return dataclasses.replace(
+        config,
+        state_backend=load.state_backend,
+        wheel_loading=WheelLoading.EAGER,
+        max_user_wheels=1,
+    )
+
+
+def _decode(message: str | bytes) -> dict[str, Any]:
+    if isinstance(message, bytes):
+        return msgpack.unpackb(message)
+
+    return json.loads(message)
+
+
+class _Simulation:
+    def __init__(
+        self,
+        load: LoadConfig,
+        config: Config,
+        client: httpx.AsyncClient,
+        ws_url: str,
+    ) -> None:
+        self._load = load
+        self._config = config
+        self._client = client
+        self._ws_url = ws_url
+        self._random = random.Random(load.seed)
+        self._internal = {"Authorization": f"Bearer {config.internal_token}"}
+        self._stopping = asyncio.Event()
+        self._requests: set[asyncio.Task[httpx.Response | None]] = set()
+        self.wheels: list[_Wheel] = []
+        self.recorder = _Recorder()
+
+    async def _sleep(self, rate: float) -> bool:
+        # Poisson arrivals, returns False once the simulation is over
+        if rate <= 0:
+            await self._stopping.wait()
+            return False
+
+        try:
+            await asyncio.wait_for(
+                self._stopping.wait(),
+                self._random.expovariate(rate),
+            )
+        except TimeoutError:
+            return True
+
+        return False
+
+    async def create_wheels(self) -> None:
+        client = self._client
+        for owner in range(1, self._load.wheels + 1):
+            response = await client.post(
+                f"/user/{owner}/wheel",
+                params={"name": f"Wheel {owner}"},
+                headers=self._internal,
+            )
+            response.raise_for_status()
+            wheel_id = uuid.UUID(response.json()["id"])
+            for index in range(self._load.drinks):
+                response = await client.post(
+                    f"/user/{owner}/wheel/{wheel_id}/drink",
+                    params={"name": f"Drink {index}"},
+                    headers=self._internal,
+                )
+                response.raise_for_status()
+
+            token = jwt.encode(
+                {
+                    "exp": datetime.now(tz=UTC) + timedelta(hours=1),
+                    "wheelId": str(wheel_id),
+                },
+                key=self._config.jwt_secret,
+                algorithm="HS256",
+            )
+            self.wheels.append(_Wheel(id=wheel_id, owner=owner, token=token))
+
+    async def _display(self, wheel: _Wheel, ready: asyncio.Event) -> None:
+        load = self._load
+        recorder = self.recorder
+        state: dict[str, Any] = {}
+        async with connect(self._ws_url, max_size=None) as websocket:
+            await websocket.send(
+                json.dumps(
+                    {
+                        "token": wheel.token,
+                        "protocol": load.protocol,
+                        "encoding": load.encoding,
+                    }
+                )
+            )
+            async for message in websocket:
+                received_at = time.perf_counter()
+                recorder.messages += 1
+                recorder.bytes += len(message)
+                payload = _decode(message)
+                was_locked = state.get("is_locked", False)
+                match payload.get("type"):
+                    case "snapshot":
+                        state = payload["state"]
+                    case "patch":
+                        state = state | payload["changes"]
+                    case _:
+                        state = payload
+
+                wheel.state = state
+                ready.set()
+                if (
+                    state["is_locked"]
+                    and not was_locked
+                    and (sent_at := wheel.spin_sent_at) is not None
+                ):
+                    recorder.broadcast_delays.append(received_at - sent_at)
+
+    async def _spin(self, wheel: _Wheel) -> None:
+        client = self._client
+        recorder = self.recorder
+        while await self._sleep(self._load.spin_rate):
+            code = wheel.state.get("code")
+            wheel.spin_sent_at = time.perf_counter()
+            response = await recorder.request(
+                "spin",
+                client.post(
+                    f"/wheel/{wheel.id}/is_locked",
+                    params={"speed": self._random.uniform(1, 10)},
+                    headers={"Authorization": f"Bearer {code}"},
+                ),
+            )
+            if response is None or response.is_error:
+                continue
+
+            await recorder.request(
+                "unlock",
+                client.delete(
+                    "/wheel/is_locked",
+                    headers={"Authorization": f"Bearer {wheel.token}"},
+                ),
+            )
+
+    async def _churn_drinks(self, wheel: _Wheel) -> None:
+        client = self._client
+        recorder = self.recorder
+        base = f"/user/{wheel.owner}/wheel/{wheel.id}"
+        while await self._sleep(self._load.drink_churn):
+            wheel.churn_count += 1
+            if wheel.churn_count % 2:
+                await recorder.request(
+                    "add_drink",
+                    client.post(
+                        f"{base}/drink",
+                        params={"name": f"Churn {wheel.churn_count}"},
+                        headers=self._internal,
+                    ),
+                )
+                continue
+
+            drink = next(
+                (
+                    drink
+                    for drink in wheel.state.get("drinks", [])
+                    if drink["name"].startswith("Churn ")
+                ),
+                None,
+            )
+            if drink is not None:
+                await recorder.request(
+                    "delete_drink",
+                    client.delete(
+                        f"{base}/drink/{drink['id']}",
+                        headers=self._internal,
+                    ),
+                )
+
+    async def _bot(self) -> None:
+        client = self._client
+        recorder = self.recorder
+        while await self._sleep(self._load.bot_rate):
+            wheel = self._random.choice(self.wheels)
+            if self._random.random() < 0.5:
+                request = recorder.request(
+                    "list_wheels",
+                    client.get(f"/user/{wheel.owner}/wheel", headers=self._internal),
+                )
+            else:
+                request = recorder.request(
+                    "get_wheel",
+                    client.get(
+                        f"/user/{wheel.owner}/wheel/{wheel.id}",
+                        headers=self._internal,
+                    ),
+                )
+            # Bot requests are independent of each other
+            task = asyncio.create_task(request)
+            self._requests.add(task)
+            task.add_done_callback(self._requests.discard)
+
+    async def run(self) -> float:
+        displays = []
+        ready = []
+        for wheel in self.wheels:
+            for _ in range(self._load.displays):
+                event = asyncio.Event()
+                ready.append(event)
+                displays.append(asyncio.create_task(self._display(wheel, event)))
+
+        await asyncio.wait_for(
+            asyncio.gather(*(event.wait() for event in ready)),
+            timeout=30,
+        )
+
+        workers = [
+            *(asyncio.create_task(self._spin(wheel)) for wheel in self.wheels),
+            *(asyncio.create_task(self._churn_drinks(wheel)) for wheel in self.wheels),
+            asyncio.create_task(self._bot()),
+        ]
+        start = time.perf_counter()
+        await asyncio.sleep(self._load.duration)
+        self._stopping.set()
+        await asyncio.gather(*workers, *self._requests)
+        duration = time.perf_counter() - start
+
+        for display in displays:
+            display.cancel()
+        await asyncio.gather(*displays, return_exceptions=True)
+        return duration
+
+
+async def _serve(app: FastAPI) -> tuple[uvicorn.Server, asyncio.Task[None], int]:
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app,
+            host="127.0.0.1",
+            port=0,
+            log_level="warning",
+        )
+    )
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+
+    port = next(socket.getsockname()[1] for s in server.servers for socket in s.sockets)
+    return server, task, port
+
+
+async def _run(load: LoadConfig) -> dict[str, Any]:
+    config = _api_config(load)
+    with (
+        fake_redis(),
+        mock.patch("misfortune.config.init_config", return_value=config),
+    ):
+        from misfortune.api.main import app
+
+        server, serving, port = await _serve(app)
+        try:
+            async with httpx.AsyncClient(
+                base_url=f"http://127.0.0.1:{port}",
+                limits=httpx.Limits(max_connections=200),
+                timeout=30,
+            ) as client:
+                simulation = _Simulation(
+                    load,
+                    config,
+                    client,
+                    f"ws://127.0.0.1:{port}/ws",
+                )
+                await simulation.create_wheels()
+                duration = await simulation.run()
+        finally:
+            server.should_exit = True
+            await serving
+
+    return {
+        "config": {
+            key: value.value if isinstance(value, enum.Enum) else value
+            for key, value in dataclasses.asdict(load).items()
+        },
+        "duration_seconds": round(duration, 3),
+        **simulation.recorder.report(duration),
+    }
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    load, output = _parse_args(argv)
+    report = json.dumps(asyncio.run(_run(load)), indent=2)
+    if output is not None:
+        output.write_text(report + "\n")
+    else:
+        sys.stdout.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
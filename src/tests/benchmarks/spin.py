@@ -0,0 +1,64 @@
+import asyncio
+import timeit
+from typing import TYPE_CHECKING
+
+from misfortune.api.model import InternalWheel, State
+from misfortune.api.protocol import encode_full
+from misfortune.observable import observable
+from misfortune.shared_model import Drink
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+_DRINK_COUNTS = (10, 100, 1000)
+_ROUNDS = 2000
+
+
+def _state(drink_count: int) -> State:
+    wheel = InternalWheel.create(owner=1, name="Benchmark")
+    wheel = wheel.model_copy(
+        update={"drinks": [Drink.create(f"Drink {i}") for i in range(drink_count)]}
+    )
+    return State.initial(wheel=wheel, code="code")
+
+
+def _spin(state: State) -> State:
+    return state.replace(
+        is_locked=not state.is_locked,
+        speed=state.speed + 1,
+        current_drink=len(state.drinks) - 1,
+    )
+
+
+def _measure(func: Callable[[], object]) -> float:
+    return min(timeit.repeat(func, number=_ROUNDS, repeat=5)) / _ROUNDS * 1e6
+
+
+def _run(drink_count: int) -> tuple[float, float, float]:
+    state = _state(drink_count)
+    spun = _spin(state)
+    subject = observable(state)
+    loop = asyncio.new_event_loop()
+
+    def _update() -> None:
+        loop.run_until_complete(subject.update(_spin(subject.value)))
+
+    try:
+        return (
+            _measure(lambda: _spin(state)),
+            _measure(_update),
+            _measure(lambda: encode_full(spun)),
+        )
+    finally:
+        loop.close()
+
+
+def main() -> None:
+    print("drinks  replace (µs)  update (µs)  encode (µs)")
+    for drink_count in _DRINK_COUNTS:
+        replace, update, encode = _run(drink_count)
+        print(f"{drink_count:>6}  {replace:>12.2f}  {update:>11.2f}  {encode:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import asyncio
+from unittest import mock
+from uuid import uuid4
+
+from fakeredis import FakeAsyncRedis
+
+from misfortune.bot.model import UserState
+from misfortune.bot.repo import Repository
+from misfortune.config import RepoConfig
+from tests.fake_redis import fake_redis
+
+_REPO_CONFIG = RepoConfig(host="localhost", username="test", password=None)
+
+
+def test_migrate__indexes_existing_states():
+    # More states than fit into a single batch
+    states = {
+        user_id: UserState(
+            active_wheel=None,
+            drinks_message=user_id,
+            pending_registration_id=uuid4(),
+        )
+        for user_id in range(1, Repository._BATCH_SIZE * 2 + 2)
+    }
+
+    async def _run(server) -> None:
+        repo = Repository(_REPO_CONFIG)
+        # The states as the schema without an index stored them
+        client = FakeAsyncRedis(server=server)
+        for user_id, state in states.items():
+            await client.set(repo._state_key(user_id), state.model_dump_json())
+
+        await repo.migrate()
+        await repo.migrate()
+
+        assert await client.scard(repo._index_key) == len(states)
+        with mock.patch.object(repo._client, "mget", wraps=repo._client.mget) as mget:
+            assert await repo.load_user_states() == states
+        assert mget.call_count == 3
+        await client.aclose()
+        await repo.close()
+
+    with fake_redis() as server:
+        asyncio.run(_run(server))
+
+
+def test_load_user_states__skips_missing_states():
+    async def _run(server) -> None:
+        repo = Repository(_REPO_CONFIG)
+        state = UserState.create()
+        await repo.update_user_state(1, state)
+        # The index entry of a state which was removed by hand
+        client = FakeAsyncRedis(server=server)
+        await client.sadd(repo._index_key, 2)
+
+        assert await repo.load_user_states() == {1: state}
+        await client.aclose()
+        await repo.close()
+
+    with fake_redis() as server:
+        asyncio.run(_run(server))
@@ -0,0 +1,39 @@
+from contextlib import ExitStack, contextmanager
+from typing import TYPE_CHECKING
+from unittest import mock
+
+from fakeredis import FakeAsyncRedis, FakeServer
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from redis.asyncio import Redis
+
+    from misfortune.config import RepoConfig
+
+# Every module that creates Redis clients imports create_client by name
+_CLIENT_FACTORIES = (
+    "misfortune.api.repo.create_client",
+    "misfortune.bot.repo.create_client",
+    "misfortune.observable.create_client",
+    "misfortune.redis_pool.create_client",
+)
+
+
+@contextmanager
+def fake_redis() -> Iterator[FakeServer]:
+    server = FakeServer()
+
+    def _create_client(
+        config: RepoConfig,
+        *,
+        blocking_reads: bool = False,
+        retry: bool = True,
+        host: str | None = None,
+    ) -> Redis:
+        return FakeAsyncRedis(server=server, protocol=3)
+
+    with ExitStack() as stack:
+        for target in _CLIENT_FACTORIES:
+            stack.enter_context(mock.patch(target, _create_client))
+        yield server
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from misfortune.metrics import MetricsRegistry, timed
+
+
+def test_histogram__renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    family = registry.histogram(
+        "test_seconds",
+        "Test latency",
+        label_names=("method",),
+        buckets=(0.1, 1.0),
+    )
+    histogram = family.labels("get")
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert registry.render().splitlines() == [
+        "# HELP test_seconds Test latency",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{method="get",le="0.1"} 2',
+        'test_seconds_bucket{method="get",le="1.0"} 3',
+        'test_seconds_bucket{method="get",le="+Inf"} 4',
+        'test_seconds_sum{method="get"} 2.65',
+        'test_seconds_count{method="get"} 4',
+    ]
+
+
+def test_histogram__rejects_wrong_labels():
+    family = MetricsRegistry().histogram("test", "Test", label_names=("method",))
+    with pytest.raises(ValueError):
+        family.labels()
+
+
+def test_gauge__reads_labelled_samples_on_render():
+    registry = MetricsRegistry()
+    values = {"a": 1}
+    registry.gauge(
+        "test_gauge",
+        "Test gauge",
+        lambda: (((key,), value) for key, value in values.items()),
+        label_names=("key",),
+    )
+    values["b"] = 2
+
+    assert registry.render().splitlines()[2:] == [
+        'test_gauge{key="a"} 1',
+        'test_gauge{key="b"} 2',
+    ]
+
+
+def test_register__rejects_duplicate_names():
+    registry = MetricsRegistry()
+    registry.counter("test_total", "Test", lambda: 0)
+    with pytest.raises(ValueError):
+        registry.counter("test_total", "Test", lambda: 0)
+
+
+def test_timed__observes_duration():
+    histogram = MetricsRegistry().histogram("test_seconds", "Test").labels()
+
+    @timed(histogram)
+    async def _sleep() -> str:
+        await asyncio.sleep(0.01)
+        return "done"
+
+    assert asyncio.run(_sleep()) == "done"
+    assert histogram.count == 1
+    assert histogram.sum >= 0.01
@@ -0,0 +1,457 @@
+import asyncio
+import logging
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import TYPE_CHECKING, Any
+
+import pytest
+from fakeredis import FakeAsyncRedis
+
+from misfortune.config import OverflowPolicy, RepoConfig
+from misfortune.metrics import registry
+from misfortune.observable import (
+    Codec,
+    LockMonitoring,
+    Observable,
+    QueuedListener,
+    RedisObservableHub,
+    StaleRevisionError,
+    Versioned,
+    observable,
+    payload_stats,
+    queue_stats,
+)
+from tests.fake_redis import fake_redis
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Callable
+
+
+def test_queued_listener__update_does_not_wait_for_listener():
+    async def _run() -> None:
+        release = asyncio.Event()
+        received: list[int] = []
+
+        async def _slow(value: int) -> None:
+            await release.wait()
+            received.append(value)
+
+        listener = QueuedListener(_slow, max_size=4, policy=OverflowPolicy.CONFLATE)
+        subject = observable(1)
+        subject.add_listener(listener)
+
+        await asyncio.wait_for(subject.update(2), timeout=1)
+        await asyncio.wait_for(subject.update(3), timeout=1)
+
+        release.set()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        await listener.close()
+        assert received == [2, 3]
+
+    asyncio.run(_run())
+
+
+def test_queued_listener__conflates_to_latest():
+    async def _run() -> None:
+        release = asyncio.Event()
+        received: list[int] = []
+
+        async def _slow(value: int) -> None:
+            await release.wait()
+            received.append(value)
+
+        dropped = queue_stats.dropped
+        listener = QueuedListener(_slow, max_size=1, policy=OverflowPolicy.CONFLATE)
+        for value in range(5):
+            listener.offer(value)
+            await asyncio.sleep(0)
+
+        release.set()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        await listener.close()
+
+        assert received == [0, 4]
+        assert listener.dropped == 3
+        assert queue_stats.dropped == dropped + 3
+        assert "misfortune_broadcast_dropped_total" in registry.render()
+
+    asyncio.run(_run())
+
+
+def test_queued_listener__disconnects_slow_subscriber():
+    async def _run() -> None:
+        overflowed = asyncio.Event()
+
+        async def _stuck(value: int) -> None:
+            await asyncio.Event().wait()
+
+        async def _on_overflow() -> None:
+            overflowed.set()
+
+        listener = QueuedListener(
+            _stuck,
+            max_size=1,
+            policy=OverflowPolicy.DISCONNECT,
+            on_overflow=_on_overflow,
+        )
+        listener.offer(0)
+        await asyncio.sleep(0)
+        listener.offer(1)
+        listener.offer(2)
+
+        await asyncio.wait_for(overflowed.wait(), timeout=1)
+        assert listener.dropped == 2
+        await listener.close()
+
+    asyncio.run(_run())
+
+
+def test_observable__failing_listener_does_not_affect_others():
+    async def _run() -> None:
+        received: list[int] = []
+
+        async def _failing(value: int) -> None:
+            raise ValueError(value)
+
+        async def _working(value: int) -> None:
+            received.append(value)
+
+        subject = observable(1)
+        subject.add_listener(_failing)
+        subject.add_listener(_working)
+        await subject.update(2)
+
+        assert received == [2]
+
+    asyncio.run(_run())
+
+
+def test_encode__shares_payload_between_subscribers():
+    async def _run() -> None:
+        calls: list[int] = []
+
+        def _encoder(value: int) -> str:
+            calls.append(value)
+            return str(value)
+
+        subject = observable(1)
+        stats_before = payload_stats.reused
+
+        assert [subject.encode(1, _encoder) for _ in range(3)] == ["1", "1", "1"]
+        await subject.update(2)
+        assert subject.encode(2, _encoder) == "2"
+
+        assert calls == [1, 2]
+        assert payload_stats.reused - stats_before == 2
+
+    asyncio.run(_run())
+
+
+@dataclass(frozen=True)
+class _Versioned(Versioned):
+    version: int
+    payload: list[int]
+
+
+def test_update__compares_versioned_values_by_version():
+    async def _run() -> None:
+        received: list[_Versioned] = []
+
+        async def _listener(value: _Versioned) -> None:
+            received.append(value)
+
+        subject = observable(_Versioned(version=0, payload=[]))
+        subject.add_listener(_listener)
+
+        await subject.update(_Versioned(version=0, payload=[1]))
+        await subject.update(_Versioned(version=1, payload=[]))
+
+        assert [value.version for value in received] == [1]
+
+    asyncio.run(_run())
+
+
+def test_update__compares_other_values_by_equality():
+    async def _run() -> None:
+        received: list[uuid.UUID] = []
+
+        async def _listener(value: uuid.UUID) -> None:
+            received.append(value)
+
+        # UUIDs have a version as well, which is the same for all random ones
+        first = uuid.uuid4()
+        second = uuid.uuid4()
+        subject = observable(first)
+        subject.add_listener(_listener)
+
+        await subject.update(first)
+        await subject.update(second)
+
+        assert received == [second]
+
+    asyncio.run(_run())
+
+
+def test_lock_monitor__records_contention(caplog):
+    async def _run() -> None:
+        monitoring = LockMonitoring(hold_warning=timedelta(milliseconds=5))
+        subject = observable(1, monitor=monitoring.monitor("contended"))
+
+        async def _hold() -> None:
+            async with subject.atomic() as atom:
+                await asyncio.sleep(0.01)
+                await atom.update(atom.value + 1)
+
+        await asyncio.gather(_hold(), subject.update(5))
+
+        metrics = registry.render()
+        assert 'misfortune_lock_wait_seconds_count{observable="contended"} 2' in metrics
+        assert 'misfortune_lock_hold_seconds_count{observable="contended"} 2' in metrics
+        assert (
+            'misfortune_lock_queue_depth_bucket{observable="contended",le="0"} 1'
+            in metrics
+        )
+        assert (
+            'misfortune_listener_notification_seconds_count{observable="contended"} 2'
+            in metrics
+        )
+
+        monitoring.release("contended")
+        assert 'observable="contended"' not in registry.render()
+
+    with caplog.at_level(logging.WARNING, logger="misfortune.observable"):
+        asyncio.run(_run())
+
+    assert "Held lock of contended" in caplog.text
+
+
+_REPO_CONFIG = RepoConfig(host="localhost", username="test", password=None)
+_INT_CODEC = Codec(encode=lambda value: str(value).encode(), decode=int)
+
+
+async def _eventually(predicate: Callable[[], bool]) -> None:
+    async with asyncio.timeout(1):
+        while not predicate():
+            await asyncio.sleep(0.01)
+
+
+@asynccontextmanager
+async def _hubs(**kwargs: Any) -> AsyncIterator[list[RedisObservableHub]]:
+    hubs = [RedisObservableHub(_REPO_CONFIG, **kwargs) for _ in range(2)]
+    for hub in hubs:
+        await hub.start()
+
+    try:
+        yield hubs
+    finally:
+        for hub in hubs:
+            await hub.close()
+
+
+def test_redis_hub__propagates_updates():
+    async def _run() -> None:
+        created: list[str] = []
+
+        async def _on_created(key: str, state: Observable[int]) -> None:
+            created.append(key)
+
+        async def _on_discarded(key: str) -> None:
+            pass
+
+        async with _hubs() as (first, second):
+            second.watch(
+                "wheel:",
+                _INT_CODEC,
+                on_created=_on_created,
+                on_discarded=_on_discarded,
+            )
+            writer = await first.observable("wheel:1", 1, _INT_CODEC)
+            await _eventually(lambda: created == ["wheel:1"])
+            reader = await second.observable("wheel:1", 5, _INT_CODEC)
+            assert reader.value == 1
+
+            await writer.update(2)
+            await _eventually(lambda: reader.value == 2)
+
+            await reader.update(3)
+            await _eventually(lambda: writer.value == 3)
+
+    with fake_redis():
+        asyncio.run(_run())
+
+
+def test_redis_hub__observable_keeps_instance_announced_meanwhile():
+    async def _run() -> None:
+        created: list[Observable[int]] = []
+
+        async def _on_created(key: str, state: Observable[int]) -> None:
+            created.append(state)
+
+        async def _on_discarded(key: str) -> None:
+            pass
+
+        async with _hubs() as (hub, other):
+            hub.watch(
+                "wheel:",
+                _INT_CODEC,
+                on_created=_on_created,
+                on_discarded=_on_discarded,
+            )
+            pipeline = hub._client.pipeline
+
+            @asynccontextmanager
+            async def _pipeline(**kwargs: Any) -> AsyncIterator[Any]:
+                async with pipeline(**kwargs) as pipe:
+                    execute = pipe.execute
+
+                    async def _execute() -> list[Any]:
+                        results = await execute()
+                        # Another process announces the key before the results arrive
+                        await hub._dispatch("wheel:1", 0, b"1")
+                        return results
+
+                    pipe.execute = _execute
+                    yield pipe
+
+            hub._client.pipeline = _pipeline
+            subject = await hub.observable("wheel:1", 1, _INT_CODEC)
+            del hub._client.pipeline
+
+            assert created == [subject]
+            writer = await other.observable("wheel:1", None, _INT_CODEC)
+            await writer.update(2)
+            await _eventually(lambda: subject.value == 2)
+
+    with fake_redis():
+        asyncio.run(_run())
+
+
+def test_redis_hub__ignores_stale_revisions():
+    async def _run(server) -> None:
+        async with _hubs() as (first, second):
+            writer = await first.observable("wheel:1", 1, _INT_CODEC)
+            reader = await second.observable("wheel:1", None, _INT_CODEC)
+            await writer.update(2)
+            await writer.update(3)
+            await _eventually(lambda: reader.value == 3)
+
+            client = FakeAsyncRedis(server=server)
+            await client.publish("test:api:observable:wheel:1", b"1:7")
+            await client.publish("test:api:observable:wheel:1", b"3:8")
+            await client.publish("test:api:observable:wheel:1", b"4:9")
+            await client.aclose()
+
+            await _eventually(lambda: reader.value == 9)
+
+    with fake_redis() as server:
+        asyncio.run(_run(server))
+
+
+def test_redis_hub__atomic_fetches_unpublished_writes():
+    async def _run(server) -> None:
+        async with _hubs() as (hub, _):
+            subject = await hub.observable("wheel:1", 1, _INT_CODEC)
+
+            client = FakeAsyncRedis(server=server)
+            await client.hset(
+                "test:api:observable:wheel:1",
+                mapping={"value": b"5", "revision": 3},
+            )
+            await client.aclose()
+
+            async with subject.atomic() as atom:
+                assert atom.value == 5
+                await atom.update(6)
+
+            assert (await hub.get("wheel:1", _INT_CODEC)).value == 6
+
+    with fake_redis() as server:
+        asyncio.run(_run(server))
+
+
+def test_redis_hub__accepts_retried_write():
+    async def _run() -> None:
+        async with _hubs() as (hub, _):
+            await hub._write("wheel:1", 1, b"5")
+            # The client retries a write it didn't get a response for
+            await hub._write("wheel:1", 1, b"5")
+
+            with pytest.raises(StaleRevisionError):
+                await hub._write("wheel:1", 1, b"6")
+            assert (await hub.get("wheel:1", _INT_CODEC)).value == 5
+
+    with fake_redis():
+        asyncio.run(_run())
+
+
+def test_redis_hub__release_stops_tracking():
+    async def _run() -> None:
+        async with _hubs() as (first, second):
+            released = await first.observable("wheel:1", 1, _INT_CODEC)
+            writer = await second.observable("wheel:1", None, _INT_CODEC)
+
+            first.release("wheel:1")
+            await writer.update(2)
+            reloaded = await first.observable("wheel:1", None, _INT_CODEC)
+
+            assert reloaded is not released
+            assert reloaded.value == 2
+            await asyncio.sleep(0.05)
+            assert released.value == 1
+
+    with fake_redis():
+        asyncio.run(_run())
+
+
+def test_redis_hub__discard_reaches_other_processes():
+    async def _run() -> None:
+        discarded: list[str] = []
+
+        async def _on_created(key: str, state: Observable[int]) -> None:
+            pass
+
+        async def _on_discarded(key: str) -> None:
+            discarded.append(key)
+
+        async with _hubs() as (first, second):
+            second.watch(
+                "wheel:",
+                _INT_CODEC,
+                on_created=_on_created,
+                on_discarded=_on_discarded,
+            )
+            await first.observable("wheel:1", 1, _INT_CODEC)
+            await second.observable("wheel:1", None, _INT_CODEC)
+
+            await first.discard("wheel:1")
+
+            await _eventually(lambda: discarded == ["wheel:1"])
+            assert await second.get("wheel:1", _INT_CODEC) is None
+
+    with fake_redis():
+        asyncio.run(_run())
+
+
+def test_redis_hub__rejects_writes_after_lock_expired(caplog):
+    async def _run() -> None:
+        async with _hubs(lock_timeout=timedelta(milliseconds=50)) as (first, second):
+            stalled = await first.observable("wheel:1", 1, _INT_CODEC)
+            other = await second.observable("wheel:1", None, _INT_CODEC)
+
+            with pytest.raises(StaleRevisionError):
+                async with stalled.atomic() as atom:
+                    await asyncio.sleep(0.1)
+                    await other.update(2)
+                    await atom.update(3)
+
+            await _eventually(lambda: stalled.value == 2)
+            assert (await first.get("wheel:1", _INT_CODEC)).value == 2
+
+    with fake_redis(), caplog.at_level(logging.WARNING, "misfortune.observable"):
+        asyncio.run(_run())
+
+    assert "Lock of wheel:1 expired before it was released" in caplog.text
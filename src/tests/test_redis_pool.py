@@ -0,0 +1,106 @@
+import asyncio
+from unittest import mock
+
+from redis.exceptions import ConnectionError
+
+from misfortune.config import RepoConfig
+from misfortune.redis_pool import ReplicaReader, create_client
+
+_HEALTHY = {
+    "role": "slave",
+    "master_link_status": "up",
+    "slave_repl_offset": 1000,
+}
+_MAX_LAG = 100
+
+
+def test_create_client__retries_only_if_allowed():
+    config = RepoConfig(host="localhost", username=None, password=None, retries=2)
+
+    def _retries(**kwargs) -> int:
+        pool = create_client(config, **kwargs).connection_pool
+        return pool.connection_kwargs["retry"].get_retries()
+
+    assert _retries() == 2
+    assert _retries(retry=False) == 0
+
+
+def _primary(offset: int = 1000) -> mock.Mock:
+    primary = mock.Mock()
+    primary.info = mock.AsyncMock(return_value={"master_repl_offset": offset})
+    return primary
+
+
+def _replica(**info) -> mock.Mock:
+    replica = mock.Mock()
+    replica.info = mock.AsyncMock(return_value=_HEALTHY | info)
+    return replica
+
+
+def test_replica_reader__alternates_healthy_replicas():
+    primary = _primary()
+    first = _replica()
+    second = _replica(slave_repl_offset=1000 - _MAX_LAG)
+    reader = ReplicaReader(primary, [first, second], max_lag=_MAX_LAG)
+
+    async def _run() -> list[object]:
+        return [await reader.client() for _ in range(4)]
+
+    assert asyncio.run(_run()) == [first, second, first, second]
+    assert reader.fallbacks == 0
+    # The offset of the primary is only checked once per interval
+    assert primary.info.await_count == 1
+
+
+def test_replica_reader__skips_unhealthy_replicas():
+    primary = _primary()
+    healthy = _replica()
+    unreachable = _replica()
+    unreachable.info.side_effect = ConnectionError
+    replicas = [
+        _replica(master_link_status="down"),
+        _replica(slave_repl_offset=1000 - _MAX_LAG - 1),
+        _replica(role="master"),
+        unreachable,
+        healthy,
+    ]
+    reader = ReplicaReader(primary, replicas, max_lag=_MAX_LAG)
+
+    async def _run() -> list[object]:
+        return [await reader.client() for _ in range(2)]
+
+    assert asyncio.run(_run()) == [healthy, healthy]
+    assert reader.fallbacks == 0
+
+
+def test_replica_reader__falls_back_to_primary():
+    primary = _primary()
+    # Still connected to the primary, but far behind it
+    stale = _replica(slave_repl_offset=10)
+    reader = ReplicaReader(primary, [stale], max_lag=_MAX_LAG)
+
+    async def _run() -> list[object]:
+        return [await reader.client() for _ in range(3)]
+
+    assert asyncio.run(_run()) == [primary, primary, primary]
+    assert reader.fallbacks == 3
+    # The health of a replica is only checked once per interval
+    assert stale.info.await_count == 1
+
+
+def test_replica_reader__falls_back_without_primary_offset():
+    primary = _primary()
+    primary.info.side_effect = ConnectionError
+    replica = _replica()
+    reader = ReplicaReader(primary, [replica], max_lag=_MAX_LAG)
+
+    assert asyncio.run(reader.client()) is primary
+    assert replica.info.await_count == 0
+
+
+def test_replica_reader__uses_primary_without_replicas():
+    primary = _primary()
+    reader = ReplicaReader(primary, [], max_lag=_MAX_LAG)
+
+    assert asyncio.run(reader.client()) is primary
+    assert reader.fallbacks == 0
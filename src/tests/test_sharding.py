@@ -0,0 +1,84 @@
+import asyncio
+import uuid
+from collections import Counter
+
+import httpx
+import pytest
+
+from misfortune.sharding import HashRing, ShardRoutingTransport, wheel_id_from_path
+
+_MEMBERS = ["http://api-0:8000", "http://api-1:8000", "http://api-2:8000"]
+
+
+def test_ring__requires_members():
+    with pytest.raises(ValueError):
+        HashRing([])
+
+
+def test_ring__spreads_wheels_evenly():
+    ring = HashRing(_MEMBERS)
+    wheel_ids = [uuid.uuid4() for _ in range(3000)]
+
+    owners = Counter(ring.owner(wheel_id) for wheel_id in wheel_ids)
+
+    assert owners.keys() == set(_MEMBERS)
+    assert min(owners.values()) > 600
+    assert [ring.owner(wheel_id) for wheel_id in wheel_ids] == [
+        HashRing(list(reversed(_MEMBERS))).owner(wheel_id) for wheel_id in wheel_ids
+    ]
+
+
+def test_ring__only_moves_wheels_of_added_member():
+    ring = HashRing(_MEMBERS)
+    grown = HashRing([*_MEMBERS, "http://api-3:8000"])
+    wheel_ids = [uuid.uuid4() for _ in range(3000)]
+
+    moved = [w for w in wheel_ids if ring.owner(w) != grown.owner(w)]
+
+    assert all(grown.owner(w) == "http://api-3:8000" for w in moved)
+    assert len(moved) < 1200
+
+
+def test_wheel_id_from_path():
+    wheel_id = uuid.uuid4()
+
+    assert wheel_id_from_path(f"/user/1/wheel/{wheel_id}") == wheel_id
+    assert wheel_id_from_path(f"/user/1/wheel/{wheel_id}/drink") == wheel_id
+    assert wheel_id_from_path(f"/wheel/{wheel_id}/is_locked") == wheel_id
+    assert wheel_id_from_path("/user/1/wheel") is None
+
+
+def test_transport__routes_wheel_requests_to_owner():
+    ring = HashRing(_MEMBERS)
+    wheel_id = uuid.uuid4()
+    requests: list[httpx.Request] = []
+
+    def _handle(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200)
+
+    async def _run() -> None:
+        async with httpx.AsyncClient(
+            base_url="https://api.example.com",
+            transport=ShardRoutingTransport(
+                ring,
+                transport=httpx.MockTransport(_handle),
+            ),
+        ) as client:
+            await client.get(f"/user/1/wheel/{wheel_id}", params=dict(a="b"))
+            await client.get("/user/1/wheel")
+            await client.post(f"/user/1/wheel/{wheel_id}/registration")
+
+    asyncio.run(_run())
+
+    owner = httpx.URL(ring.owner(wheel_id))
+    assert requests[0].url == owner.copy_with(
+        path=f"/user/1/wheel/{wheel_id}",
+        query=b"a=b",
+    )
+    assert requests[0].headers["Host"] == owner.netloc.decode()
+    assert requests[1].url == "https://api.example.com/user/1/wheel"
+    assert (
+        requests[2].url
+        == f"https://api.example.com/user/1/wheel/{wheel_id}/registration"
+    )